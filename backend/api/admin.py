@@ -1,6 +1,11 @@
 from django.contrib import admin
-from .models import Document, Quiz
+from .models import Document, Quiz, CacheStats
 
 # Register your models here.
 admin.site.register(Document)
 admin.site.register(Quiz)
+
+
+@admin.register(CacheStats)
+class CacheStatsAdmin(admin.ModelAdmin):
+    list_display = ('name', 'hits', 'misses', 'hit_rate', 'updated_at')
@@ -1,6 +1,12 @@
+from pathlib import Path
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class ApiConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "api"
+
+    def ready(self):
+        # Uploads are streamed into the spool directory, so it has to exist before the first request
+        Path(settings.INGESTION_SPOOL_DIR).mkdir(parents=True, exist_ok=True)
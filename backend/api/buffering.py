@@ -0,0 +1,51 @@
+import atexit
+import threading
+from django.conf import settings
+from django.db import connection
+
+
+class BufferedWriter:
+    """
+    Per-process buffer of records written in batches, so frequent small events don't each cost a
+    write. `write(records)` is called with the buffered records once the batch size (setting
+    `batch_size_setting`) is reached, `flush_seconds_setting` seconds after the first of them,
+    whichever is sooner, and when the process exits. It returns the number of records written.
+    """
+
+    def __init__(self, write, batch_size_setting, flush_seconds_setting):
+        self._write = write
+        self._batch_size_setting = batch_size_setting
+        self._flush_seconds_setting = flush_seconds_setting
+        self._pending = []
+        self._lock = threading.Lock()
+        self._timer = None
+        # Records still buffered when the process exits
+        atexit.register(self.flush)
+
+    def add(self, record):
+        with self._lock:
+            self._pending.append(record)
+            full = len(self._pending) >= getattr(settings, self._batch_size_setting)
+            if not full and self._timer is None:
+                self._timer = threading.Timer(getattr(settings, self._flush_seconds_setting), self._flush_on_timer)
+                self._timer.daemon = True
+                self._timer.start()
+        if full:
+            self.flush()
+
+    def _flush_on_timer(self):
+        try:
+            self.flush()
+        finally:
+            connection.close()
+
+    def flush(self):
+        """Write the buffered records now; returns the number written"""
+        with self._lock:
+            records, self._pending = self._pending, []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not records:
+            return 0
+        return self._write(records)
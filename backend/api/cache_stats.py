@@ -0,0 +1,37 @@
+import logging
+from collections import Counter
+from django.db import DatabaseError
+
+from .buffering import BufferedWriter
+from .models import CacheStats
+
+logger = logging.getLogger(__name__)
+
+
+def record_cache_lookup(name, hit):
+    """
+    Count a hit or miss of a cache. Counts are kept per process and added to the CacheStats rows
+    once CACHE_STATS_BATCH_SIZE lookups are waiting, or CACHE_STATS_FLUSH_SECONDS after the first
+    of them, so lookups don't all update the same row.
+    """
+    _lookups.add((name, hit))
+
+
+def _write_lookups(lookups):
+    counts = Counter(lookups)
+    try:
+        for name in {name for name, _ in lookups}:
+            CacheStats.add(name, counts[(name, True)], counts[(name, False)])
+    except DatabaseError as e:
+        # Only the reporting misses these lookups
+        logger.error(f"Failed to write {len(lookups)} cache lookups: {e}")
+        return 0
+    return len(lookups)
+
+
+_lookups = BufferedWriter(_write_lookups, 'CACHE_STATS_BATCH_SIZE', 'CACHE_STATS_FLUSH_SECONDS')
+
+
+def flush_cache_stats():
+    """Add the buffered counts to their CacheStats rows, one UPDATE per cache. Returns the lookups written."""
+    return _lookups.flush()
@@ -0,0 +1,131 @@
+import re
+import hashlib
+from django.conf import settings
+from django.db import transaction
+
+from .models import DocumentChunk
+from .compression import decompress_text
+from .search import index_document
+from .retrieval import term_counts
+from .tokens import count_tokens
+
+# Page separators produced by the extractor: form feeds, or the markers Azure Document Intelligence
+# emits in markdown output
+PAGE_BREAK_RE = re.compile(r'\f|<!--\s*PageBreak\s*-->')
+PARAGRAPH_BREAK_RE = re.compile(r'\n\s*\n')
+
+
+def _page_spans(text):
+    """Yield (start, end, page_number) for each page of the extracted text"""
+    start = 0
+    page_number = 1
+    for match in PAGE_BREAK_RE.finditer(text):
+        yield start, match.end(), page_number
+        start = match.end()
+        page_number += 1
+    if start < len(text):
+        yield start, len(text), page_number
+
+
+def _split_span(text, start, end, target_chars):
+    """Split text[start:end] into pieces of roughly target_chars, preferring paragraph boundaries"""
+    pieces = []
+    piece_start = start
+    while end - piece_start > target_chars:
+        window_end = piece_start + target_chars
+        # Cut at the last paragraph break inside the window, otherwise at the last whitespace
+        breaks = [m.end() for m in PARAGRAPH_BREAK_RE.finditer(text, piece_start + target_chars // 2, window_end)]
+        cut = breaks[-1] if breaks else text.rfind(' ', piece_start + target_chars // 2, window_end) + 1
+        if cut <= piece_start:
+            cut = window_end
+        pieces.append((piece_start, cut))
+        piece_start = cut
+    if piece_start < end:
+        if pieces and end - piece_start < target_chars // 4:
+            # Fold a short tail into the previous piece instead of leaving a tiny chunk
+            pieces[-1] = (pieces[-1][0], end)
+        else:
+            pieces.append((piece_start, end))
+    return pieces
+
+
+def chunk_content_hash(text):
+    """Hash of a chunk's text that ignores whitespace differences, so re-extraction noise does not count as a change"""
+    return hashlib.sha256(' '.join(text.split()).encode('utf-8')).hexdigest()
+
+
+def split_into_chunks(text, target_chars=None):
+    """
+    Split extracted text into ordered chunks that never cross a page boundary.
+    Each chunk is a dict with start_offset/end_offset into `text`, page_number, text, content_hash
+    term_counts (for the retrieval index) and token_count;
+    concatenating the chunks reproduces `text` exactly.
+    """
+    target_chars = target_chars or settings.DOCUMENT_CHUNK_TARGET_CHARS
+    chunks = []
+    for page_start, page_end, page_number in _page_spans(text):
+        for start, end in _split_span(text, page_start, page_end, target_chars):
+            chunks.append({
+                'index': len(chunks),
+                'start_offset': start,
+                'end_offset': end,
+                'page_number': page_number,
+                'text': text[start:end],
+                'content_hash': chunk_content_hash(text[start:end]),
+                'term_counts': term_counts(text[start:end]),
+                'token_count': count_tokens(text[start:end]),
+            })
+    return chunks
+
+
+def create_document_chunks(document, text=None):
+    """(Re)build the chunk rows for a document from its extracted text"""
+    text = document.extracted_text if text is None else text
+    chunks = [DocumentChunk(document=document, **chunk) for chunk in split_into_chunks(text)]
+    with transaction.atomic():
+        DocumentChunk.objects.filter(document=document).delete()
+        DocumentChunk.objects.bulk_create(chunks)
+    index_document(document)
+    return chunks
+
+
+def document_text_length(document):
+    """Length of the document's extracted text, read from the last chunk"""
+    last_chunk = DocumentChunk.objects.filter(document=document).order_by('-index').values('end_offset').first()
+    return last_chunk['end_offset'] if last_chunk else 0
+
+
+def read_document_range(document, start, end):
+    """Return text[start:end] of a document, loading only the chunks that overlap the range"""
+    chunks = DocumentChunk.objects.filter(
+        document=document,
+        start_offset__lt=end,
+        end_offset__gt=start,
+    ).order_by('index').values_list('start_offset', 'text')
+
+    parts = []
+    for chunk_start, chunk_text in chunks:
+        parts.append(decompress_text(chunk_text)[max(start - chunk_start, 0):max(end - chunk_start, 0)])
+    return ''.join(parts)
+
+
+def read_document_page(document, page_number):
+    """Return the text of one page, or None if the document has no such page"""
+    chunks = DocumentChunk.objects.filter(
+        document=document, page_number=page_number
+    ).order_by('index').values_list('text', flat=True)
+    if not chunks:
+        return None
+    return ''.join(decompress_text(text) for text in chunks)
+
+
+def load_document_text(document):
+    """
+    Full extracted text of a document, assembled from its chunks.
+    Documents ingested before chunking existed fall back to the extracted_text column.
+    """
+    chunks = list(DocumentChunk.objects.filter(document=document).order_by('index').values_list('text', flat=True))
+    if chunks:
+        return ''.join(decompress_text(text) for text in chunks)
+    stored = type(document).objects.filter(pk=document.pk).values_list('extracted_text', flat=True).first()
+    return decompress_text(stored) or ''
@@ -0,0 +1,144 @@
+import re
+import zlib
+import struct
+import threading
+from collections import Counter
+from django.conf import settings
+
+# Stored format of CompressedTextField values:
+#   <utf-8 text>                        uncompressed (short values and rows written before compression)
+#   \x00 r <utf-8 text>                 uncompressed text that itself starts with a NUL byte
+#   \x00 z <zlib stream>                zlib without a dictionary
+#   \x00 d <dictionary id:u32> <zlib>   zlib with a preset dictionary from CompressionDictionary
+# PostgreSQL text can never contain NUL, so a leading NUL unambiguously marks a header.
+HEADER_MARKER = b'\x00'
+FORMAT_RAW = b'r'
+FORMAT_ZLIB = b'z'
+FORMAT_ZLIB_DICT = b'd'
+
+ZLIB_MAX_DICTIONARY_SIZE = 32 * 1024
+_WORD_RE = re.compile(r"[A-Za-z][A-Za-z'\-]+")
+
+_dictionaries = {}
+_active_dictionary = None
+_dictionary_lock = threading.Lock()
+
+
+class TextCompressionError(Exception):
+    pass
+
+
+def _load_dictionary(dictionary_id):
+    """Return the bytes of a stored dictionary; dictionaries are immutable so they are cached forever"""
+    data = _dictionaries.get(dictionary_id)
+    if data is None:
+        from .models import CompressionDictionary
+        row = CompressionDictionary.objects.filter(pk=dictionary_id).values_list('data', flat=True).first()
+        if row is None:
+            raise TextCompressionError(f"Compression dictionary {dictionary_id} does not exist")
+        data = _dictionaries[dictionary_id] = bytes(row)
+    return data
+
+
+def get_active_dictionary():
+    """
+    Return (id, bytes) of the dictionary used for new writes, or None.
+    Looked up once per process; a newly trained dictionary is picked up after a restart.
+    """
+    global _active_dictionary
+    if _active_dictionary is None:
+        with _dictionary_lock:
+            if _active_dictionary is None:
+                from .models import CompressionDictionary
+                row = CompressionDictionary.objects.filter(is_active=True).order_by('-created_at').values_list('id', 'data').first()
+                if row is not None:
+                    _dictionaries[row[0]] = bytes(row[1])
+                _active_dictionary = (row[0], bytes(row[1])) if row else ()
+    return _active_dictionary or None
+
+
+def reset_dictionary_cache():
+    global _active_dictionary
+    _active_dictionary = None
+    _dictionaries.clear()
+
+
+def compress_text(text, dictionary=None, use_dictionary=True):
+    """
+    Encode text for storage in a CompressedTextField.
+    Values too short to benefit, or that do not shrink, are stored as plain UTF-8.
+    """
+    raw = text.encode('utf-8')
+    plain = HEADER_MARKER + FORMAT_RAW + raw if raw.startswith(HEADER_MARKER) else raw
+    if len(raw) < settings.TEXT_COMPRESSION_MIN_BYTES:
+        return plain
+
+    if dictionary is None and use_dictionary:
+        dictionary = get_active_dictionary()
+
+    if dictionary:
+        dictionary_id, dictionary_data = dictionary
+        compressor = zlib.compressobj(settings.TEXT_COMPRESSION_LEVEL, zdict=dictionary_data)
+        encoded = HEADER_MARKER + FORMAT_ZLIB_DICT + struct.pack('>I', dictionary_id) + compressor.compress(raw) + compressor.flush()
+    else:
+        encoded = HEADER_MARKER + FORMAT_ZLIB + zlib.compress(raw, settings.TEXT_COMPRESSION_LEVEL)
+
+    return encoded if len(encoded) < len(plain) else plain
+
+
+def decompress_text(value):
+    """Decode a stored CompressedTextField value (bytes, memoryview, or legacy str) back to text"""
+    if value is None or isinstance(value, str):
+        return value
+
+    value = bytes(value)
+    if not value.startswith(HEADER_MARKER):
+        return value.decode('utf-8')
+
+    format_code = value[1:2]
+    if format_code == FORMAT_RAW:
+        return value[2:].decode('utf-8')
+    if format_code == FORMAT_ZLIB:
+        return zlib.decompress(value[2:]).decode('utf-8')
+    if format_code == FORMAT_ZLIB_DICT:
+        dictionary_id, = struct.unpack('>I', value[2:6])
+        decompressor = zlib.decompressobj(zdict=_load_dictionary(dictionary_id))
+        return (decompressor.decompress(value[6:]) + decompressor.flush()).decode('utf-8')
+    raise TextCompressionError(f"Unknown compressed text format {format_code!r}")
+
+
+def is_compressed(value):
+    """True if a stored value is already in a compressed format"""
+    if value is None or isinstance(value, str):
+        return False
+    return bytes(value[:2]) in (HEADER_MARKER + FORMAT_ZLIB, HEADER_MARKER + FORMAT_ZLIB_DICT)
+
+
+def train_dictionary(samples, size=ZLIB_MAX_DICTIONARY_SIZE):
+    """
+    Build a zlib preset dictionary from sample texts.
+    Picks the word n-grams that save the most bytes (length x frequency); zlib favours matches
+    near the end of the dictionary, so the most valuable strings are placed last.
+    """
+    counts = Counter()
+    for text in samples:
+        words = _WORD_RE.findall(text)
+        for n in (1, 2, 3):
+            for i in range(len(words) - n + 1):
+                counts[' '.join(words[i:i + n])] += 1
+
+    scored = sorted(
+        ((len(phrase) * count, phrase) for phrase, count in counts.items() if count > 1 and len(phrase) > 3),
+        reverse=True,
+    )
+
+    chosen = []
+    total = 0
+    for _, phrase in scored:
+        encoded = (phrase + ' ').encode('utf-8')
+        if total + len(encoded) > size:
+            break
+        chosen.append(encoded)
+        total += len(encoded)
+
+    return b''.join(reversed(chosen))
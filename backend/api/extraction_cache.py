@@ -0,0 +1,182 @@
+import re
+import hashlib
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import Q, F, Sum
+from django.utils import timezone
+
+from .models import ExtractionCacheEntry
+from .cache_stats import record_cache_lookup
+
+logger = logging.getLogger(__name__)
+
+CACHE_STATS_NAME = 'extraction'
+SIMHASH_BITS = 64
+SIMHASH_BAND_BITS = 16
+# Texts whose fingerprints differ in at most this many bits are compared as alias candidates.
+# With four 16-bit bands, any pair within 3 bits shares at least one band exactly.
+NEAR_DUPLICATE_MAX_DISTANCE = 3
+
+_WORD_RE = re.compile(r'\w+')
+
+
+def _to_signed_64(value):
+    """Map an unsigned 64-bit int onto the signed range of a BIGINT column"""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def _to_unsigned_64(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+def compute_simhash(text):
+    """
+    Compute a 64-bit SimHash over word trigrams of `text`.
+    Returned as a signed integer so it fits a BigIntegerField.
+    """
+    words = _WORD_RE.findall(text.lower())
+    shingles = [' '.join(words[i:i + 3]) for i in range(max(len(words) - 2, 1))]
+
+    weights = [0] * SIMHASH_BITS
+    for shingle in shingles:
+        digest = int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'big')
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += 1 if digest >> bit & 1 else -1
+
+    fingerprint = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            fingerprint |= 1 << bit
+    return _to_signed_64(fingerprint)
+
+
+def _simhash_bands(simhash):
+    unsigned = _to_unsigned_64(simhash)
+    mask = (1 << SIMHASH_BAND_BITS) - 1
+    return [(unsigned >> (i * SIMHASH_BAND_BITS)) & mask for i in range(SIMHASH_BITS // SIMHASH_BAND_BITS)]
+
+
+def hamming_distance(a, b):
+    return bin(_to_unsigned_64(a) ^ _to_unsigned_64(b)).count('1')
+
+
+def _normalized(text):
+    return ' '.join(text.split())
+
+
+def find_near_duplicate(simhash, text):
+    """
+    Return the canonical cache entry holding the same text as `text` (up to whitespace), if any.
+    SimHash only narrows down the candidates: texts a few edited words apart fingerprint within
+    NEAR_DUPLICATE_MAX_DISTANCE bits too, and must keep their own entry.
+    """
+    bands = _simhash_bands(simhash)
+    candidates = ExtractionCacheEntry.objects.filter(canonical__isnull=True).filter(
+        Q(simhash_band0=bands[0]) | Q(simhash_band1=bands[1]) |
+        Q(simhash_band2=bands[2]) | Q(simhash_band3=bands[3])
+    ).only('id', 'simhash')
+
+    close = []
+    for candidate in candidates:
+        distance = hamming_distance(simhash, candidate.simhash)
+        if distance <= NEAR_DUPLICATE_MAX_DISTANCE:
+            close.append((distance, candidate.id))
+    if not close:
+        return None
+
+    normalized = _normalized(text)
+    entries = ExtractionCacheEntry.objects.in_bulk([entry_id for _, entry_id in close])
+    for _, entry_id in sorted(close):
+        if _normalized(entries[entry_id].extracted_text) == normalized:
+            return entries[entry_id]
+    return None
+
+
+def lookup_extraction_cache(content_sha256):
+    """
+    Look up cached extraction results for an uploaded file.
+    Returns (extracted_text, summary) or None, and records the hit or miss.
+    """
+    if not content_sha256 or not settings.EXTRACTION_CACHE_ENABLED:
+        return None
+
+    entry = ExtractionCacheEntry.objects.select_related('canonical').filter(content_sha256=content_sha256).first()
+    record_cache_lookup(CACHE_STATS_NAME, hit=entry is not None)
+    if entry is None:
+        return None
+
+    now = timezone.now()
+    touched_ids = [entry.id] + ([entry.canonical_id] if entry.canonical_id else [])
+    ExtractionCacheEntry.objects.filter(id__in=touched_ids).update(hit_count=F('hit_count') + 1, last_used_at=now)
+
+    source = entry.canonical or entry
+    logger.info(f"Extraction cache hit for {content_sha256[:12]}")
+    return source.extracted_text, source.summary
+
+
+def store_extraction_result(content_sha256, extracted_text, summary):
+    """
+    Cache the extraction results for a file hash.
+    If an existing entry holds the same text (e.g. the same PDF re-saved), only an alias pointing at it is stored.
+    """
+    if not content_sha256 or not settings.EXTRACTION_CACHE_ENABLED:
+        return None
+
+    simhash = compute_simhash(extracted_text)
+    bands = _simhash_bands(simhash)
+    canonical = find_near_duplicate(simhash, extracted_text)
+
+    fields = {
+        'simhash': simhash,
+        'simhash_band0': bands[0],
+        'simhash_band1': bands[1],
+        'simhash_band2': bands[2],
+        'simhash_band3': bands[3],
+    }
+    if canonical:
+        logger.info(f"Extraction result for {content_sha256[:12]} has the same text as cache entry {canonical.id}")
+        fields['canonical'] = canonical
+    else:
+        fields.update(
+            extracted_text=extracted_text,
+            summary=summary,
+            size=len(extracted_text.encode('utf-8')) + len((summary or '').encode('utf-8')),
+        )
+
+    try:
+        entry, _ = ExtractionCacheEntry.objects.get_or_create(content_sha256=content_sha256, defaults=fields)
+    except IntegrityError:
+        # Another worker cached the same file concurrently
+        entry = ExtractionCacheEntry.objects.get(content_sha256=content_sha256)
+    return entry
+
+
+def evict_extraction_cache(max_age=None, max_bytes=None):
+    """
+    Evict cache entries not used within `max_age`, then least recently used entries
+    until the cached text fits in `max_bytes`. Aliases go with their canonical entry.
+    Returns the number of cache rows removed.
+    """
+    if max_age is None:
+        max_age = timedelta(days=settings.EXTRACTION_CACHE_MAX_AGE_DAYS)
+    if max_bytes is None:
+        max_bytes = settings.EXTRACTION_CACHE_MAX_BYTES
+
+    canonical_entries = ExtractionCacheEntry.objects.filter(canonical__isnull=True)
+    expired_count, _ = canonical_entries.filter(last_used_at__lt=timezone.now() - max_age).delete()
+
+    removed = 0
+    total_size = canonical_entries.aggregate(total=Sum('size'))['total'] or 0
+    if total_size > max_bytes:
+        evict_ids = []
+        for entry_id, size in canonical_entries.order_by('last_used_at').values_list('id', 'size').iterator():
+            if total_size <= max_bytes:
+                break
+            evict_ids.append(entry_id)
+            total_size -= size
+        removed, _ = ExtractionCacheEntry.objects.filter(id__in=evict_ids).delete()
+
+    logger.info(f"Extraction cache eviction removed {expired_count} expired and {removed} over-size rows")
+    return expired_count + removed
@@ -0,0 +1,76 @@
+from django.apps import apps
+from django.db import models
+from django.db.models.query_utils import DeferredAttribute
+
+from .compression import compress_text, decompress_text
+
+
+class CompressedTextDescriptor(DeferredAttribute):
+    """
+    Keeps the stored (compressed) bytes on the instance and only decompresses on first access.
+    Being a data descriptor, it is consulted even when the raw value sits in instance.__dict__.
+    """
+
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        value = super().__get__(instance, cls)
+        if isinstance(value, (bytes, memoryview)):
+            value = decompress_text(value)
+            instance.__dict__[self.field.attname] = value
+        return value
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.field.attname] = value
+
+
+class CompressedTextField(models.TextField):
+    """
+    Text field stored compressed in a binary column (bytea on PostgreSQL).
+    Values are compressed on save (see api/compression.py for the format) and decompressed
+    lazily the first time the attribute is read. values()/values_list() return the stored
+    bytes; pass them through api.compression.decompress_text.
+    Rows written as plain text before the column was converted are read transparently;
+    compress_text_columns rewrites them in batches.
+    """
+    descriptor_class = CompressedTextDescriptor
+
+    def get_internal_type(self):
+        return "BinaryField"
+
+    def from_db_value(self, value, expression, connection):
+        if isinstance(value, memoryview):
+            return bytes(value)
+        return value
+
+    def to_python(self, value):
+        if isinstance(value, (bytes, memoryview)):
+            return decompress_text(value)
+        return super().to_python(value)
+
+    def pre_save(self, model_instance, add):
+        # Values loaded from the database and never read are saved back without a decode/encode round trip
+        value = model_instance.__dict__.get(self.attname)
+        if isinstance(value, (bytes, memoryview)):
+            return value
+        return super().pre_save(model_instance, add)
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if value is None:
+            return None
+        if not isinstance(value, (bytes, memoryview)):
+            value = compress_text(self.to_python(value))
+        return connection.Database.Binary(value)
+
+    def value_to_string(self, obj):
+        return self.value_from_object(obj)
+
+
+def compressed_fields():
+    """All (model, field) pairs in the project that use CompressedTextField"""
+    return [
+        (model, field)
+        for model in apps.get_models()
+        for field in model._meta.concrete_fields
+        if isinstance(field, CompressedTextField)
+    ]
@@ -0,0 +1,909 @@
+import json
+import math
+import hashlib
+import uuid
+import logging
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextvars import copy_context
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import PermissionDenied
+
+from utils.quiz_generator import generate_quizzes_from_text, QuizGenerationError
+from utils.flashcard_generator import generate_flashcards_from_text, FlashcardGenerationError
+from utils.mnemonic_generator import generate_mnemonics_from_text, MnemonicGenerationError
+from utils.adaptive_quiz_generator import generate_adaptive_quizzes, save_adaptive_quizzes
+from .models import Document, DocumentVersion, Quiz, Flashcard, Mnemonic, GenerationJob, UserTokenUsage
+from .jobs import mark_job_done, mark_job_failed
+from .llm_cache import cached_llm_call
+from .study_pack import generate_study_pack_from_text, StudyPackGenerationError
+from .llm_gateway import llm_call, LLMUnavailable
+from .usage_ledger import usage_feature
+from .search import index_items, refresh_search_vectors
+from .similarity import SimilarityIndex, item_signature, remove_new_duplicates
+from .pools import POOLED_KINDS, pool_target, pooled_count, take_pooled_items, pool_similarity_index, add_to_pool
+from .chunking import split_into_chunks
+from .retrieval import select_generation_context, split_generation_context, estimate_context_tokens, DEFAULT_CONTEXT_ITEMS
+from .tokens import estimate_call_tokens, estimate_generation_tokens, estimate_study_pack_tokens, check_token_budget, reserve_tokens
+from .serializers import QuizItemSerializer, FlashcardItemSerializer, MnemonicItemSerializer
+
+logger = logging.getLogger(__name__)
+
+
+def _quiz_from_item(user, document, validated_item_data, difficulty):
+    # Handle explanation field - convert JSON to string if needed
+    explanation_data = validated_item_data.get("explanation")
+    explanation_str = explanation_data
+    if isinstance(explanation_data, dict):
+        # Convert JSON object to string for storage in TextField
+        explanation_str = json.dumps(explanation_data)
+
+    return Quiz(
+        user=user,
+        document=document,
+        question=validated_item_data["question"],
+        option1=validated_item_data["options"][0],
+        option2=validated_item_data["options"][1],
+        option3=validated_item_data["options"][2],
+        option4=validated_item_data["options"][3],
+        correct_option_index=validated_item_data["correct_option_index"],
+        hint=validated_item_data.get("hint"),
+        explanation=explanation_str,
+        keywords=validated_item_data.get("keywords", []),
+        difficulty=difficulty
+    )
+
+
+def _flashcard_from_item(user, document, validated_item_data, difficulty):
+    return Flashcard(
+        user=user,
+        document=document,
+        front=validated_item_data["front"],
+        back=validated_item_data["back"],
+        hint=validated_item_data.get("hint"),
+        keywords=validated_item_data.get("keywords", []),
+        difficulty=difficulty
+    )
+
+
+def _mnemonic_from_item(user, document, validated_item_data):
+    return Mnemonic(
+        user=user,
+        document=document,
+        mnemonic=validated_item_data["mnemonic"],
+        mnemonic_type=validated_item_data["mnemonic_type"],
+        mnemonic_explanation=validated_item_data["mnemonic_explanation"],
+        topic=validated_item_data["topic"]
+    )
+
+
+def _validated_items(kind, serializer_class, items, document, errors):
+    """Validated data of the valid generated items; the problems with invalid ones are appended to `errors`"""
+    valid = []
+    for item in items:
+        item_serializer = serializer_class(data=item)
+        if item_serializer.is_valid():
+            valid.append(item_serializer.validated_data)
+        else:
+            error_detail = json.dumps(item_serializer.errors)
+            logger.warning(f"Invalid {kind} item structure received from AI for doc {document.id}. Errors: {error_detail}. Item: {str(item)[:200]}...")
+            errors.append(f"Invalid {kind} data received: {error_detail}")
+    return valid
+
+
+def _bulk_save_items(model, items, index, limit=None):
+    """
+    Insert unsaved items of one model with a single query in one transaction, skipping near
+    duplicates of the document's items and of each other and stopping after `limit` items.
+    Returns the saved items; if the insert fails, nothing is saved and the error is raised.
+    """
+    kept = []
+    for item in items:
+        if limit is not None and len(kept) >= limit:
+            break
+        signature = item_signature(item)
+        duplicate_of = index.find_duplicate(signature)
+        if duplicate_of is not None:
+            index.duplicates_dropped += 1
+            logger.info(f"Dropped generated {model._meta.verbose_name} for doc {item.document_id}: near duplicate of {duplicate_of}")
+            continue
+        item.minhash = signature
+        index.add(f'new:{len(kept)}', signature)
+        kept.append(item)
+    try:
+        with transaction.atomic():
+            saved = model.objects.bulk_create(kept)
+    finally:
+        # Placeholders stood in for the batch's own items; saved ones are indexed by id below
+        for position in range(len(kept)):
+            index.signatures.pop(f'new:{position}', None)
+    for item in saved:
+        index.add(item.pk, item.minhash)
+    index_items(saved)
+    return saved
+
+
+def _persist_items(kind, model, serializer_class, build, describe, document, items, index, limit):
+    """
+    Persistence stage shared by the generators: validate every generated item, build the rows and
+    bulk-insert the ones kept (see _bulk_save_items). A failed insert saves none of the batch and
+    reports each of its items. Returns (saved items, list of error messages).
+    """
+    errors = []
+    rows = [build(validated_item_data) for validated_item_data in _validated_items(kind, serializer_class, items, document, errors)]
+    try:
+        saved = _bulk_save_items(model, rows, index, limit)
+    except DatabaseError as e:
+        logger.error(f"Failed to save {len(rows)} validated {kind} items for doc {document.id}. Error: {e}")
+        errors += [f"Error saving {kind}: {describe(row)}" for row in rows]
+        saved = []
+    return saved, errors
+
+
+def save_quiz_items(user, document, items, difficulty, index=None, limit=None):
+    """
+    Validate generated quiz items and save the valid ones, skipping near duplicates of the
+    document's existing quizzes and stopping after `limit` saved items.
+    Returns (saved quizzes, list of error messages).
+    """
+    return _persist_items(
+        'quiz', Quiz, QuizItemSerializer,
+        lambda validated_item_data: _quiz_from_item(user, document, validated_item_data, difficulty),
+        lambda quiz: quiz.question,
+        document, items, index or SimilarityIndex(Quiz, document.id), limit,
+    )
+
+
+def save_flashcard_items(user, document, items, difficulty, index=None, limit=None):
+    """
+    Validate generated flashcard items and save the valid ones, skipping near duplicates of the
+    document's existing flashcards and stopping after `limit` saved items.
+    Returns (saved flashcards, list of error messages).
+    """
+    return _persist_items(
+        'flashcard', Flashcard, FlashcardItemSerializer,
+        lambda validated_item_data: _flashcard_from_item(user, document, validated_item_data, difficulty),
+        lambda flashcard: f"{flashcard.front[:50]}...",
+        document, items, index or SimilarityIndex(Flashcard, document.id), limit,
+    )
+
+
+def save_mnemonic_items(user, document, items, index=None, limit=None):
+    """
+    Validate generated mnemonic items and save the valid ones, skipping near duplicates of the
+    document's existing mnemonics and stopping after `limit` saved items.
+    Returns (saved mnemonics, list of error messages).
+    """
+    return _persist_items(
+        'mnemonic', Mnemonic, MnemonicItemSerializer,
+        lambda validated_item_data: _mnemonic_from_item(user, document, validated_item_data),
+        lambda mnemonic: mnemonic.topic,
+        document, items, index or SimilarityIndex(Mnemonic, document.id), limit,
+    )
+
+
+# Request parameter holding the number of items asked for
+COUNT_PARAMS = {
+    GenerationJob.Kind.QUIZ: 'number_of_quizzes',
+    GenerationJob.Kind.FLASHCARD: 'number_of_flashcards',
+}
+
+
+def _study_pack_counts(params):
+    """Items of each kind a study pack request asks for (mnemonics: one per topic if topics are given)"""
+    return {
+        GenerationJob.Kind.QUIZ: params['number_of_quizzes'],
+        GenerationJob.Kind.FLASHCARD: params['number_of_flashcards'],
+        GenerationJob.Kind.MNEMONIC: len(params.get('topics') or []) or params['number_of_mnemonics'],
+    }
+
+
+def _requested_items(kind, params):
+    """Number of items a generation request asks for (mnemonics: one per topic; study packs: all kinds)"""
+    if kind == GenerationJob.Kind.STUDY_PACK:
+        return sum(_study_pack_counts(params).values())
+    if kind in COUNT_PARAMS:
+        return params[COUNT_PARAMS[kind]]
+    return len(params.get('topics') or []) or DEFAULT_CONTEXT_ITEMS
+
+
+def generation_part_counts(kind, number_of_items, topics=None):
+    """
+    Items asked of each generator call of a request. Larger requests fan out: a small lead call,
+    so the first items are saved (and streamed) after one short round trip, then calls of at most
+    GENERATION_FANOUT_ITEMS items over disjoint sections of the context, run concurrently.
+    Fanned-out quiz and flashcard calls each ask for GENERATION_FANOUT_SPARE_ITEMS extra items, so
+    duplicates across calls can be dropped and the merged result still trimmed to `number_of_items`.
+    Mnemonics are split by topic (without topics they can't be divided and take one call).
+    """
+    lead_items = settings.GENERATION_STREAM_LEAD_ITEMS
+    if (kind == GenerationJob.Kind.MNEMONIC and not topics) or number_of_items < 2 * lead_items:
+        return [number_of_items]
+
+    remaining = number_of_items - lead_items
+    calls = math.ceil(remaining / settings.GENERATION_FANOUT_ITEMS)
+    counts = [lead_items] + [remaining // calls + (1 if i < remaining % calls else 0) for i in range(calls)]
+    if kind != GenerationJob.Kind.MNEMONIC:
+        counts = [count + settings.GENERATION_FANOUT_SPARE_ITEMS for count in counts]
+    return counts
+
+
+def _context_query(kind, params, document):
+    """Text the generation context is picked by: requested topics for mnemonics, otherwise the summary"""
+    if kind == GenerationJob.Kind.MNEMONIC:
+        query = ' '.join((params.get('topics') or []) + [params.get('instructions') or ''])
+        if query.strip():
+            return query
+    return document.summary
+
+
+def _generation_estimate(document, kind, number_of_items, topics=None):
+    part_counts = generation_part_counts(kind, number_of_items, topics)
+    return estimate_generation_tokens(
+        kind, estimate_context_tokens(document, number_of_items), sum(part_counts), len(part_counts)
+    )
+
+
+def _check_generation_budget(user, document, kind, number_of_items, topics=None):
+    return check_token_budget(user, _generation_estimate(document, kind, number_of_items, topics))
+
+
+def _refill_budget(user):
+    """
+    Tokens pool refills of the user's documents may spend: their unreserved tokens beyond the
+    GENERATION_POOL_KEPT_BUDGET_SHARE of their limit that is kept for their own requests
+    """
+    usage, _ = UserTokenUsage.objects.get_or_create(user=user)
+    return usage.unreserved_tokens() - math.ceil(usage.max_tokens * settings.GENERATION_POOL_KEPT_BUDGET_SHARE)
+
+
+def _affordable_items(document, kind, number_of_items, budget):
+    """The most of `number_of_items` items whose estimated generation cost fits in `budget` tokens"""
+    low, high = 0, number_of_items
+    while low < high:
+        middle = (low + high + 1) // 2
+        if _generation_estimate(document, kind, middle)['total_tokens'] <= budget:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def _repeated_request(user, document, kind, params):
+    """The job of an identical request the user made within GENERATION_REPEAT_WINDOW_SECONDS that hasn't failed, or None"""
+    since = timezone.now() - timedelta(seconds=settings.GENERATION_REPEAT_WINDOW_SECONDS)
+    return GenerationJob.objects.filter(
+        user=user, document=document, kind=kind, is_refill=False, params=params, created_at__gte=since,
+    ).exclude(status=GenerationJob.Status.FAILED).order_by('-created_at').first()
+
+
+def enqueue_generation_job(user, document, kind, params):
+    """
+    Queue a generation request for the generation worker.
+    A repeat of a request made moments ago (a double-click or a retry) returns the earlier job.
+    Quiz and flashcard requests are served from the document's pool first (see api/pools.py): pooled
+    items are saved right away, and a request the pool covers completes without queueing any work.
+    The estimated cost of the rest is checked against the user's remaining tokens first, so requests
+    that cannot be afforded are rejected (PermissionDenied) without queueing anything.
+    """
+    repeated = _repeated_request(user, document, kind, params)
+    if repeated is not None:
+        logger.info(f"Returning {kind} generation job {repeated.id} for a repeated request on document {document.id}")
+        return repeated
+
+    number_of_items = _requested_items(kind, params)
+    # use_cache=false asks for freshly generated items, so it skips the pool as well
+    use_pool = kind in POOLED_KINDS and params.get('use_cache', True)
+    pooled = min(pooled_count(document, kind, params['difficulty']), number_of_items) if use_pool else 0
+    if kind == GenerationJob.Kind.STUDY_PACK:
+        check_token_budget(user, estimate_study_pack_tokens(
+            estimate_context_tokens(document, number_of_items), _study_pack_counts(params)
+        ))
+    elif number_of_items > pooled:
+        _check_generation_budget(user, document, kind, number_of_items - pooled, params.get('topics'))
+
+    # Not visible to the worker until the pooled items are saved on it
+    with transaction.atomic():
+        job = GenerationJob.objects.create(user=user, document=document, kind=kind, params=params)
+        if pooled:
+            items = take_pooled_items(document, kind, params['difficulty'], number_of_items)
+            saved, pool_errors = _save_items(job, document, items, SimilarityIndex(GENERATED_MODELS[kind], document.id), limit=number_of_items)
+            job.item_ids = [item.pk for item in saved]
+            job.save(update_fields=['item_ids'])
+
+    if use_pool:
+        enqueue_pool_refill(document, kind, params['difficulty'])
+    if pooled and len(job.item_ids) >= number_of_items:
+        result = _job_result(job, document, number_of_items, 0, len(job.item_ids), [])
+        mark_job_done(job, result=_with_item_errors(result, pool_errors))
+        logger.info(f"Served {kind} generation job {job.id} for document {document.id} from the pool")
+    else:
+        logger.info(f"Queued {kind} generation job {job.id} for document {document.id} ({len(job.item_ids)} items from the pool)")
+    return job
+
+
+def enqueue_pool_refill(document, kind, difficulty):
+    """
+    Queue a refill of a document's pool if it is at least GENERATION_POOL_MIN_REFILL items short of
+    its plan tier target and no refill of the document is pending. Refills are billed to the owner,
+    so one is sized to their spare tokens (see _refill_budget) and isn't queued if that leaves it
+    under GENERATION_POOL_MIN_REFILL items. Returns the refill job, or None.
+    """
+    min_refill = max(settings.GENERATION_POOL_MIN_REFILL, 1)
+    shortfall = pool_target(document.user) - pooled_count(document, kind, difficulty)
+    if shortfall < min_refill:
+        return None
+    pending = GenerationJob.objects.filter(
+        document=document, is_refill=True, status__in=[GenerationJob.Status.QUEUED, GenerationJob.Status.RUNNING],
+    )
+    if pending.exists():
+        return None
+    size = _affordable_items(document, kind, shortfall, _refill_budget(document.user))
+    if size < min_refill:
+        logger.info(f"Not refilling the {kind} pool ({difficulty}) of document {document.id}: the owner has too few tokens to spare")
+        return None
+
+    params = {
+        'difficulty': difficulty,
+        COUNT_PARAMS[kind]: size,
+        # A cached response would repeat the items just served from the pool
+        'use_cache': False,
+    }
+    job = GenerationJob.objects.create(user=document.user, document=document, kind=kind, params=params, is_refill=True)
+    logger.info(f"Queued refill of the {kind} pool ({difficulty}, {size} items) of document {document.id}")
+    return job
+
+
+def prewarm_document_pools(document):
+    """
+    Queue a refill of the first pool that is filled before anything is requested
+    (GENERATION_POOL_PREWARM_DIFFICULTIES) and is short. Each finished refill prewarms the next.
+    """
+    for kind in POOLED_KINDS:
+        for difficulty in settings.GENERATION_POOL_PREWARM_DIFFICULTIES:
+            if enqueue_pool_refill(document, kind, difficulty) is not None:
+                return
+
+
+def enqueue_adaptive_quiz_job(user, document):
+    """
+    Queue adaptive quiz generation for a user's document, unless a queued one is already waiting:
+    the generator reads the answers when it runs, so one job covers every submission made before.
+    Returns the new job, or None if the request was coalesced into the waiting one.
+    """
+    try:
+        with transaction.atomic():
+            job = GenerationJob.objects.create(user=user, document=document, kind=GenerationJob.Kind.ADAPTIVE_QUIZ)
+    except IntegrityError:
+        # one_queued_adaptive_quiz_job: another submission queued it first
+        logger.info(f"Adaptive quiz generation for document {document.id} is already queued")
+        return None
+    logger.info(f"Queued adaptive quiz generation job {job.id} for document {document.id}")
+    return job
+
+
+# Generator calls for one part of a job: (job, context text, item count, offset of the part's first item)
+# -> (items, extra response fields). They don't touch the job's document, so they can run on any thread.
+# Responses go through the LLM response cache unless the request opted out with use_cache=false
+# or the call passes use_cache=False (top-ups, which must not get the cached response back).
+# `existing_items` (see _existing_items_digest) is part of the cache key, so a response is only
+# reused while the document has the same items, not once its own items have been saved.
+
+def _call_quiz_generator(job, text, count, offset, use_cache=True, existing_items=None):
+    difficulty = job.params['difficulty']
+    quiz_data = cached_llm_call(
+        'quiz', text, {'difficulty': difficulty, 'number_of_quizzes': count, 'existing_items': existing_items},
+        lambda: llm_call(
+            lambda: generate_quizzes_from_text(
+                text_content=text,
+                difficulty=difficulty,
+                number_of_quizzes=count,
+                user=job.user,  # Pass user for token tracking
+                retries=settings.LLM_GENERATOR_RETRIES
+            ),
+            estimated_tokens=estimate_call_tokens(job.kind, text, count), label='quiz',
+        ),
+        use_cache=use_cache and job.params.get('use_cache', True),
+    )
+    # Limit saving to the number requested, even if the AI returned more
+    return quiz_data.get("quizzes", [])[:count], {}
+
+
+def _call_flashcard_generator(job, text, count, offset, use_cache=True, existing_items=None):
+    difficulty = job.params['difficulty']
+    flashcard_data = cached_llm_call(
+        'flashcard', text, {'difficulty': difficulty, 'number_of_flashcards': count, 'existing_items': existing_items},
+        lambda: llm_call(
+            lambda: generate_flashcards_from_text(
+                text_content=text,
+                difficulty=difficulty,
+                number_of_flashcards=count,
+                user=job.user,
+                retries=settings.LLM_GENERATOR_RETRIES
+            ),
+            estimated_tokens=estimate_call_tokens(job.kind, text, count), label='flashcard',
+        ),
+        use_cache=use_cache and job.params.get('use_cache', True),
+    )
+    return flashcard_data.get("flashcards", [])[:count], {}
+
+
+def _call_mnemonic_generator(job, text, count, offset, use_cache=True, existing_items=None):
+    params = job.params
+    mnemonic_types = params.get('mnemonic_types') or None
+    topics = (params.get('topics') or [])[offset:offset + count] or None
+    instructions = params.get('instructions') or None
+    mnemonic_data = cached_llm_call(
+        'mnemonic', text,
+        {'mnemonic_types': mnemonic_types, 'topics': topics, 'instructions': instructions, 'existing_items': existing_items},
+        lambda: llm_call(
+            lambda: generate_mnemonics_from_text(
+                text_content=text,
+                mnemonic_types=mnemonic_types,
+                topics=topics,
+                instructions=instructions,
+                user=job.user,
+                retries=settings.LLM_GENERATOR_RETRIES
+            ),
+            estimated_tokens=estimate_call_tokens(job.kind, text, count), label='mnemonic',
+        ),
+        use_cache=use_cache and params.get('use_cache', True),
+    )
+    return mnemonic_data.get("mnemonics", []), {'uncovered_topics': mnemonic_data.get("uncovered_topics", [])}
+
+
+def _save_items(job, document, items, index, limit=None):
+    if job.kind == GenerationJob.Kind.QUIZ:
+        return save_quiz_items(job.user, document, items, job.params['difficulty'], index=index, limit=limit)
+    if job.kind == GenerationJob.Kind.FLASHCARD:
+        return save_flashcard_items(job.user, document, items, job.params['difficulty'], index=index, limit=limit)
+    return save_mnemonic_items(job.user, document, items, index=index)
+
+
+GENERATORS = {
+    GenerationJob.Kind.QUIZ: _call_quiz_generator,
+    GenerationJob.Kind.FLASHCARD: _call_flashcard_generator,
+    GenerationJob.Kind.MNEMONIC: _call_mnemonic_generator,
+}
+
+def _call_generator(job, text, count, offset, use_cache=True, existing_items=None):
+    """The GENERATORS call of the job's kind, with the tokens it uses attributed to that kind"""
+    with usage_feature(job.kind):
+        return GENERATORS[job.kind](job, text, count, offset, use_cache=use_cache, existing_items=existing_items)
+
+
+GENERATED_MODELS = {
+    GenerationJob.Kind.QUIZ: Quiz,
+    GenerationJob.Kind.FLASHCARD: Flashcard,
+    GenerationJob.Kind.MNEMONIC: Mnemonic,
+}
+
+
+def _job_result(job, document, number_of_items, generated_count, saved_count, uncovered_topics):
+    """Response body of the former synchronous endpoint"""
+    if job.kind == GenerationJob.Kind.QUIZ:
+        return {
+            "message": f"Quiz generation process completed for document {document.id}. {saved_count} of {number_of_items} requested quizzes were successfully saved.",
+            # Not a QuizSession (those start on submission): a request id the upload page carries into the quiz URL
+            "quiz_session_id": str(uuid.uuid4()),
+            "document_id": document.id,
+            "difficulty": job.params['difficulty'],
+            "requested_count": number_of_items,
+        }
+    if job.kind == GenerationJob.Kind.FLASHCARD:
+        return {
+            "message": f"Flashcard generation process completed for document {document.id}. {saved_count} of {number_of_items} requested flashcards were successfully saved.",
+            "session_id": str(uuid.uuid4()),
+            "document_id": document.id,
+            "difficulty": job.params['difficulty'],
+            "requested_count": number_of_items,
+        }
+    return {
+        "message": f"Mnemonic generation process completed for document {document.id}. {saved_count} mnemonics were successfully saved.",
+        "document_id": document.id,
+        "saved_count": saved_count,
+        "generated_count": generated_count,
+        "uncovered_topics": uncovered_topics,
+    }
+
+
+def _with_item_errors(result, errors):
+    """
+    Add what the synchronous endpoint's response status told the client to a job result: `status`
+    is 207 (Multi-Status) if some items failed validation or saving, listed in `errors`, else 200.
+    """
+    if errors:
+        result["errors"] = errors
+    result["status"] = status.HTTP_207_MULTI_STATUS if errors else status.HTTP_200_OK
+    return result
+
+
+def _call_on_own_connection(call, *args):
+    try:
+        return call(*args)
+    finally:
+        # Generators record token usage; close the connection this thread opened for it
+        connection.close()
+
+
+def _generated_parts(job, parts, existing_items=None):
+    """
+    Run the generator call of every part, at most GENERATION_FANOUT_CONCURRENCY at a time, yielding
+    (part index, items, extra fields) as each call returns. A lone part runs on the current thread.
+    Raises the error of the first failed call.
+    """
+    if len(parts) == 1:
+        text, _, count = parts[0]
+        yield (0, *_call_generator(job, text, count, 0, existing_items=existing_items))
+        return
+
+    # Parts are submitted in order, so the lead call is the first one to start
+    with ThreadPoolExecutor(max_workers=min(len(parts), settings.GENERATION_FANOUT_CONCURRENCY)) as executor:
+        futures = {}
+        offset = 0
+        for part_index, (text, _, count) in enumerate(parts):
+            # Each call runs in a copy of this context, so its usage settles the job's token hold
+            futures[executor.submit(
+                copy_context().run, _call_on_own_connection, _call_generator, job, text, count, offset, True, existing_items
+            )] = part_index
+            offset += count
+        for future in as_completed(futures):
+            yield (futures[future], *future.result())
+
+
+def _existing_items_digest(job, document):
+    """
+    Hash of the ids of the document's items of the job's kind (and difficulty), other than the job's
+    own, for the LLM cache key. A response cached before those items were saved would only repeat
+    them, and every item would be dropped as a near duplicate; a retried job still gets its hit.
+    """
+    queryset = GENERATED_MODELS[job.kind].objects.filter(document=document).exclude(id__in=job.item_ids)
+    if job.kind != GenerationJob.Kind.MNEMONIC:
+        queryset = queryset.filter(difficulty=job.params['difficulty'])
+    ids = ','.join(str(item_id) for item_id in queryset.order_by('id').values_list('id', flat=True))
+    return hashlib.sha256(ids.encode('ascii')).hexdigest()
+
+
+def _job_parts(job, document, number_of_items):
+    """
+    Context of each generator call of a job, as (text, tokens, item count) parts.
+    Empty if the document has no text.
+    """
+    # Only the most relevant, diverse chunks that fit the context budget are sent to the model,
+    # split into disjoint parts when the request is made in more than one call
+    part_counts = generation_part_counts(job.kind, number_of_items, job.params.get('topics'))
+    exclude_hashes = None
+    if job.document_version_id is not None:
+        # Regeneration after a file replacement draws only on the chunks that changed since that version
+        exclude_hashes = {chunk['content_hash'] for chunk in split_into_chunks(job.document_version.extracted_text)}
+    return split_generation_context(
+        document, part_counts, query_text=_context_query(job.kind, job.params, document), exclude_hashes=exclude_hashes
+    )
+
+
+def _parts_estimate(job, parts):
+    """Expected tokens of the generator calls over `parts`, given the actual context size"""
+    return estimate_generation_tokens(
+        job.kind, sum(tokens for _, tokens, _ in parts), sum(count for _, _, count in parts), len(parts)
+    )
+
+
+def run_generation_job(job):
+    """Run a claimed generation job of any kind"""
+    if job.is_refill:
+        run_pool_refill_job(job)
+    elif job.kind == GenerationJob.Kind.STUDY_PACK:
+        run_study_pack_job(job)
+    elif job.kind == GenerationJob.Kind.ADAPTIVE_QUIZ:
+        run_adaptive_quiz_job(job)
+    else:
+        run_item_generation_job(job)
+        if job.document_version_id is not None:
+            record_regeneration(job.document_version_id)
+
+
+def run_item_generation_job(job):
+    """
+    Run a claimed quiz, flashcard or mnemonic generation job: select the context, re-check the
+    token budget against the actual context size, call the generator and save the items.
+    Items are saved and appended to job.item_ids as each generator call returns, so the stream
+    endpoint can send them before the whole job is done. Near duplicates of the document's items
+    (or of each other) are dropped; if that leaves a quiz or flashcard job short, one more call is
+    made over the section that produced the fewest duplicates. Failures are recorded on the job
+    with the HTTP status the synchronous endpoint used to return.
+    """
+    document = Document.objects.without_text().get(pk=job.document_id)
+    number_of_items = _requested_items(job.kind, job.params)
+    item_ids = list(job.item_ids)  # Items served from the pool when the job was queued
+    errors = []
+    generated_count = 0
+    uncovered_topics = []
+    try:
+        # A requeued job keeps the items its earlier run saved
+        to_generate = number_of_items - len(item_ids) if job.kind in COUNT_PARAMS else number_of_items
+        parts = _job_parts(job, document, to_generate) if to_generate > 0 else []
+        if not parts and to_generate > 0:
+            logger.warning(f"Document ID {document.id} has no extracted text for {job.kind} generation.")
+            mark_job_failed(job, "Document content is empty or not processed.", error_status=400)
+            return
+
+        # The token budget is re-checked against the actual context size, and held while the calls run
+        with reserve_tokens(job.user, _parts_estimate(job, parts)):
+            index = SimilarityIndex(GENERATED_MODELS[job.kind], document.id)
+            # Spare items of fanned-out quiz and flashcard calls are only used to make up for duplicates
+            limited = job.kind != GenerationJob.Kind.MNEMONIC
+            part_duplicates = [0] * len(parts)
+            existing_items = _existing_items_digest(job, document)
+            for part_index, items, extra in _generated_parts(job, parts, existing_items):
+                generated_count += len(items)
+                dropped_before = index.duplicates_dropped
+                saved, item_errors = _save_items(
+                    job, document, items, index, limit=number_of_items - len(item_ids) if limited else None
+                )
+                part_duplicates[part_index] += index.duplicates_dropped - dropped_before
+                uncovered_topics += extra.get('uncovered_topics', [])
+                errors += item_errors
+                item_ids += [item.pk for item in saved]
+                job.item_ids = item_ids
+                job.save(update_fields=['item_ids'])
+
+            shortfall = number_of_items - len(item_ids)
+            if limited and shortfall > 0 and index.duplicates_dropped:
+                text, _, _ = parts[part_duplicates.index(min(part_duplicates))]
+                try:
+                    items, _ = _call_generator(
+                        job, text, shortfall + settings.GENERATION_FANOUT_SPARE_ITEMS, 0, use_cache=False
+                    )
+                except (QuizGenerationError, FlashcardGenerationError, LLMUnavailable) as e:
+                    # The items already saved stand; the job completes short
+                    logger.warning(f"Top-up {job.kind} call for job {job.id} failed: {e}")
+                    errors.append(f"Could not replace {shortfall} duplicate {job.kind} items: {e}")
+                else:
+                    generated_count += len(items)
+                    saved, item_errors = _save_items(job, document, items, index, limit=shortfall)
+                    errors += item_errors
+                    item_ids += [item.pk for item in saved]
+                    job.item_ids = item_ids
+                    job.save(update_fields=['item_ids'])
+    except PermissionDenied as e:
+        # Token limit exceeded, either before the call or inside the generator's token tracking
+        mark_job_failed(job, e.detail, error_status=403)
+        return
+    except LLMUnavailable as e:
+        # The model service is failing or overloaded (see api/llm_gateway.py)
+        mark_job_failed(job, e.detail, error_status=503)
+        return
+    except (QuizGenerationError, FlashcardGenerationError, MnemonicGenerationError) as e:
+        logger.error(f"{job.get_kind_display()} generation failed for doc {document.id}: {e}")
+        mark_job_failed(job, e, error_status=e.status_code)
+        return
+    except Exception as e:
+        logger.exception(f"Unexpected error running {job.kind} generation job {job.id} for doc {document.id}: {e}")
+        mark_job_failed(job, f"An unexpected error occurred during {job.kind} generation.", error_status=500)
+        return
+
+    logger.info(f"Requested {number_of_items} {job.kind} items for document {document.id}. Generated {generated_count}. Successfully saved {len(item_ids)}. Encountered {len(errors)} issues during validation or saving.")
+    result = _job_result(job, document, number_of_items, generated_count, len(item_ids), uncovered_topics)
+    mark_job_done(job, item_ids=item_ids, result=_with_item_errors(result, errors))
+
+
+def record_regeneration(version_id):
+    """
+    Record the outcome of a replaced version's regeneration jobs on the version once none of them
+    is left to run: 'failed' with their errors if any failed, otherwise 'done'.
+    """
+    jobs = list(GenerationJob.objects.filter(document_version_id=version_id).values_list('status', 'error'))
+    if any(job_status in (GenerationJob.Status.QUEUED, GenerationJob.Status.RUNNING) for job_status, _ in jobs):
+        return
+    errors = [error for job_status, error in jobs if job_status == GenerationJob.Status.FAILED]
+    DocumentVersion.objects.filter(pk=version_id, regeneration_status='queued').update(
+        regeneration_status='failed' if errors else 'done', regeneration_error='\n'.join(errors),
+    )
+
+
+def abandon_generation_job(job, error):
+    """Fail a job for good, recording it on the version it was regenerating items of, if any"""
+    mark_job_failed(job, error)
+    if job.document_version_id is not None:
+        record_regeneration(job.document_version_id)
+
+
+def run_pool_refill_job(job):
+    """
+    Run a claimed pool refill: generate items for the document's pool of the job's kind and difficulty,
+    up to its plan tier target, skipping near duplicates of the document's saved and pooled items.
+    """
+    document = Document.objects.without_text().get(pk=job.document_id)
+    difficulty = job.params['difficulty']
+    # Requests may have drawn on the pool (or another refill filled it) since the job was queued,
+    # and on the owner's tokens
+    wanted = min(_requested_items(job.kind, job.params), pool_target(document.user) - pooled_count(document, job.kind, difficulty))
+    wanted = _affordable_items(document, job.kind, max(wanted, 0), _refill_budget(job.user))
+    pooled = 0
+    try:
+        parts = _job_parts(job, document, wanted) if wanted > 0 else []
+        if parts:
+            with reserve_tokens(job.user, _parts_estimate(job, parts)):
+                index = pool_similarity_index(document, job.kind, difficulty)
+                for _, items, _ in _generated_parts(job, parts):
+                    added, _ = add_to_pool(document, job.kind, difficulty, items, index, limit=wanted - pooled)
+                    pooled += len(added)
+    except PermissionDenied as e:
+        mark_job_failed(job, e.detail, error_status=403)
+        return
+    except LLMUnavailable as e:
+        mark_job_failed(job, e.detail, error_status=503)
+        return
+    except (QuizGenerationError, FlashcardGenerationError) as e:
+        logger.error(f"Refill of the {job.kind} pool of doc {document.id} failed: {e}")
+        mark_job_failed(job, e, error_status=e.status_code)
+        return
+    except Exception as e:
+        logger.exception(f"Unexpected error running {job.kind} pool refill job {job.id} for doc {document.id}: {e}")
+        mark_job_failed(job, f"An unexpected error occurred during {job.kind} generation.", error_status=500)
+        return
+
+    mark_job_done(job, result={'document_id': document.id, 'difficulty': difficulty, 'pooled_count': pooled})
+    if pooled:
+        prewarm_document_pools(document)
+
+
+def _pack_section(pack, section, count, document, errors, limit=True):
+    """
+    Items of one section of a study pack response, the first `count` of them if `limit`.
+    A missing or malformed section is reported in `errors` and yields no items, so the other
+    sections are still saved.
+    """
+    items = pack.get(section) if isinstance(pack, dict) else None
+    if items is None:
+        if count:
+            logger.warning(f"Study pack response for doc {document.id} has no {section}.")
+            errors.append(f"No {section} data received.")
+        return []
+    if not isinstance(items, list):
+        logger.warning(f"Invalid {section} section received from AI for doc {document.id}: {str(items)[:200]}...")
+        errors.append(f"Invalid {section} data received: expected a list, got {type(items).__name__}.")
+        return []
+    return items[:count] if limit else items
+
+
+def _generate_study_pack(job, document, text, counts, errors, use_cache):
+    """Make the study pack call and save its items; returns ({kind}_ids lists, near duplicates dropped)"""
+    difficulty = job.params['difficulty']
+    topics = job.params.get('topics') or None
+    pack = cached_llm_call(
+        'study_pack', text,
+        {
+            'difficulty': difficulty,
+            'number_of_quizzes': counts[GenerationJob.Kind.QUIZ],
+            'number_of_flashcards': counts[GenerationJob.Kind.FLASHCARD],
+            'number_of_mnemonics': counts[GenerationJob.Kind.MNEMONIC],
+            'topics': topics,
+        },
+        lambda: generate_study_pack_from_text(
+            text_content=text,
+            difficulty=difficulty,
+            number_of_quizzes=counts[GenerationJob.Kind.QUIZ],
+            number_of_flashcards=counts[GenerationJob.Kind.FLASHCARD],
+            number_of_mnemonics=counts[GenerationJob.Kind.MNEMONIC],
+            topics=topics,
+            user=job.user,
+        ),
+        use_cache=use_cache,
+    )
+
+    quizzes = [
+        _quiz_from_item(job.user, document, data, difficulty)
+        for data in _validated_items('quiz', QuizItemSerializer, _pack_section(pack, 'quizzes', counts[GenerationJob.Kind.QUIZ], document, errors), document, errors)
+    ]
+    flashcards = [
+        _flashcard_from_item(job.user, document, data, difficulty)
+        for data in _validated_items('flashcard', FlashcardItemSerializer, _pack_section(pack, 'flashcards', counts[GenerationJob.Kind.FLASHCARD], document, errors), document, errors)
+    ]
+    mnemonics = [
+        _mnemonic_from_item(job.user, document, data)
+        for data in _validated_items('mnemonic', MnemonicItemSerializer, _pack_section(pack, 'mnemonics', counts[GenerationJob.Kind.MNEMONIC], document, errors, limit=False), document, errors)
+    ]
+    indexes = [SimilarityIndex(model, document.id) for model in (Quiz, Flashcard, Mnemonic)]
+    with transaction.atomic():
+        saved = {
+            'quiz_ids': [item.pk for item in _bulk_save_items(Quiz, quizzes, indexes[0])],
+            'flashcard_ids': [item.pk for item in _bulk_save_items(Flashcard, flashcards, indexes[1])],
+            'mnemonic_ids': [item.pk for item in _bulk_save_items(Mnemonic, mnemonics, indexes[2])],
+        }
+    return saved, sum(index.duplicates_dropped for index in indexes)
+
+
+def run_study_pack_job(job):
+    """
+    Run a claimed study pack job: one generator call over a context shared by the quizzes, flashcards
+    and mnemonics of a document, so the document is sent (and paid for) once. The output is split by
+    kind, validated, and bulk-saved to the three tables in one transaction.
+    """
+    document = Document.objects.without_text().get(pk=job.document_id)
+    params = job.params
+    counts = _study_pack_counts(params)
+    errors = []
+    try:
+        text, context_tokens = select_generation_context(document, sum(counts.values()), query_text=document.summary)
+        if not text:
+            logger.warning(f"Document ID {document.id} has no extracted text for study pack generation.")
+            mark_job_failed(job, "Document content is empty or not processed.", error_status=400)
+            return
+        use_cache = params.get('use_cache', True)
+        with reserve_tokens(job.user, estimate_study_pack_tokens(context_tokens, counts)), usage_feature(job.kind):
+            saved, duplicates_dropped = _generate_study_pack(job, document, text, counts, errors, use_cache)
+            if use_cache and duplicates_dropped and not any(saved.values()):
+                # A cached response repeats what the same request saved before; ask the model again
+                saved, _ = _generate_study_pack(job, document, text, counts, errors, use_cache=False)
+    except PermissionDenied as e:
+        mark_job_failed(job, e.detail, error_status=403)
+        return
+    except LLMUnavailable as e:
+        mark_job_failed(job, e.detail, error_status=503)
+        return
+    except StudyPackGenerationError as e:
+        logger.error(f"Study pack generation failed for doc {document.id}: {e}")
+        mark_job_failed(job, e, error_status=e.status_code)
+        return
+    except Exception as e:
+        logger.exception(f"Unexpected error running study pack job {job.id} for doc {document.id}: {e}")
+        mark_job_failed(job, "An unexpected error occurred during study pack generation.", error_status=500)
+        return
+
+    result = {
+        "message": (
+            f"Study pack generation completed for document {document.id}. Saved {len(saved['quiz_ids'])} quizzes, "
+            f"{len(saved['flashcard_ids'])} flashcards and {len(saved['mnemonic_ids'])} mnemonics."
+        ),
+        "document_id": document.id,
+        "difficulty": params['difficulty'],
+        **saved,
+    }
+    logger.info(f"Study pack job {job.id} for document {document.id}: {result['message']}")
+    mark_job_done(job, result=_with_item_errors(result, errors))
+
+
+def run_adaptive_quiz_job(job):
+    """
+    Run a claimed adaptive quiz job: generate quizzes targeting the user's weak spots in the document
+    (from all answers submitted so far) and save them, dropping near duplicates of existing quizzes.
+    """
+    document_id = job.document_id
+    estimate = estimate_generation_tokens('quiz', settings.GENERATION_CONTEXT_MIN_TOKENS, DEFAULT_CONTEXT_ITEMS)
+    try:
+        with reserve_tokens(job.user, estimate), usage_feature(job.kind):
+            quiz_data = llm_call(
+                lambda: generate_adaptive_quizzes(user=job.user, document_id=document_id),
+                estimated_tokens=estimate['total_tokens'],
+                label='adaptive quiz',
+            )
+        last_quiz_id = Quiz.objects.filter(document_id=document_id).aggregate(last=Max('id'))['last'] or 0
+        save_adaptive_quizzes(user=job.user, document_id=document_id, quiz_data=quiz_data)
+        # The adaptive generator saves on its own; drop what it repeated of the existing quizzes
+        new_quizzes = Quiz.objects.filter(document_id=document_id, id__gt=last_quiz_id)
+        remove_new_duplicates(Quiz, document_id, new_quizzes.values_list('id', flat=True))
+        refresh_search_vectors(Quiz, Quiz.objects.filter(document_id=document_id, search_vector__isnull=True))
+        item_ids = list(new_quizzes.order_by('id').values_list('id', flat=True))
+    except PermissionDenied as e:
+        mark_job_failed(job, e.detail, error_status=403)
+        return
+    except LLMUnavailable as e:
+        # Made again on the next third submission
+        mark_job_failed(job, e.detail, error_status=503)
+        return
+    except Exception as e:
+        logger.exception(f"Unexpected error running adaptive quiz job {job.id} for doc {document_id}: {e}")
+        mark_job_failed(job, "An unexpected error occurred during adaptive quiz generation.", error_status=500)
+        return
+
+    logger.info(f"Adaptive quiz job {job.id} saved {len(item_ids)} quizzes for document {document_id}")
+    mark_job_done(job, item_ids=item_ids, result=_with_item_errors({
+        "message": f"Adaptive quiz generation completed for document {document_id}. Saved {len(item_ids)} quizzes.",
+        "document_id": document_id,
+        "quiz_ids": item_ids,
+    }, []))
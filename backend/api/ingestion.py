@@ -0,0 +1,425 @@
+import io
+import os
+import mmap
+import time
+import uuid
+import logging
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from django.conf import settings
+from django.core.files.move import file_move_safe
+from django.db import connection, transaction
+from django.db.models import Count
+from django.utils import timezone
+from pypdf import PdfReader, PdfWriter
+from pypdf.errors import PdfReadError
+
+from utils.doc_processor import extract_and_preprocess_text
+from .models import BackgroundJob, Document, DocumentChunk, DocumentIngestionJob, IngestionJobRange, TokenUsageEvent
+from .jobs import mark_job_done, mark_job_failed, requeue_job
+from .extraction_cache import lookup_extraction_cache, store_extraction_result
+from .chunking import create_document_chunks, split_into_chunks
+from .search import refresh_document_vectors, refresh_search_vectors
+from .versioning import replace_document_content, enqueue_regeneration_jobs
+from .generation import prewarm_document_pools
+from .usage_ledger import usage_feature
+
+logger = logging.getLogger(__name__)
+
+
+class DocumentIngestionError(Exception):
+    """Raised when an uploaded document cannot be extracted into a Document."""
+    pass
+
+
+class RangeExtractionError(DocumentIngestionError):
+    """Raised when page ranges of a large PDF failed; retrying the job only extracts those ranges again."""
+    pass
+
+
+def _spool_dir():
+    spool_dir = Path(settings.INGESTION_SPOOL_DIR)
+    spool_dir.mkdir(parents=True, exist_ok=True)
+    return spool_dir
+
+
+def spool_upload(uploaded_file, spool_path):
+    """
+    Place an uploaded file at `spool_path` without reading it into memory.
+    Uploads already on disk (HashingTemporaryFileUploadHandler) are moved; anything else is copied in chunks.
+    """
+    if hasattr(uploaded_file, 'temporary_file_path'):
+        file_move_safe(uploaded_file.temporary_file_path(), spool_path, allow_overwrite=True)
+        return
+
+    with open(spool_path, 'wb') as destination:
+        for chunk in uploaded_file.chunks():
+            destination.write(chunk)
+
+
+def _split_filename(original_filename):
+    filename_without_ext, file_extension = os.path.splitext(original_filename)
+    return filename_without_ext, file_extension.lstrip('.')
+
+
+def _document_for_upload(user, uploaded_file, extracted_text, summary):
+    filename_without_ext, file_extension = _split_filename(uploaded_file.name)
+    return Document(
+        user=user,
+        filename=filename_without_ext,
+        size=uploaded_file.size,
+        file_type=file_extension,
+        extracted_text=extracted_text,
+        summary=summary,
+    )
+
+
+def create_document_from_cache(user, uploaded_file):
+    """
+    Create a Document straight from the extraction cache if this exact file was processed before.
+    Returns the Document, or None on a cache miss.
+    """
+    cached = lookup_extraction_cache(getattr(uploaded_file, 'sha256', ''))
+    if cached is None:
+        return None
+
+    extracted_text, summary = cached
+    document = _document_for_upload(user, uploaded_file, extracted_text, summary)
+    document.save()
+    create_document_chunks(document, extracted_text)
+    logger.info(f"Created document {document.id} for user {user.id} from the extraction cache")
+    prewarm_document_pools(document)
+    return document
+
+
+def _ingestion_job_for_upload(user, uploaded_file, batch_id=None, target_document=None):
+    """Spool an uploaded file and return the (unsaved) job that will extract it"""
+    original_filename = uploaded_file.name
+    _, file_extension = _split_filename(original_filename)
+
+    spool_path = _spool_dir() / f"{uuid.uuid4().hex}.{file_extension or 'bin'}"
+    spool_upload(uploaded_file, spool_path)
+
+    return DocumentIngestionJob(
+        user=user,
+        original_filename=original_filename,
+        file_type=file_extension,
+        size=uploaded_file.size,
+        content_sha256=getattr(uploaded_file, 'sha256', ''),
+        spool_path=str(spool_path),
+        batch_id=batch_id,
+        target_document=target_document,
+    )
+
+
+def enqueue_document_upload(user, uploaded_file, target_document=None):
+    """
+    Move the uploaded file into the spool directory and queue it for the ingestion worker.
+    With `target_document`, the upload becomes a new version of that document instead of a new Document.
+    Returns the created DocumentIngestionJob.
+    """
+    job = _ingestion_job_for_upload(user, uploaded_file, target_document=target_document)
+    job.save()
+    logger.info(f"Queued ingestion job {job.id} for '{job.original_filename}' user {user.id}")
+    return job
+
+
+def enqueue_document_batch(user, uploaded_files):
+    """
+    Ingest several uploads at once.
+    Files found in the extraction cache become Documents immediately (with their pools prewarmed like
+    single uploads), the rest are queued as jobs sharing one batch_id; both are written with bulk inserts.
+    Returns (batch_id, results) where results holds a Document, a DocumentIngestionJob or an
+    error message for each file, in upload order.
+    """
+    batch_id = uuid.uuid4()
+    results = [None] * len(uploaded_files)
+    documents = {}
+    jobs = {}
+
+    for position, uploaded_file in enumerate(uploaded_files):
+        cached = lookup_extraction_cache(getattr(uploaded_file, 'sha256', ''))
+        if cached is not None:
+            documents[position] = (_document_for_upload(user, uploaded_file, *cached), cached[0])
+            continue
+        try:
+            jobs[position] = _ingestion_job_for_upload(user, uploaded_file, batch_id)
+        except OSError as e:
+            logger.exception(f"Failed to spool upload '{uploaded_file.name}' for user {user.id}: {e}")
+            results[position] = "An unexpected error occurred while saving the upload."
+
+    with transaction.atomic():
+        Document.objects.bulk_create([document for document, _ in documents.values()])
+        DocumentChunk.objects.bulk_create([
+            DocumentChunk(document=document, **chunk)
+            for document, extracted_text in documents.values()
+            for chunk in split_into_chunks(extracted_text)
+        ])
+        DocumentIngestionJob.objects.bulk_create(list(jobs.values()))
+
+    if documents:
+        document_ids = [document.id for document, _ in documents.values()]
+        refresh_document_vectors(Document.objects.filter(id__in=document_ids))
+        refresh_search_vectors(DocumentChunk, DocumentChunk.objects.filter(document_id__in=document_ids))
+        for document, _ in documents.values():
+            prewarm_document_pools(document)
+
+    for position, (document, _) in documents.items():
+        results[position] = document
+    for position, job in jobs.items():
+        results[position] = job
+
+    logger.info(
+        f"Batch {batch_id} for user {user.id}: {len(documents)} from cache, {len(jobs)} queued, "
+        f"{len(uploaded_files) - len(documents) - len(jobs)} failed"
+    )
+    return batch_id, results
+
+
+def claimable_ingestion_jobs():
+    """
+    Ingestion jobs a worker may claim: those of users with fewer than
+    INGESTION_MAX_RUNNING_JOBS_PER_USER jobs already running, so one large batch
+    cannot occupy every worker slot.
+    """
+    busy_users = DocumentIngestionJob.objects.filter(
+        status=BackgroundJob.Status.RUNNING
+    ).values('user_id').annotate(
+        running=Count('id')
+    ).filter(
+        running__gte=settings.INGESTION_MAX_RUNNING_JOBS_PER_USER
+    ).values('user_id')
+    return DocumentIngestionJob.objects.select_related('user').exclude(user_id__in=busy_users)
+
+
+def extract_document(job):
+    """
+    Run text extraction and summarisation for a claimed job and save the resulting Document.
+    The spooled file is memory-mapped, so the extractor reads pages from the OS page cache
+    instead of a per-upload copy on the Python heap.
+    Raises DocumentIngestionError with a user-facing message on failure.
+    """
+    # An identical upload may have been extracted while this job sat in the queue
+    cached = lookup_extraction_cache(job.content_sha256)
+    if cached is not None:
+        extracted_text, summary = cached
+    else:
+        page_count = _pdf_page_count(job)
+        if page_count > settings.INGESTION_RANGE_PAGES:
+            extracted_text, summary = _extract_page_ranges(job, page_count)
+        else:
+            extracted_text, summary = _extract_spooled_file(job)
+        store_extraction_result(job.content_sha256, extracted_text, summary)
+
+    if job.target_document_id:
+        document, _ = replace_document_content(job.target_document, job, extracted_text, summary)
+        return document
+
+    filename_without_ext, _ = _split_filename(job.original_filename)
+    document = Document.objects.create(
+        user=job.user,
+        filename=filename_without_ext,
+        size=job.size,
+        file_type=job.file_type,
+        extracted_text=extracted_text,
+        summary=summary,
+    )
+    create_document_chunks(document, extracted_text)
+    return document
+
+
+def _check_extraction_result(job, result, label=''):
+    if result.get('error'):
+        logger.error(f"Document processing failed for '{job.original_filename}'{label} user {job.user_id}: {result['error']}")
+        if "client not initialized" in result['error']:
+            raise DocumentIngestionError("Document processing service configuration error.")
+        raise DocumentIngestionError("Failed to process document content.")
+    return result.get('text', ''), result.get('summary', '')
+
+
+def _extract_spooled_file(job):
+    if not os.path.getsize(job.spool_path):
+        raise DocumentIngestionError("Uploaded file is empty.")
+
+    with open(job.spool_path, 'rb') as spooled_file, \
+            mmap.mmap(spooled_file.fileno(), 0, access=mmap.ACCESS_READ) as file_content, \
+            usage_feature(TokenUsageEvent.Feature.SUMMARY):
+        result = extract_and_preprocess_text(file_content, job.user)
+
+    return _check_extraction_result(job, result)
+
+
+def _pdf_page_count(job):
+    """Number of pages in a spooled PDF, or 0 for other file types and unreadable PDFs"""
+    if job.file_type.lower() != 'pdf' or not os.path.getsize(job.spool_path):
+        return 0
+    try:
+        # Given a path, PdfReader reads the whole file into memory; a file object is read on demand
+        with open(job.spool_path, 'rb') as pdf_file:
+            return len(PdfReader(pdf_file).pages)
+    except (PdfReadError, ValueError) as e:
+        # Leave damaged files to the extractor, which reports its own error
+        logger.warning(f"Could not read page count of '{job.original_filename}' (job {job.id}): {e}")
+        return 0
+
+
+def _plan_page_ranges(job, page_count):
+    """
+    Return the page ranges of a job, creating them on first run.
+    A job requeued after a worker died keeps its ranges, so finished ones are not extracted again.
+    """
+    ranges = list(job.ranges.all())
+    if ranges:
+        return ranges
+
+    range_pages = settings.INGESTION_RANGE_PAGES
+    IngestionJobRange.objects.bulk_create([
+        IngestionJobRange(
+            job=job,
+            index=index,
+            first_page=first_page,
+            last_page=min(first_page + range_pages - 1, page_count),
+        )
+        for index, first_page in enumerate(range(1, page_count + 1, range_pages))
+    ])
+    return list(job.ranges.all())
+
+
+def _range_pdf_bytes(reader, reader_lock, page_range):
+    """Write the pages of one range into a standalone PDF"""
+    writer = PdfWriter()
+    # PdfReader parses objects lazily and is not safe to share between threads
+    with reader_lock:
+        for page_number in range(page_range.first_page, page_range.last_page + 1):
+            writer.add_page(reader.pages[page_number - 1])
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+def _extract_range(job, reader, reader_lock, page_range):
+    """
+    Extract one page range on a pool thread, retrying it on its own up to INGESTION_RANGE_RETRIES times.
+    Returns (extracted_text, summary, attempts).
+    """
+    label = f" pages {page_range.first_page}-{page_range.last_page}"
+    attempts = 0
+    try:
+        content = _range_pdf_bytes(reader, reader_lock, page_range)
+        while True:
+            attempts += 1
+            try:
+                with usage_feature(TokenUsageEvent.Feature.SUMMARY):
+                    result = extract_and_preprocess_text(content, job.user)
+                extracted_text, summary = _check_extraction_result(job, result, label)
+                return extracted_text, summary, attempts
+            except DocumentIngestionError as e:
+                if attempts > settings.INGESTION_RANGE_RETRIES:
+                    e.attempts = attempts
+                    raise
+                logger.warning(f"Retrying{label} of ingestion job {job.id} (attempt {attempts} failed)")
+                time.sleep(2 ** attempts)
+    finally:
+        # Pool threads open their own connections if the extractor touches the database
+        connection.close()
+
+
+def _extract_page_ranges(job, page_count):
+    """
+    Extract a large PDF as independent page ranges on a bounded thread pool.
+    Each range row records its own status, so job status reports progress per range and a
+    failed range is retried without redoing the others. Range texts are merged in page order,
+    separated by form feeds so chunking keeps page boundaries; the summaries are merged the same way.
+    """
+    ranges = _plan_page_ranges(job, page_count)
+    pending = [page_range for page_range in ranges if page_range.status != BackgroundJob.Status.DONE]
+    logger.info(f"Extracting {page_count} pages of job {job.id} as {len(ranges)} ranges ({len(pending)} pending)")
+
+    reader_lock = threading.Lock()
+    failure = None
+
+    IngestionJobRange.objects.filter(id__in=[r.id for r in pending]).update(status=BackgroundJob.Status.RUNNING)
+    with open(job.spool_path, 'rb') as pdf_file, \
+            ThreadPoolExecutor(max_workers=settings.INGESTION_MAX_PARALLEL_RANGES) as executor:
+        reader = PdfReader(pdf_file)
+        futures = {
+            executor.submit(_extract_range, job, reader, reader_lock, page_range): page_range
+            for page_range in pending
+        }
+        for future in as_completed(futures):
+            page_range = futures[future]
+            page_range.finished_at = timezone.now()
+            try:
+                page_range.extracted_text, page_range.summary, page_range.attempts = future.result()
+                page_range.status = BackgroundJob.Status.DONE
+                page_range.error = ''
+            except Exception as e:
+                if not isinstance(e, DocumentIngestionError):
+                    logger.exception(f"Unexpected error extracting range {page_range.index} of job {job.id}: {e}")
+                    e = DocumentIngestionError("Failed to process document content.")
+                page_range.attempts = getattr(e, 'attempts', page_range.attempts + 1)
+                page_range.status = BackgroundJob.Status.FAILED
+                page_range.error = str(e)
+                failure = failure or e
+            page_range.save(update_fields=['status', 'extracted_text', 'summary', 'attempts', 'error', 'finished_at'])
+
+    if failure is not None:
+        raise RangeExtractionError(str(failure)) from failure
+
+    ranges.sort(key=lambda r: r.index)
+    extracted_text = '\f'.join(r.extracted_text for r in ranges)
+    summary = '\n\n'.join(r.summary for r in ranges if r.summary)
+    return extracted_text, summary
+
+
+def _remove_spooled_file(job):
+    try:
+        os.remove(job.spool_path)
+    except OSError:
+        pass
+
+
+def abandon_ingestion_job(job, error):
+    """Fail a job for good: its spooled file and the text of its finished ranges are no longer needed"""
+    mark_job_failed(job, error)
+    _remove_spooled_file(job)
+    job.ranges.update(extracted_text='', summary='')
+
+
+def run_ingestion_job(job):
+    """
+    Process a claimed ingestion job end to end, recording the outcome on the job row.
+    Jobs with failed page ranges are requeued until INGESTION_JOB_MAX_ATTEMPTS; the spooled
+    file is kept until the job succeeds or is abandoned.
+    """
+    try:
+        document = extract_document(job)
+    except RangeExtractionError as e:
+        if job.attempts < settings.INGESTION_JOB_MAX_ATTEMPTS:
+            logger.warning(f"Requeued ingestion job {job.id} after attempt {job.attempts}: {e}")
+            requeue_job(job, e)
+        else:
+            abandon_ingestion_job(job, e)
+        return None
+    except DocumentIngestionError as e:
+        abandon_ingestion_job(job, e)
+        return None
+    except Exception as e:
+        logger.exception(f"Unexpected error during document processing for job {job.id}: {e}")
+        abandon_ingestion_job(job, "An unexpected error occurred during document processing.")
+        return None
+
+    _remove_spooled_file(job)
+    # The merged text is saved on the Document now
+    job.ranges.all().delete()
+    mark_job_done(job, document=document)
+    logger.info(f"Successfully processed and saved document '{document.filename}' for user {job.user_id} (job {job.id})")
+
+    if job.target_document_id:
+        # The file is already replaced; regeneration failures are recorded on the version, not the job
+        enqueue_regeneration_jobs(document.versions.first())
+        # Pooled items were generated from the old content
+        document.pooled_items.all().delete()
+    prewarm_document_pools(document)
+    return document
@@ -0,0 +1,146 @@
+import os
+import time
+import socket
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.utils import timezone
+
+from .models import BackgroundJob
+
+logger = logging.getLogger(__name__)
+
+
+def worker_identity():
+    """Return a label identifying this worker process (host:pid)"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def claim_jobs(queryset, worker_id, limit=1):
+    """
+    Atomically claim up to `limit` queued jobs from `queryset`.
+    Rows are locked with SKIP LOCKED so concurrent workers never claim the same job.
+    Returns the claimed job instances, already marked as running.
+    """
+    with transaction.atomic():
+        jobs = list(
+            queryset.select_for_update(skip_locked=True, of=('self',))
+            .filter(status=BackgroundJob.Status.QUEUED)
+            .order_by('created_at')[:limit]
+        )
+        if not jobs:
+            return []
+
+        now = timezone.now()
+        for job in jobs:
+            job.status = BackgroundJob.Status.RUNNING
+            job.locked_by = worker_id
+            job.started_at = now
+            job.attempts += 1
+        queryset.model.objects.bulk_update(jobs, ['status', 'locked_by', 'started_at', 'attempts'])
+
+    return jobs
+
+
+def mark_job_done(job, **fields):
+    """Mark a job as done, saving any extra result fields alongside the status"""
+    for name, value in fields.items():
+        setattr(job, name, value)
+    job.status = BackgroundJob.Status.DONE
+    job.error = ''
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'finished_at', *fields.keys()])
+
+
+def mark_job_failed(job, error, **fields):
+    """Mark a job as failed with a user-facing error message, saving any extra fields alongside"""
+    for name, value in fields.items():
+        setattr(job, name, value)
+    job.status = BackgroundJob.Status.FAILED
+    job.error = str(error)
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'finished_at', *fields.keys()])
+
+
+def requeue_job(job, error):
+    """Put a job back in the queue after a failed attempt, keeping the error for status reports"""
+    job.status = BackgroundJob.Status.QUEUED
+    job.locked_by = ''
+    job.error = str(error)
+    job.save(update_fields=['status', 'locked_by', 'error'])
+
+
+def requeue_stale_jobs(queryset, stale_after, abandon=mark_job_failed):
+    """
+    Put jobs that have been running longer than `stale_after` back in the queue.
+    Covers workers that died mid-job; returns the number of requeued jobs. Jobs already claimed
+    STALE_JOB_MAX_ATTEMPTS times are given up with `abandon(job, error)` instead, and so are jobs
+    whose requeue would break a constraint on queued rows (an adaptive quiz job with a newer one
+    already queued for the document, see one_queued_adaptive_quiz_job): the queued job covers them.
+    """
+    cutoff = timezone.now() - stale_after
+    stale = queryset.filter(
+        status=BackgroundJob.Status.RUNNING,
+        started_at__lt=cutoff,
+    )
+    count = 0
+    for job in stale:
+        if job.attempts >= settings.STALE_JOB_MAX_ATTEMPTS:
+            logger.error(f"Giving up {type(job).__name__} {job.id}: still running after {job.attempts} attempts")
+            abandon(job, "Processing stopped responding too many times. Please try again later.")
+            continue
+        try:
+            # One row at a time, so a row that can't be requeued doesn't hold back the others
+            with transaction.atomic():
+                count += stale.filter(pk=job.pk).update(status=BackgroundJob.Status.QUEUED, locked_by='')
+        except IntegrityError as e:
+            logger.warning(f"Not requeuing stale {type(job).__name__} {job.id}, a job queued after it covers it: {e}")
+            abandon(job, "Superseded by a newer request.")
+    if count:
+        logger.warning(f"Requeued {count} stale {queryset.model.__name__} rows")
+    return count
+
+
+def _run_on_own_connection(run_job, job):
+    try:
+        run_job(job)
+    except Exception:
+        # Handlers record their own failures; anything escaping them would otherwise vanish with the future
+        logger.exception(f"Unhandled error in {type(job).__name__} {job.id}")
+    finally:
+        # Each pool thread has its own connection; don't leave it open between jobs
+        connection.close()
+
+
+def run_job_pool(claim_next, run_job, concurrency, poll_interval, once=False, on_poll=None):
+    """
+    Run claimed jobs on a pool of `concurrency` threads, polling the queue every `poll_interval` seconds.
+    `claim_next()` returns the next claimed job or None; it is called once per free slot, so claim rules
+    (e.g. per-user limits) are re-checked for every job. `on_poll()` runs before each round of claims.
+    With `once`, returns when the queue is empty and all claimed jobs have finished.
+    """
+    running = set()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while True:
+            close_old_connections()
+            if on_poll:
+                try:
+                    on_poll()
+                except Exception:
+                    # Housekeeping (e.g. the stale job sweep) must not stop the worker from claiming jobs
+                    logger.exception("Error in the worker's poll hook")
+
+            while len(running) < concurrency:
+                job = claim_next()
+                if job is None:
+                    break
+                running.add(executor.submit(_run_on_own_connection, run_job, job))
+
+            if not running:
+                if once:
+                    break
+                time.sleep(poll_interval)
+                continue
+
+            _, running = wait(running, timeout=poll_interval, return_when=FIRST_COMPLETED)
@@ -0,0 +1,102 @@
+import json
+import hashlib
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import LLMResponseCacheEntry
+from .cache_stats import record_cache_lookup
+
+logger = logging.getLogger(__name__)
+
+CACHE_STATS_PREFIX = 'llm'
+
+
+def _model_name(generator):
+    return settings.STUDY_PLAN_MODEL if generator == 'study_plan' else settings.LLM_MODEL
+
+
+def llm_cache_key(generator, text, params):
+    """
+    Cache key of a generator call: a hash of the whitespace-normalised input text, the generator,
+    its parameters, the model and the prompt version
+    """
+    payload = json.dumps({
+        'generator': generator,
+        'text': hashlib.sha256(' '.join(text.split()).encode('utf-8')).hexdigest(),
+        'params': params,
+        'model': _model_name(generator),
+        'prompt_version': settings.LLM_PROMPT_VERSION,
+    }, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def cached_llm_call(generator, text, params, call, use_cache=True):
+    """
+    Return the response of `call()` (a generator call on `text` with `params`), reusing a stored
+    response for the same inputs if one is younger than LLM_CACHE_TTL_HOURS.
+    Only successful responses are stored; hits and misses are counted under 'llm:<generator>'.
+    """
+    if not use_cache or not settings.LLM_CACHE_ENABLED:
+        return call()
+
+    key = llm_cache_key(generator, text, params)
+    now = timezone.now()
+    entry = LLMResponseCacheEntry.objects.filter(
+        key=key,
+        created_at__gte=now - timedelta(hours=settings.LLM_CACHE_TTL_HOURS),
+    ).only('id', 'response').first()
+    record_cache_lookup(f"{CACHE_STATS_PREFIX}:{generator}", hit=entry is not None)
+    if entry is not None:
+        LLMResponseCacheEntry.objects.filter(pk=entry.pk).update(hit_count=F('hit_count') + 1, last_used_at=now)
+        logger.info(f"LLM cache hit for {generator} call {key[:12]}")
+        return entry.response
+
+    response = call()
+    fields = {
+        'generator': generator,
+        'model_name': _model_name(generator),
+        'prompt_version': settings.LLM_PROMPT_VERSION,
+        'response': response,
+        'size': len(json.dumps(response, default=str).encode('utf-8')),
+        'hit_count': 0,
+        'created_at': timezone.now(),
+        'last_used_at': timezone.now(),
+    }
+    try:
+        # Replaces an expired entry for the same key
+        LLMResponseCacheEntry.objects.update_or_create(key=key, defaults=fields)
+    except IntegrityError:
+        # Another worker stored the same call concurrently
+        pass
+    return response
+
+
+def evict_llm_cache(max_age=None, max_bytes=None):
+    """
+    Remove responses older than `max_age`, then least recently used responses until the cache
+    fits in `max_bytes`. Returns the number of rows removed.
+    """
+    if max_age is None:
+        max_age = timedelta(hours=settings.LLM_CACHE_TTL_HOURS)
+    if max_bytes is None:
+        max_bytes = settings.LLM_CACHE_MAX_BYTES
+
+    expired_count, _ = LLMResponseCacheEntry.objects.filter(created_at__lt=timezone.now() - max_age).delete()
+
+    removed = 0
+    total_size = LLMResponseCacheEntry.objects.aggregate(total=Sum('size'))['total'] or 0
+    if total_size > max_bytes:
+        evict_ids = []
+        for entry_id, size in LLMResponseCacheEntry.objects.order_by('last_used_at').values_list('id', 'size').iterator():
+            if total_size <= max_bytes:
+                break
+            evict_ids.append(entry_id)
+            total_size -= size
+        removed, _ = LLMResponseCacheEntry.objects.filter(id__in=evict_ids).delete()
+
+    logger.info(f"LLM cache eviction removed {expired_count} expired and {removed} over-size rows")
+    return expired_count + removed
@@ -0,0 +1,219 @@
+import time
+import random
+import logging
+import threading
+from django.conf import settings
+from openai import APIConnectionError
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+logger = logging.getLogger(__name__)
+
+# Model backends, each with its own gateway: a failing backend doesn't trip the other's circuit
+AZURE_OPENAI = 'azure_openai'  # Quizzes, flashcards, mnemonics, study packs (utils generators and api/study_pack.py)
+PERPLEXITY = 'perplexity'  # Study plans (utils.study_planner)
+
+# Responses that mean the model service is overloaded or failing, rather than a bad request
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class LLMUnavailable(APIException):
+    """The model service is failing or overloaded: the circuit is open, or retries and waiting ran out"""
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "The AI service is temporarily unavailable. Please try again in a few minutes."
+    default_code = 'llm_unavailable'
+
+
+def is_retryable(error):
+    """
+    Whether a failed call is worth retrying: rate limits, timeouts and server errors of the
+    openai SDK or of the utils generators (whose *GenerationError carries status_code)
+    """
+    if isinstance(error, APIConnectionError):  # Includes timeouts
+        return True
+    return getattr(error, 'status_code', None) in RETRYABLE_STATUS_CODES
+
+
+class TokenBucket:
+    """
+    Paces calls to a tokens-per-minute quota: `acquire(n)` waits until n tokens have accumulated.
+    The bucket holds at most one minute of quota, so an idle period allows one burst of that size.
+    """
+
+    def __init__(self, tokens_per_minute):
+        self.capacity = tokens_per_minute
+        self.rate = tokens_per_minute / 60
+        self.tokens = tokens_per_minute
+        self.updated = time.monotonic()
+        self.condition = threading.Condition()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, tokens, timeout):
+        """Take `tokens` from the bucket, waiting up to `timeout` seconds; returns False on timeout"""
+        tokens = min(tokens, self.capacity)  # A call larger than the quota still goes through, alone
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while True:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return True
+                wait = (tokens - self.tokens) / self.rate
+                remaining = deadline - time.monotonic()
+                if wait > remaining:
+                    return False
+                self.condition.wait(wait)
+
+
+class CircuitBreaker:
+    """
+    Fails calls fast after `failure_threshold` consecutive retryable failures. After `reset_seconds`
+    one trial call is let through (half-open); its success closes the circuit, its failure reopens it,
+    and so does a trial that ends without a result (see abandon_trial).
+    """
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_threshold, reset_seconds):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.lock = threading.Lock()
+
+    def before_call(self):
+        """Raise LLMUnavailable unless a call may be made now; returns whether the call is the half-open trial"""
+        with self.lock:
+            if self.state == self.CLOSED:
+                return False
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = self.HALF_OPEN
+                logger.info("LLM circuit half-open: letting a trial call through")
+                return True
+            raise LLMUnavailable()
+
+    def abandon_trial(self):
+        """
+        Reopen the circuit after a trial call that recorded neither success nor failure (it gave up
+        waiting for quota or a slot, or was interrupted), so another trial is let through later
+        instead of the circuit staying half-open.
+        """
+        with self.lock:
+            if self.state == self.HALF_OPEN:
+                logger.warning("LLM circuit reopened: the trial call did not complete")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def record_success(self):
+        with self.lock:
+            if self.state != self.CLOSED:
+                logger.info("LLM circuit closed")
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning(f"LLM circuit open after {self.failures} consecutive failures")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+class LLMGateway:
+    """
+    Single path for the model calls of this process. Calls are limited to `max_concurrency` at a
+    time, paced by a token bucket sized to the deployment's quota, retried with exponential backoff
+    and full jitter on retryable errors, and failed fast with LLMUnavailable while the circuit is open.
+    """
+
+    def __init__(self, max_concurrency, tokens_per_minute, max_retries, backoff_base, backoff_max,
+                 failure_threshold, reset_seconds, queue_timeout):
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.circuit = CircuitBreaker(failure_threshold, reset_seconds)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.queue_timeout = queue_timeout
+
+    @classmethod
+    def from_settings(cls, backend):
+        return cls(
+            max_concurrency=settings.LLM_MAX_CONCURRENCY,
+            # The quota is the Azure OpenAI deployment's; other backends aren't paced
+            tokens_per_minute=settings.LLM_TOKENS_PER_MINUTE if backend == AZURE_OPENAI else 0,
+            max_retries=settings.LLM_MAX_RETRIES,
+            backoff_base=settings.LLM_BACKOFF_BASE_SECONDS,
+            backoff_max=settings.LLM_BACKOFF_MAX_SECONDS,
+            failure_threshold=settings.LLM_CIRCUIT_FAILURE_THRESHOLD,
+            reset_seconds=settings.LLM_CIRCUIT_RESET_SECONDS,
+            queue_timeout=settings.LLM_QUEUE_TIMEOUT_SECONDS,
+        )
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def call(self, fn, estimated_tokens=0, label='LLM'):
+        """
+        Return fn() (one model call), made under the gateway's limits. Non-retryable errors are
+        raised as they are; retryable ones are retried and end in LLMUnavailable.
+        """
+        for attempt in range(self.max_retries + 1):
+            trial = self.circuit.before_call()
+            try:
+                if self.bucket and not self.bucket.acquire(estimated_tokens, self.queue_timeout):
+                    logger.warning(f"{label} call gave up waiting for {estimated_tokens} tokens of quota")
+                    raise LLMUnavailable()
+                if not self.slots.acquire(timeout=self.queue_timeout):
+                    logger.warning(f"{label} call gave up waiting for a free slot")
+                    raise LLMUnavailable()
+                try:
+                    result = fn()
+                except Exception as e:
+                    if not is_retryable(e):
+                        # The service answered; the request itself was at fault
+                        self.circuit.record_success()
+                        raise
+                    self.circuit.record_failure()
+                    error = e
+                else:
+                    self.circuit.record_success()
+                    return result
+                finally:
+                    self.slots.release()
+            except BaseException:
+                if trial:
+                    self.circuit.abandon_trial()  # No-op if the trial got as far as recording its outcome
+                raise
+
+            if attempt < self.max_retries:
+                delay = self._backoff(attempt)
+                logger.warning(f"{label} call failed (attempt {attempt + 1}/{self.max_retries + 1}), retrying in {delay:.1f}s: {error}")
+                time.sleep(delay)
+
+        logger.error(f"{label} call failed after {self.max_retries + 1} attempts: {error}")
+        raise LLMUnavailable() from error
+
+
+_gateways = {}
+_gateways_lock = threading.Lock()
+
+
+def get_gateway(backend=AZURE_OPENAI):
+    """The process-wide gateway of a model backend (limits apply per worker process)"""
+    if backend not in _gateways:
+        with _gateways_lock:
+            if backend not in _gateways:
+                _gateways[backend] = LLMGateway.from_settings(backend)
+    return _gateways[backend]
+
+
+def llm_call(fn, estimated_tokens=0, label='LLM', backend=AZURE_OPENAI):
+    """Make a model call through the backend's process-wide gateway, see LLMGateway.call"""
+    return get_gateway(backend).call(fn, estimated_tokens=estimated_tokens, label=label)
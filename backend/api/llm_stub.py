@@ -0,0 +1,157 @@
+import re
+import json
+import time
+import random
+import hashlib
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Chat completions paths of Azure OpenAI (/openai/deployments/<name>/...) and of plain OpenAI-compatible servers
+COMPLETIONS_PATH_RE = re.compile(r'^(?:/openai/deployments/(?P<deployment>[^/]+))?(?:/v1)?/chat/completions$')
+_COUNT_RE = re.compile(r'(\d+)\s+(?:multiple-choice\s+)?(quiz|quizzes|questions|flashcards|mnemonics)')
+_WORD_RE = re.compile(r'[A-Za-z]{5,}')
+DEFAULT_STUB_ITEMS = 5
+
+
+def _requested_count(prompt, kinds):
+    for count, kind in _COUNT_RE.findall(prompt):
+        if kind in kinds:
+            return int(count)
+    return DEFAULT_STUB_ITEMS
+
+
+def _stub_quizzes(rng, words, count):
+    return [{
+        "question": f"Which statement about {rng.choice(words)} and {rng.choice(words)} is correct? ({i + 1})",
+        "options": [f"{rng.choice(words)} option {n}" for n in range(4)],
+        "correct_option_index": rng.randrange(4),
+        "hint": f"Think about {rng.choice(words)}.",
+        "explanation": f"The document links {rng.choice(words)} to {rng.choice(words)}.",
+        "keywords": rng.sample(words, min(3, len(words))),
+    } for i in range(count)]
+
+
+def _stub_flashcards(rng, words, count):
+    return [{
+        "front": f"What is {rng.choice(words)}? ({i + 1})",
+        "back": f"{rng.choice(words)} relates to {rng.choice(words)} and {rng.choice(words)}.",
+        "hint": f"Starts with {rng.choice(words)[0]}.",
+        "keywords": rng.sample(words, min(3, len(words))),
+    } for i in range(count)]
+
+
+def _stub_mnemonics(rng, words, count):
+    types = ['acronym', 'acrostic', 'rhyme', 'association', 'visualization']
+    return [{
+        "mnemonic": ' '.join(rng.choice(words) for _ in range(4)),
+        "mnemonic_type": rng.choice(types),
+        "mnemonic_explanation": f"Each word recalls part of {rng.choice(words)}.",
+        "topic": f"{rng.choice(words)} ({i + 1})",
+    } for i in range(count)]
+
+
+def stub_completion_content(prompt):
+    """
+    Deterministic JSON reply to a generation prompt: the same prompt always gets the same reply.
+    The kind of reply is guessed from the prompt's wording, item counts from numbers in it.
+    """
+    rng = random.Random(hashlib.sha256(prompt.encode('utf-8')).digest())
+    words = sorted(set(_WORD_RE.findall(prompt))) or ['concept', 'process', 'structure']
+    lowered = prompt.lower()
+    if 'study pack' in lowered:
+        reply = {
+            "quizzes": _stub_quizzes(rng, words, _requested_count(lowered, ('quiz', 'quizzes'))),
+            "flashcards": _stub_flashcards(rng, words, _requested_count(lowered, ('flashcards',))),
+            "mnemonics": _stub_mnemonics(rng, words, _requested_count(lowered, ('mnemonics',))),
+        }
+    elif 'mnemonic' in lowered:
+        reply = {"mnemonics": _stub_mnemonics(rng, words, _requested_count(lowered, ('mnemonics',))), "uncovered_topics": []}
+    elif 'flashcard' in lowered:
+        reply = {"flashcards": _stub_flashcards(rng, words, _requested_count(lowered, ('flashcards',)))}
+    else:
+        reply = {"quizzes": _stub_quizzes(rng, words, _requested_count(lowered, ('quiz', 'quizzes', 'questions')))}
+    return json.dumps(reply)
+
+
+def stub_chat_completion(body, deployment=None):
+    """OpenAI chat.completion response object for a request body"""
+    prompt = '\n'.join(str(message.get('content', '')) for message in body.get('messages', []))
+    content = stub_completion_content(prompt)
+    prompt_tokens = len(prompt) // 4 + 1
+    completion_tokens = len(content) // 4 + 1
+    return {
+        "id": f"chatcmpl-stub-{hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:24]}",
+        "object": "chat.completion",
+        "created": 0,
+        "model": deployment or body.get('model') or 'stub',
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens},
+    }
+
+
+class StubLLMServer(ThreadingHTTPServer):
+    """
+    Local stand-in for the Azure OpenAI deployment, for running and load-testing generation offline.
+    Replies after `latency` seconds; answers 429 to every `fail_every`-th request and to requests
+    beyond `max_in_flight` concurrent ones, like a deployment at its quota.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0, fail_every=0, max_in_flight=0):
+        super().__init__(address, StubLLMHandler)
+        self.latency = latency
+        self.fail_every = fail_every
+        self.max_in_flight = max_in_flight
+        self.requests = 0
+        self.in_flight = 0
+        self.lock = threading.Lock()
+
+
+class StubLLMHandler(BaseHTTPRequestHandler):
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        match = COMPLETIONS_PATH_RE.match(self.path.split('?', 1)[0])
+        if not match:
+            self._send_json(404, {"error": {"code": "NotFound", "message": f"Unknown path {self.path}"}})
+            return
+
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            throttled = (
+                (server.fail_every and server.requests % server.fail_every == 0)
+                or (server.max_in_flight and server.in_flight >= server.max_in_flight)
+            )
+            if not throttled:
+                server.in_flight += 1
+        if throttled:
+            self._send_json(429, {"error": {"code": "429", "message": "Rate limit exceeded (stub)"}}, {'Retry-After': '1'})
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            try:
+                body = json.loads(self.rfile.read(length) or b'{}')
+            except ValueError:
+                self._send_json(400, {"error": {"code": "BadRequest", "message": "Body is not JSON"}})
+                return
+            time.sleep(server.latency)
+            self._send_json(200, stub_chat_completion(body, match.group('deployment')))
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
@@ -0,0 +1,48 @@
+import time
+from django.core.management.base import BaseCommand
+
+from api.compression import compress_text, decompress_text, get_active_dictionary
+from api.fields import compressed_fields
+
+
+class Command(BaseCommand):
+    help = "Report compression ratio and per-row compress/decompress cost for every CompressedTextField column."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sample', type=int, default=200, help="Rows sampled per column")
+
+    def handle(self, *args, **options):
+        dictionary = get_active_dictionary()
+        self.stdout.write(f"Active dictionary: {dictionary[0] if dictionary else 'none'}")
+
+        for model, field in compressed_fields():
+            stored_values = (
+                model._base_manager.exclude(**{f"{field.attname}__isnull": True})
+                .order_by('-pk')
+                .values_list(field.attname, flat=True)[:options['sample']]
+            )
+            texts = [text for text in map(decompress_text, stored_values) if text]
+            label = f"{model._meta.db_table}.{field.column}"
+            if not texts:
+                self.stdout.write(f"{label}: no rows")
+                continue
+
+            raw_bytes = sum(len(text.encode('utf-8')) for text in texts)
+            variants = [('zlib', False)] + ([('zlib+dict', True)] if dictionary else [])
+            for name, use_dictionary in variants:
+                started = time.perf_counter()
+                encoded = [compress_text(text, use_dictionary=use_dictionary) for text in texts]
+                compress_seconds = time.perf_counter() - started
+
+                started = time.perf_counter()
+                for value in encoded:
+                    decompress_text(value)
+                decompress_seconds = time.perf_counter() - started
+
+                stored_bytes = sum(len(value) for value in encoded)
+                self.stdout.write(
+                    f"{label} [{name}]: {len(texts)} rows, {raw_bytes} -> {stored_bytes} bytes "
+                    f"(ratio {raw_bytes / max(stored_bytes, 1):.2f}x), "
+                    f"write {compress_seconds / len(texts) * 1000:.3f} ms/row, "
+                    f"read {decompress_seconds / len(texts) * 1000:.3f} ms/row"
+                )
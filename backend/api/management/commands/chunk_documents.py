@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from api.models import Document
+from api.chunking import create_document_chunks
+
+
+class Command(BaseCommand):
+    help = "Build DocumentChunk rows for documents ingested before chunked storage existed."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--rebuild', action='store_true', help="Re-chunk documents that already have chunks")
+
+    def handle(self, *args, **options):
+        queryset = Document.objects.order_by('id')
+        if not options['rebuild']:
+            queryset = queryset.filter(chunks__isnull=True)
+
+        processed = 0
+        last_id = 0
+        while True:
+            batch = list(queryset.filter(id__gt=last_id).only('id', 'extracted_text')[:options['batch_size']])
+            if not batch:
+                break
+            for document in batch:
+                create_document_chunks(document)
+            processed += len(batch)
+            last_id = batch[-1].id
+            self.stdout.write(f"Chunked {processed} documents")
+
+        self.stdout.write(self.style.SUCCESS(f"Done. Chunked {processed} documents"))
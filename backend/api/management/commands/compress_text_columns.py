@@ -0,0 +1,66 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import BinaryField, Value
+
+from api.compression import compress_text, decompress_text, is_compressed
+from api.fields import compressed_fields
+
+
+class Command(BaseCommand):
+    help = (
+        "Compress existing rows of every CompressedTextField column in batches. "
+        "Safe to re-run; rows already compressed with the active dictionary are skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--decompress', action='store_true',
+                            help="Rewrite rows as plain UTF-8 instead (required before reverting migration 0015)")
+        parser.add_argument('--recompress', action='store_true',
+                            help="Also rewrite rows that are already compressed, e.g. after training a new dictionary")
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        for model, field in compressed_fields():
+            label = f"{model._meta.db_table}.{field.column}"
+            rewritten, bytes_before, bytes_after = self._process_column(model, field, options)
+            self.stdout.write(
+                f"{label}: rewrote {rewritten} rows, {bytes_before} -> {bytes_after} bytes"
+                + (" (dry run)" if options['dry_run'] else "")
+            )
+
+    def _process_column(self, model, field, options):
+        rewritten = bytes_before = bytes_after = 0
+        last_pk = 0
+        queryset = model._base_manager.exclude(**{f"{field.attname}__isnull": True}).order_by('pk')
+
+        while True:
+            batch = list(queryset.filter(pk__gt=last_pk).values_list('pk', field.attname)[:options['batch_size']])
+            if not batch:
+                break
+            last_pk = batch[-1][0]
+
+            updates = []
+            for pk, stored in batch:
+                stored = stored.encode('utf-8') if isinstance(stored, str) else bytes(stored)
+                if options['decompress']:
+                    new_value = decompress_text(stored).encode('utf-8')
+                elif is_compressed(stored) and not options['recompress']:
+                    continue
+                else:
+                    new_value = compress_text(decompress_text(stored))
+
+                if new_value != stored:
+                    updates.append((pk, new_value))
+                    bytes_before += len(stored)
+                    bytes_after += len(new_value)
+
+            if updates and not options['dry_run']:
+                with transaction.atomic():
+                    for pk, new_value in updates:
+                        model._base_manager.filter(pk=pk).update(
+                            **{field.attname: Value(new_value, output_field=BinaryField())}
+                        )
+            rewritten += len(updates)
+
+        return rewritten, bytes_before, bytes_after
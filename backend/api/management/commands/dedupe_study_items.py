@@ -0,0 +1,56 @@
+from collections import defaultdict
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.models import Document, Quiz, Flashcard, Mnemonic, QuizAnswer, FlashcardReview
+from api.similarity import near_duplicates
+
+# Rows pointing at an item that must follow it to the item it is merged into
+ITEM_REFERENCES = {
+    Quiz: (QuizAnswer, 'quiz_id'),
+    Flashcard: (FlashcardReview, 'flashcard_id'),
+    Mnemonic: None,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Sign quizzes, flashcards and mnemonics saved before MinHash signatures existed and merge "
+        "near duplicates within each document into the oldest item of their group."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--document', type=int, help="Only dedupe this document")
+        parser.add_argument('--dry-run', action='store_true', help="Report duplicates without merging them")
+
+    def handle(self, *args, **options):
+        documents = Document.objects.order_by('id').values_list('id', flat=True)
+        if options['document']:
+            documents = documents.filter(id=options['document'])
+
+        totals = defaultdict(int)
+        for document_id in documents.iterator():
+            for model, reference in ITEM_REFERENCES.items():
+                duplicates = near_duplicates(model, document_id)
+                if not duplicates:
+                    continue
+                totals[model] += len(duplicates)
+                self.stdout.write(f"Document {document_id}: {len(duplicates)} duplicate {model._meta.verbose_name_plural.lower()}")
+                if not options['dry_run']:
+                    self._merge(model, reference, duplicates)
+
+        summary = ', '.join(f"{totals[model]} {model._meta.verbose_name_plural.lower()}" for model in ITEM_REFERENCES)
+        verb = "Found" if options['dry_run'] else "Merged"
+        self.stdout.write(self.style.SUCCESS(f"Done. {verb} {summary}"))
+
+    def _merge(self, model, reference, duplicates):
+        """Repoint answers and reviews of the duplicates to the kept items, then delete the duplicates"""
+        by_keeper = defaultdict(list)
+        for duplicate_id, keeper_id in duplicates.items():
+            by_keeper[keeper_id].append(duplicate_id)
+        with transaction.atomic():
+            if reference is not None:
+                reference_model, field = reference
+                for keeper_id, duplicate_ids in by_keeper.items():
+                    reference_model.objects.filter(**{f'{field}__in': duplicate_ids}).update(**{field: keeper_id})
+            model.objects.filter(id__in=list(duplicates)).delete()
@@ -0,0 +1,57 @@
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.models import GenerationJob
+from api.jobs import claim_jobs, requeue_stale_jobs, run_job_pool, worker_identity
+from api.generation import abandon_generation_job, run_generation_job
+
+logger = logging.getLogger(__name__)
+
+
+def idle_for_refills():
+    """
+    Pool refills only take a free slot while no request is waiting, and at most
+    GENERATION_POOL_MAX_RUNNING_REFILLS at a time, so bursts of requests find slots free.
+    """
+    if GenerationJob.objects.filter(is_refill=False, status=GenerationJob.Status.QUEUED).exists():
+        return False
+    running_refills = GenerationJob.objects.filter(is_refill=True, status=GenerationJob.Status.RUNNING).count()
+    return running_refills < settings.GENERATION_POOL_MAX_RUNNING_REFILLS
+
+
+class Command(BaseCommand):
+    help = "Run the generation worker: claims queued quiz, flashcard and mnemonic generation jobs and saves the items. Refills generation pools when idle."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Drain the queue once and exit instead of polling")
+        parser.add_argument('--poll-interval', type=float, default=1.0, help="Seconds to sleep when the queue is empty")
+        parser.add_argument('--stale-after', type=int, default=15, help="Minutes after which a running job is considered abandoned")
+        parser.add_argument('--concurrency', type=int, default=8, help="Number of generations running at the same time")
+
+    def handle(self, *args, **options):
+        worker_id = worker_identity()
+        stale_after = timedelta(minutes=options['stale_after'])
+        concurrency = max(options['concurrency'], 1)
+        self.stdout.write(f"Generation worker {worker_id} started with {concurrency} slots")
+
+        def claim_next():
+            jobs = claim_jobs(GenerationJob.objects.filter(is_refill=False), worker_id)
+            if not jobs and idle_for_refills():
+                jobs = claim_jobs(GenerationJob.objects.filter(is_refill=True), worker_id)
+            if not jobs:
+                return None
+            logger.info(f"Worker {worker_id} processing {jobs[0].kind} generation job {jobs[0].id}")
+            return jobs[0]
+
+        run_job_pool(
+            claim_next,
+            run_generation_job,
+            concurrency=concurrency,
+            poll_interval=options['poll_interval'],
+            once=options['once'],
+            on_poll=lambda: requeue_stale_jobs(GenerationJob.objects.all(), stale_after, abandon=abandon_generation_job),
+        )
+
+        self.stdout.write(f"Generation worker {worker_id} finished")
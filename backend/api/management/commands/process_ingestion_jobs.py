@@ -0,0 +1,44 @@
+import logging
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+
+from api.models import DocumentIngestionJob
+from api.jobs import claim_jobs, requeue_stale_jobs, run_job_pool, worker_identity
+from api.ingestion import run_ingestion_job, claimable_ingestion_jobs, abandon_ingestion_job
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Run the document ingestion worker: claims queued upload jobs and extracts them into Documents."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Drain the queue once and exit instead of polling")
+        parser.add_argument('--poll-interval', type=float, default=2.0, help="Seconds to sleep when the queue is empty")
+        parser.add_argument('--stale-after', type=int, default=30, help="Minutes after which a running job is considered abandoned")
+        parser.add_argument('--concurrency', type=int, default=4, help="Number of jobs extracted at the same time")
+
+    def handle(self, *args, **options):
+        worker_id = worker_identity()
+        stale_after = timedelta(minutes=options['stale_after'])
+        concurrency = max(options['concurrency'], 1)
+        self.stdout.write(f"Ingestion worker {worker_id} started with {concurrency} slots")
+
+        def claim_next():
+            # Claim one job at a time so the per-user running limit is re-checked for every slot
+            jobs = claim_jobs(claimable_ingestion_jobs(), worker_id)
+            if not jobs:
+                return None
+            logger.info(f"Worker {worker_id} processing ingestion job {jobs[0].id}")
+            return jobs[0]
+
+        run_job_pool(
+            claim_next,
+            run_ingestion_job,
+            concurrency=concurrency,
+            poll_interval=options['poll_interval'],
+            once=options['once'],
+            on_poll=lambda: requeue_stale_jobs(DocumentIngestionJob.objects.all(), stale_after, abandon=abandon_ingestion_job),
+        )
+
+        self.stdout.write(f"Ingestion worker {worker_id} finished")
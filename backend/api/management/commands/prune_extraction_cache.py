@@ -0,0 +1,22 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.extraction_cache import evict_extraction_cache
+
+
+class Command(BaseCommand):
+    help = "Evict extraction cache entries by age and total size. Meant to run periodically (e.g. daily cron)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age-days', type=int, default=settings.EXTRACTION_CACHE_MAX_AGE_DAYS,
+                            help="Remove entries not used for this many days")
+        parser.add_argument('--max-bytes', type=int, default=settings.EXTRACTION_CACHE_MAX_BYTES,
+                            help="Evict least recently used entries until cached text fits in this many bytes")
+
+    def handle(self, *args, **options):
+        removed = evict_extraction_cache(
+            max_age=timedelta(days=options['max_age_days']),
+            max_bytes=options['max_bytes'],
+        )
+        self.stdout.write(self.style.SUCCESS(f"Removed {removed} extraction cache rows"))
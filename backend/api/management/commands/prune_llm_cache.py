@@ -0,0 +1,22 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.llm_cache import evict_llm_cache
+
+
+class Command(BaseCommand):
+    help = "Evict LLM response cache entries by age and total size. Meant to run periodically (e.g. hourly cron)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age-hours', type=int, default=settings.LLM_CACHE_TTL_HOURS,
+                            help="Remove responses cached more than this many hours ago")
+        parser.add_argument('--max-bytes', type=int, default=settings.LLM_CACHE_MAX_BYTES,
+                            help="Evict least recently used responses until the cache fits in this many bytes")
+
+    def handle(self, *args, **options):
+        removed = evict_llm_cache(
+            max_age=timedelta(hours=options['max_age_hours']),
+            max_bytes=options['max_bytes'],
+        )
+        self.stdout.write(self.style.SUCCESS(f"Removed {removed} LLM response cache rows"))
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+from api.models import Document, DocumentChunk, Quiz, Flashcard, Mnemonic
+from api.search import refresh_search_vectors
+
+MODELS = {
+    'document': Document,
+    'document_text': DocumentChunk,
+    'quiz': Quiz,
+    'flashcard': Flashcard,
+    'mnemonic': Mnemonic,
+}
+
+
+class Command(BaseCommand):
+    help = "Compute full-text search vectors for documents, document text and generated study items."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--missing', action='store_true', help="Only index rows that have no search vector yet")
+        parser.add_argument('--type', choices=list(MODELS), action='append', dest='types',
+                            help="Limit to one type (repeatable); defaults to all")
+
+    def handle(self, *args, **options):
+        for type_name in options['types'] or MODELS:
+            model = MODELS[type_name]
+            queryset = model.objects.order_by('id')
+            if options['missing']:
+                queryset = queryset.filter(search_vector__isnull=True)
+
+            indexed = 0
+            last_id = 0
+            while True:
+                ids = list(queryset.filter(id__gt=last_id).values_list('id', flat=True)[:options['batch_size']])
+                if not ids:
+                    break
+                indexed += refresh_search_vectors(model, model.objects.filter(id__in=ids))
+                last_id = ids[-1]
+            self.stdout.write(f"Indexed {indexed} {type_name} rows")
+
+        self.stdout.write(self.style.SUCCESS("Done."))
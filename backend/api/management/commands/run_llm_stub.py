@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from api.llm_stub import StubLLMServer
+
+
+class Command(BaseCommand):
+    help = (
+        "Serve a deterministic stand-in for the Azure OpenAI chat completions API, for running and "
+        "load-testing generation offline. Point AZURE_OPENAI_ENDPOINT at it (e.g. http://localhost:8089)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8089)
+        parser.add_argument('--latency-ms', type=int, default=800, help="Delay before each reply")
+        parser.add_argument('--fail-every', type=int, default=0, help="Answer every Nth request with 429 (0: never)")
+        parser.add_argument('--max-in-flight', type=int, default=0,
+                            help="Answer 429 to requests beyond this many concurrent ones (0: no limit)")
+
+    def handle(self, *args, **options):
+        server = StubLLMServer(
+            (options['host'], options['port']),
+            latency=options['latency_ms'] / 1000,
+            fail_every=options['fail_every'],
+            max_in_flight=options['max_in_flight'],
+        )
+        self.stdout.write(f"LLM stub listening on http://{options['host']}:{options['port']}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f"LLM stub stopped after {server.requests} requests")
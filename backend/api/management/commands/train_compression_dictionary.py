@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.compression import decompress_text, train_dictionary, ZLIB_MAX_DICTIONARY_SIZE
+from api.fields import compressed_fields
+from api.models import CompressionDictionary
+
+
+class Command(BaseCommand):
+    help = (
+        "Train a zlib preset dictionary on a sample of stored text and make it the active dictionary for new writes. "
+        "Older dictionaries are kept so existing rows stay readable."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--samples-per-column', type=int, default=500)
+        parser.add_argument('--size', type=int, default=ZLIB_MAX_DICTIONARY_SIZE)
+
+    def handle(self, *args, **options):
+        samples = []
+        for model, field in compressed_fields():
+            stored_values = (
+                model._base_manager.exclude(**{f"{field.attname}__isnull": True})
+                .order_by('-pk')
+                .values_list(field.attname, flat=True)[:options['samples_per_column']]
+            )
+            samples.extend(text for text in map(decompress_text, stored_values) if text)
+
+        if not samples:
+            self.stdout.write(self.style.WARNING("No stored text to train on"))
+            return
+
+        data = train_dictionary(samples, size=options['size'])
+        with transaction.atomic():
+            CompressionDictionary.objects.filter(is_active=True).update(is_active=False)
+            dictionary = CompressionDictionary.objects.create(data=data, sample_count=len(samples))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {dictionary} from {len(samples)} samples. Restart web and worker processes to start using it, "
+            f"then run compress_text_columns --recompress to apply it to existing rows."
+        ))
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-18 08:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0011_document_ingestion_job"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="documentingestionjob",
+            name="content_sha256",
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 5.1.7 on 2026-10-18 08:03
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0012_ingestion_job_content_sha256"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CacheStats",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=100, unique=True)),
+                ("hits", models.BigIntegerField(default=0)),
+                ("misses", models.BigIntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "verbose_name_plural": "Cache stats",
+                "db_table": "cache_stats",
+            },
+        ),
+        migrations.CreateModel(
+            name="ExtractionCacheEntry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("content_sha256", models.CharField(max_length=64, unique=True)),
+                ("simhash", models.BigIntegerField()),
+                ("simhash_band0", models.IntegerField(db_index=True)),
+                ("simhash_band1", models.IntegerField(db_index=True)),
+                ("simhash_band2", models.IntegerField(db_index=True)),
+                ("simhash_band3", models.IntegerField(db_index=True)),
+                ("extracted_text", models.TextField(blank=True)),
+                ("summary", models.TextField(blank=True, null=True)),
+                ("size", models.IntegerField(default=0)),
+                ("hit_count", models.IntegerField(default=0)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "last_used_at",
+                    models.DateTimeField(
+                        db_index=True, default=django.utils.timezone.now
+                    ),
+                ),
+                (
+                    "canonical",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="aliases",
+                        to="api.extractioncacheentry",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name_plural": "Extraction cache entries",
+                "db_table": "extraction_cache",
+            },
+        ),
+    ]
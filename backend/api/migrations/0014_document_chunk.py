@@ -0,0 +1,56 @@
+# Generated by Django 5.1.7 on 2026-10-18 08:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0013_extraction_cache"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DocumentChunk",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("index", models.IntegerField()),
+                ("start_offset", models.IntegerField()),
+                ("end_offset", models.IntegerField()),
+                ("page_number", models.IntegerField(blank=True, null=True)),
+                ("text", models.TextField()),
+                (
+                    "document",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="chunks",
+                        to="api.document",
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "document_chunks",
+                "ordering": ["index"],
+                "indexes": [
+                    models.Index(
+                        fields=["document", "start_offset"],
+                        name="document_ch_documen_da06c9_idx",
+                    ),
+                    models.Index(
+                        fields=["document", "page_number"],
+                        name="document_ch_documen_53f1d2_idx",
+                    ),
+                ],
+                "unique_together": {("document", "index")},
+            },
+        ),
+    ]
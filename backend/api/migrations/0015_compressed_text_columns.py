@@ -0,0 +1,96 @@
+# Generated by Django 5.1.7 on 2026-10-18 08:06
+
+import api.fields
+from django.db import migrations, models
+
+# Columns converted from text to bytea. Existing values are kept as UTF-8 bytes, which
+# CompressedTextField reads as uncompressed text; compress_text_columns compresses them in batches.
+COMPRESSED_COLUMNS = [
+    ("documents", "extracted_text"),
+    ("documents", "summary"),
+    ("quizzes", "explanation"),
+    ("study_plan_steps", "description"),
+]
+
+
+def text_to_bytea(apps, schema_editor):
+    # A plain ALTER ... TYPE bytea would cast through the bytea escape syntax and mangle backslashes
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for table, column in COMPRESSED_COLUMNS:
+        schema_editor.execute(
+            f'ALTER TABLE "{table}" ALTER COLUMN "{column}" TYPE bytea USING convert_to("{column}", \'UTF8\')'
+        )
+
+
+def bytea_to_text(apps, schema_editor):
+    # Run `manage.py compress_text_columns --decompress` before reversing this migration
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for table, column in COMPRESSED_COLUMNS:
+        schema_editor.execute(
+            f'ALTER TABLE "{table}" ALTER COLUMN "{column}" TYPE text USING convert_from("{column}", \'UTF8\')'
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0014_document_chunk"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CompressionDictionary",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("data", models.BinaryField()),
+                ("sample_count", models.IntegerField(default=0)),
+                ("is_active", models.BooleanField(default=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "verbose_name_plural": "Compression dictionaries",
+                "db_table": "compression_dictionaries",
+            },
+        ),
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(text_to_bytea, bytea_to_text),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name="document",
+                    name="extracted_text",
+                    field=api.fields.CompressedTextField(),
+                ),
+                migrations.AlterField(
+                    model_name="document",
+                    name="summary",
+                    field=api.fields.CompressedTextField(
+                        blank=True,
+                        help_text="AI-generated summary of the document content for quick overview",
+                        null=True,
+                    ),
+                ),
+                migrations.AlterField(
+                    model_name="quiz",
+                    name="explanation",
+                    field=api.fields.CompressedTextField(blank=True),
+                ),
+                migrations.AlterField(
+                    model_name="studyplanstep",
+                    name="description",
+                    field=api.fields.CompressedTextField(),
+                ),
+            ],
+        ),
+    ]
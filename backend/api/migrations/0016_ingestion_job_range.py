@@ -0,0 +1,62 @@
+# Generated by Django 5.1.7 on 2026-10-18 08:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0015_compressed_text_columns"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="IngestionJobRange",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("index", models.IntegerField()),
+                ("first_page", models.IntegerField()),
+                ("last_page", models.IntegerField()),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("queued", "Queued"),
+                            ("running", "Running"),
+                            ("done", "Done"),
+                            ("failed", "Failed"),
+                        ],
+                        default="queued",
+                        max_length=10,
+                    ),
+                ),
+                ("extracted_text", models.TextField(blank=True)),
+                ("summary", models.TextField(blank=True)),
+                ("attempts", models.IntegerField(default=0)),
+                ("error", models.TextField(blank=True)),
+                ("finished_at", models.DateTimeField(blank=True, null=True)),
+                (
+                    "job",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="ranges",
+                        to="api.documentingestionjob",
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "document_ingestion_job_ranges",
+                "ordering": ["index"],
+                "unique_together": {("job", "index")},
+            },
+        ),
+    ]
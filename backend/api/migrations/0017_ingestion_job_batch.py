@@ -0,0 +1,26 @@
+# Generated by Django 5.1.7 on 2026-10-18 08:09
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0016_ingestion_job_range"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="documentingestionjob",
+            name="batch_id",
+            field=models.UUIDField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="documentingestionjob",
+            index=models.Index(
+                fields=["user", "batch_id"], name="document_in_user_id_de1456_idx"
+            ),
+        ),
+    ]
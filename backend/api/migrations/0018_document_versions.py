@@ -0,0 +1,96 @@
+# Generated by Django 5.1.7 on 2026-10-18 08:11
+
+import hashlib
+
+import api.fields
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_chunk_hashes(apps, schema_editor):
+    DocumentChunk = apps.get_model("api", "DocumentChunk")
+    batch = []
+    for chunk in DocumentChunk.objects.only("id", "text").iterator(chunk_size=500):
+        normalised = " ".join(chunk.text.split())
+        chunk.content_hash = hashlib.sha256(normalised.encode("utf-8")).hexdigest()
+        batch.append(chunk)
+        if len(batch) >= 500:
+            DocumentChunk.objects.bulk_update(batch, ["content_hash"])
+            batch = []
+    if batch:
+        DocumentChunk.objects.bulk_update(batch, ["content_hash"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0017_ingestion_job_batch"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="document",
+            name="version",
+            field=models.IntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name="documentchunk",
+            name="content_hash",
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name="documentingestionjob",
+            name="target_document",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="replacement_jobs",
+                to="api.document",
+            ),
+        ),
+        migrations.CreateModel(
+            name="DocumentVersion",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("version", models.IntegerField()),
+                ("filename", models.CharField(max_length=255)),
+                ("size", models.FloatField()),
+                ("file_type", models.CharField(max_length=10)),
+                ("extracted_text", api.fields.CompressedTextField()),
+                ("summary", api.fields.CompressedTextField(blank=True, null=True)),
+                ("uploaded_at", models.DateTimeField()),
+                ("replaced_at", models.DateTimeField(auto_now_add=True)),
+                ("changed_chunks", models.IntegerField(default=0)),
+                ("kept_items", models.IntegerField(default=0)),
+                ("stale_items", models.JSONField(default=dict)),
+                (
+                    "regeneration_status",
+                    models.CharField(default="queued", max_length=10),
+                ),
+                ("regeneration_error", models.TextField(blank=True)),
+                (
+                    "document",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="versions",
+                        to="api.document",
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "document_versions",
+                "ordering": ["-version"],
+                "unique_together": {("document", "version")},
+            },
+        ),
+        migrations.RunPython(backfill_chunk_hashes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 5.1.7 on 2026-10-18 08:14
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.conf import settings
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0018_document_versions"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="document",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="documentchunk",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="flashcard",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="mnemonic",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="quiz",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="document",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search_vector"], name="documents_search__080b1c_gin"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="documentchunk",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search_vector"], name="document_ch_search__50a032_gin"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="flashcard",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search_vector"], name="flashcards_search__31d4aa_gin"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="mnemonic",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search_vector"], name="mnemonics_search__cae09f_gin"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="quiz",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search_vector"], name="quizzes_search__992bc7_gin"
+            ),
+        ),
+    ]
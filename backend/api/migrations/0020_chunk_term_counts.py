@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-18 08:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0019_search_vectors"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="documentchunk",
+            name="term_counts",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
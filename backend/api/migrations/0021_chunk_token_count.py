@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-18 08:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0020_chunk_term_counts"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="documentchunk",
+            name="token_count",
+            field=models.IntegerField(default=0),
+        ),
+    ]
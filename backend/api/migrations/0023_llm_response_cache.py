@@ -0,0 +1,46 @@
+# Generated by Django 5.1.7 on 2026-10-18 08:25
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0022_generation_job"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="LLMResponseCacheEntry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("key", models.CharField(max_length=64, unique=True)),
+                ("generator", models.CharField(max_length=50)),
+                ("model_name", models.CharField(blank=True, max_length=100)),
+                ("prompt_version", models.CharField(blank=True, max_length=50)),
+                ("response", models.JSONField()),
+                ("size", models.IntegerField(default=0)),
+                ("hit_count", models.IntegerField(default=0)),
+                ("created_at", models.DateTimeField(auto_now_add=True, db_index=True)),
+                (
+                    "last_used_at",
+                    models.DateTimeField(
+                        db_index=True, default=django.utils.timezone.now
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name_plural": "LLM response cache entries",
+                "db_table": "llm_response_cache",
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.7 on 2026-10-18 08:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0023_llm_response_cache"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="flashcard",
+            name="minhash",
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="mnemonic",
+            name="minhash",
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="quiz",
+            name="minhash",
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+    ]
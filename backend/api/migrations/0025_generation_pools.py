@@ -0,0 +1,74 @@
+# Generated by Django 5.1.7 on 2026-10-18 08:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0024_item_minhash"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="generationjob",
+            name="is_refill",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="usertokenusage",
+            name="plan_tier",
+            field=models.CharField(
+                choices=[("free", "Free"), ("pro", "Pro")],
+                default="free",
+                max_length=20,
+            ),
+        ),
+        migrations.CreateModel(
+            name="PooledItem",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[
+                            ("quiz", "Quiz"),
+                            ("flashcard", "Flashcard"),
+                            ("mnemonic", "Mnemonic"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("difficulty", models.CharField(max_length=10)),
+                ("item", models.JSONField()),
+                ("minhash", models.JSONField()),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "document",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="pooled_items",
+                        to="api.document",
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "generation_pool_items",
+                "indexes": [
+                    models.Index(
+                        fields=["document", "kind", "difficulty", "created_at"],
+                        name="generation__documen_10d26e_idx",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.1.7 on 2026-10-18 08:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0025_generation_pools"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="generationjob",
+            name="kind",
+            field=models.CharField(
+                choices=[
+                    ("quiz", "Quiz"),
+                    ("flashcard", "Flashcard"),
+                    ("mnemonic", "Mnemonic"),
+                    ("study_pack", "Study pack"),
+                ],
+                max_length=20,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="pooleditem",
+            name="kind",
+            field=models.CharField(
+                choices=[
+                    ("quiz", "Quiz"),
+                    ("flashcard", "Flashcard"),
+                    ("mnemonic", "Mnemonic"),
+                    ("study_pack", "Study pack"),
+                ],
+                max_length=20,
+            ),
+        ),
+    ]
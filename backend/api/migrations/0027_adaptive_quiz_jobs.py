@@ -0,0 +1,76 @@
+# Generated by Django 5.1.7 on 2026-10-18 08:39
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_completed_quiz_sessions(apps, schema_editor):
+    Document = apps.get_model("api", "Document")
+    QuizSession = apps.get_model("api", "QuizSession")
+    completed = (
+        QuizSession.objects.filter(document=OuterRef("pk"), completed_at__isnull=False)
+        .order_by()
+        .values("document")
+        .annotate(count=Count("id"))
+        .values("count")
+    )
+    Document.objects.update(
+        completed_quiz_sessions=Coalesce(Subquery(completed), Value(0))
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0026_study_pack_job"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="document",
+            name="completed_quiz_sessions",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name="generationjob",
+            name="kind",
+            field=models.CharField(
+                choices=[
+                    ("quiz", "Quiz"),
+                    ("flashcard", "Flashcard"),
+                    ("mnemonic", "Mnemonic"),
+                    ("study_pack", "Study pack"),
+                    ("adaptive_quiz", "Adaptive quiz"),
+                ],
+                max_length=20,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="pooleditem",
+            name="kind",
+            field=models.CharField(
+                choices=[
+                    ("quiz", "Quiz"),
+                    ("flashcard", "Flashcard"),
+                    ("mnemonic", "Mnemonic"),
+                    ("study_pack", "Study pack"),
+                    ("adaptive_quiz", "Adaptive quiz"),
+                ],
+                max_length=20,
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="generationjob",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("kind", "adaptive_quiz"), ("status", "queued")),
+                fields=("user", "document"),
+                name="one_queued_adaptive_quiz_job",
+            ),
+        ),
+        migrations.RunPython(
+            backfill_completed_quiz_sessions, migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-18 08:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0027_adaptive_quiz_jobs"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="usertokenusage",
+            name="tokens_reserved",
+            field=models.IntegerField(default=0),
+        ),
+    ]
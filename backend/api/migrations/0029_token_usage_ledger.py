@@ -0,0 +1,115 @@
+# Generated by Django 5.1.7 on 2026-10-18 08:47
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0028_token_reservations"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TokenUsageEvent",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "feature",
+                    models.CharField(
+                        choices=[
+                            ("quiz", "Quiz"),
+                            ("flashcard", "Flashcard"),
+                            ("mnemonic", "Mnemonic"),
+                            ("study_pack", "Study pack"),
+                            ("adaptive_quiz", "Adaptive quiz"),
+                            ("summary", "Summary"),
+                            ("study_plan", "Study plan"),
+                            ("other", "Other"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("tokens", models.IntegerField()),
+                ("created_at", models.DateTimeField(default=django.utils.timezone.now)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="token_usage_events",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "token_usage_events",
+                "indexes": [
+                    models.Index(
+                        fields=["created_at"], name="token_usage_created_1ccd49_idx"
+                    )
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name="TokenUsageHourly",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "feature",
+                    models.CharField(
+                        choices=[
+                            ("quiz", "Quiz"),
+                            ("flashcard", "Flashcard"),
+                            ("mnemonic", "Mnemonic"),
+                            ("study_pack", "Study pack"),
+                            ("adaptive_quiz", "Adaptive quiz"),
+                            ("summary", "Summary"),
+                            ("study_plan", "Study plan"),
+                            ("other", "Other"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("hour", models.DateTimeField()),
+                ("tokens", models.BigIntegerField(default=0)),
+                ("calls", models.IntegerField(default=0)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="token_usage_hours",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "token_usage_hourly",
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("user", "hour", "feature"),
+                        name="unique_token_usage_hour",
+                    )
+                ],
+            },
+        ),
+    ]
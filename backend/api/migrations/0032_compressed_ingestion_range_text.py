@@ -0,0 +1,56 @@
+# Generated by Django 5.1.7 on 2026-10-18 09:00
+
+import api.fields
+from django.db import migrations
+
+# Same conversion as 0015: existing values are kept as UTF-8 bytes and compressed later by compress_text_columns
+COMPRESSED_COLUMNS = [
+    ("document_ingestion_job_ranges", "extracted_text"),
+    ("document_ingestion_job_ranges", "summary"),
+]
+
+
+def text_to_bytea(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for table, column in COMPRESSED_COLUMNS:
+        schema_editor.execute(
+            f'ALTER TABLE "{table}" ALTER COLUMN "{column}" TYPE bytea USING convert_to("{column}", \'UTF8\')'
+        )
+
+
+def bytea_to_text(apps, schema_editor):
+    # Run `manage.py compress_text_columns --decompress` before reversing this migration
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for table, column in COMPRESSED_COLUMNS:
+        schema_editor.execute(
+            f'ALTER TABLE "{table}" ALTER COLUMN "{column}" TYPE text USING convert_from("{column}", \'UTF8\')'
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0031_compressed_chunk_text"),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(text_to_bytea, bytea_to_text),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name="ingestionjobrange",
+                    name="extracted_text",
+                    field=api.fields.CompressedTextField(blank=True),
+                ),
+                migrations.AlterField(
+                    model_name="ingestionjobrange",
+                    name="summary",
+                    field=api.fields.CompressedTextField(blank=True),
+                ),
+            ],
+        ),
+    ]
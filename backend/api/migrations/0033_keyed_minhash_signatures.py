@@ -0,0 +1,28 @@
+# Generated by Django 5.1.7 on 2026-10-18 09:20
+
+from django.db import migrations, models
+
+
+def reset_minhash_signatures(apps, schema_editor):
+    # Signatures are now keyed by difficulty and answer, so old ones no longer compare.
+    # They are signed again the next time a similarity index loads them.
+    for model_name in ("Quiz", "Flashcard", "Mnemonic", "PooledItem"):
+        apps.get_model("api", model_name).objects.filter(minhash__isnull=False).update(
+            minhash=None
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0032_compressed_ingestion_range_text"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="pooleditem",
+            name="minhash",
+            field=models.JSONField(null=True),
+        ),
+        migrations.RunPython(reset_minhash_signatures, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.1.7 on 2026-10-18 09:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0033_keyed_minhash_signatures"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="generationjob",
+            name="document_version",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="regeneration_jobs",
+                to="api.documentversion",
+            ),
+        ),
+    ]
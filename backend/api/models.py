@@ -1,32 +1,366 @@
 import os
 from django.db import models
+from django.db.models import Case, F, Q, Value, When
+from django.db.models.functions import Greatest
+from django.db.models.lookups import LessThanOrEqual
 from django.contrib.auth.models import User
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
 from datetime import timedelta
 
+from .fields import CompressedTextField
+
+class DocumentQuerySet(models.QuerySet):
+    def without_text(self):
+        """Skip the (large) extracted_text column; use api.chunking to read text on demand"""
+        return self.defer('extracted_text')
+
+
 class Document(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='documents')
     filename = models.CharField(max_length=255)
     size = models.FloatField()
     file_type = models.CharField(max_length=10)
     upload_date = models.DateTimeField(auto_now_add=True)
-    extracted_text = models.TextField()
-    summary = models.TextField(blank=True, null=True, help_text="AI-generated summary of the document content for quick overview")
+    extracted_text = CompressedTextField()
+    summary = CompressedTextField(blank=True, null=True, help_text="AI-generated summary of the document content for quick overview")
     
     # Spaced repetition fields
     next_review_date = models.DateTimeField(null=True, blank=True)
     review_interval_days = models.IntegerField(default=1)
     document_mastery_score = models.DecimalField(max_digits=3, decimal_places=2, default=0.00)
 
+    version = models.IntegerField(default=1)  # Incremented each time the file is replaced
+    # Completed quiz sessions, incremented on submission; every third one queues adaptive quizzes
+    completed_quiz_sessions = models.IntegerField(default=0)
+
+    # Filename and summary; the extracted text is searched through DocumentChunk (see api.search)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = DocumentQuerySet.as_manager()
+
     class Meta:
         db_table = 'documents'
+        indexes = [
+            GinIndex(fields=['search_vector']),
+        ]
 
     def __str__(self):
         name_part = self.filename if self.filename else "Unnamed Document"
         return f"{name_part} uploaded by {self.user.username} on {self.upload_date.strftime('%Y-%m-%d %H:%M')}"
 
 
+class DocumentChunk(models.Model):
+    """
+    Ordered slice of a document's extracted text, split at page and paragraph boundaries at ingest.
+    Offsets index into Document.extracted_text so ranges can be read without loading the whole text.
+    The text is compressed per chunk, so a range read only decompresses the chunks it overlaps.
+    """
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='chunks')
+    index = models.IntegerField()  # Position of the chunk within the document
+    start_offset = models.IntegerField()
+    end_offset = models.IntegerField()
+    page_number = models.IntegerField(null=True, blank=True)
+    text = CompressedTextField()
+    content_hash = models.CharField(max_length=64, blank=True)  # Whitespace-insensitive hash, used to diff versions
+    term_counts = models.JSONField(default=dict, blank=True)  # BM25 term frequencies, see api.retrieval
+    token_count = models.IntegerField(default=0)  # Model tokens in text, see api.tokens
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        db_table = 'document_chunks'
+        ordering = ['index']
+        unique_together = ['document', 'index']
+        indexes = [
+            models.Index(fields=['document', 'start_offset']),
+            models.Index(fields=['document', 'page_number']),
+            GinIndex(fields=['search_vector']),
+        ]
+
+    def __str__(self):
+        return f"Chunk {self.index} of document {self.document_id} ({self.start_offset}-{self.end_offset})"
+
+
+class DocumentVersion(models.Model):
+    """
+    Earlier content of a Document, archived when the file is replaced.
+    Also records which generated items went stale and the regeneration of the changed sections.
+    """
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='versions')
+    version = models.IntegerField()
+    filename = models.CharField(max_length=255)
+    size = models.FloatField()
+    file_type = models.CharField(max_length=10)
+    extracted_text = CompressedTextField()
+    summary = CompressedTextField(blank=True, null=True)
+    uploaded_at = models.DateTimeField()  # When this version was originally uploaded
+    replaced_at = models.DateTimeField(auto_now_add=True)
+
+    changed_chunks = models.IntegerField(default=0)  # Chunks of the new text not present in this version
+    kept_items = models.IntegerField(default=0)
+    stale_items = models.JSONField(default=dict)  # {'quizzes': {difficulty: n}, 'flashcards': {...}, 'mnemonics': [topics]}
+    regeneration_status = models.CharField(max_length=10, default='queued')  # queued/done/failed/skipped
+    regeneration_error = models.TextField(blank=True)
+
+    class Meta:
+        db_table = 'document_versions'
+        ordering = ['-version']
+        unique_together = ['document', 'version']
+
+    def __str__(self):
+        return f"Version {self.version} of document {self.document_id}"
+
+
+class BackgroundJob(models.Model):
+    """
+    Common fields for DB-backed jobs claimed by the local worker processes.
+    Workers claim queued rows with SELECT ... FOR UPDATE SKIP LOCKED (see api/jobs.py).
+    """
+    class Status(models.TextChoices):
+        QUEUED = 'queued', _('Queued')
+        RUNNING = 'running', _('Running')
+        DONE = 'done', _('Done')
+        FAILED = 'failed', _('Failed')
+
+    status = models.CharField(
+        max_length=10,
+        choices=Status.choices,
+        default=Status.QUEUED,
+    )
+    error = models.TextField(blank=True)
+    attempts = models.IntegerField(default=0)
+    locked_by = models.CharField(max_length=255, blank=True)  # Worker that claimed the job
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        abstract = True
+
+
+class DocumentIngestionJob(BackgroundJob):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='ingestion_jobs')
+    original_filename = models.CharField(max_length=255)
+    file_type = models.CharField(max_length=10)
+    size = models.FloatField()
+    content_sha256 = models.CharField(max_length=64, blank=True)  # Hashed while the upload streamed to disk
+    spool_path = models.CharField(max_length=500)  # Uploaded file waiting for the worker
+    document = models.ForeignKey(Document, on_delete=models.SET_NULL, null=True, blank=True, related_name='ingestion_jobs')
+    batch_id = models.UUIDField(null=True, blank=True)  # Set for files uploaded together through the batch endpoint
+    # Set when the upload replaces the file of an existing document instead of creating a new one
+    target_document = models.ForeignKey(Document, on_delete=models.CASCADE, null=True, blank=True, related_name='replacement_jobs')
+
+    class Meta:
+        db_table = 'document_ingestion_jobs'
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+            models.Index(fields=['user', 'batch_id']),
+        ]
+
+    def __str__(self):
+        return f"Ingestion of '{self.original_filename}' for {self.user.username} ({self.status})"
+
+
+class IngestionJobRange(models.Model):
+    """
+    Page range of a large PDF extracted independently of the rest of the document.
+    Ranges that finished survive a worker restart or a retry of the job, so only unfinished ranges
+    are extracted again. They are deleted once the job's Document is saved.
+    """
+    job = models.ForeignKey(DocumentIngestionJob, on_delete=models.CASCADE, related_name='ranges')
+    index = models.IntegerField()
+    first_page = models.IntegerField()  # 1-based, inclusive
+    last_page = models.IntegerField()  # 1-based, inclusive
+    status = models.CharField(
+        max_length=10,
+        choices=BackgroundJob.Status.choices,
+        default=BackgroundJob.Status.QUEUED,
+    )
+    extracted_text = CompressedTextField(blank=True)
+    summary = CompressedTextField(blank=True)
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'document_ingestion_job_ranges'
+        ordering = ['index']
+        unique_together = ['job', 'index']
+
+    def __str__(self):
+        return f"Pages {self.first_page}-{self.last_page} of ingestion job {self.job_id} ({self.status})"
+
+
+class GenerationJob(BackgroundJob):
+    """
+    Quiz, flashcard or mnemonic generation request, run by the generation worker
+    (process_generation_jobs) so web workers never wait on the model.
+    """
+    class Kind(models.TextChoices):
+        QUIZ = 'quiz', _('Quiz')
+        FLASHCARD = 'flashcard', _('Flashcard')
+        MNEMONIC = 'mnemonic', _('Mnemonic')
+        STUDY_PACK = 'study_pack', _('Study pack')
+        ADAPTIVE_QUIZ = 'adaptive_quiz', _('Adaptive quiz')
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='generation_jobs')
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='generation_jobs')
+    kind = models.CharField(max_length=20, choices=Kind.choices)
+    params = models.JSONField(default=dict)  # Validated request body
+    item_ids = models.JSONField(default=list)  # Ids of the saved items once done (study packs: in result)
+    result = models.JSONField(default=dict)  # Response body of the former synchronous endpoint
+    error_status = models.IntegerField(null=True, blank=True)  # HTTP status the error maps to
+    # Pool refill: items go to the document's PooledItem pool instead of being saved for the user.
+    # Refills are only claimed while no user request is waiting.
+    is_refill = models.BooleanField(default=False)
+    # Regeneration of the items that went stale when this version was replaced: the context is only
+    # the text that changed since (see api/versioning.py)
+    document_version = models.ForeignKey(
+        DocumentVersion, on_delete=models.SET_NULL, null=True, blank=True, related_name='regeneration_jobs'
+    )
+
+    class Meta:
+        db_table = 'generation_jobs'
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+        constraints = [
+            # Quiz submissions coalesce into the adaptive job already waiting for the document
+            models.UniqueConstraint(
+                fields=['user', 'document'],
+                condition=models.Q(kind='adaptive_quiz', status='queued'),
+                name='one_queued_adaptive_quiz_job',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} generation for {self.user.username} ({self.status})"
+
+
+class PooledItem(models.Model):
+    """
+    Generated quiz or flashcard item kept in reserve for a document and difficulty (see api/pools.py).
+    Generation requests take items from the pool before calling the model; refill jobs top it up.
+    """
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='pooled_items')
+    kind = models.CharField(max_length=20, choices=GenerationJob.Kind.choices)
+    difficulty = models.CharField(max_length=10)
+    item = models.JSONField()  # Generator output, validated when pooled and again when served
+    minhash = models.JSONField(null=True)  # MinHash signature, see api.similarity
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'generation_pool_items'
+        indexes = [
+            models.Index(fields=['document', 'kind', 'difficulty', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"Pooled {self.kind} ({self.difficulty}) for document {self.document_id}"
+
+
+class CompressionDictionary(models.Model):
+    """
+    Preset zlib dictionary trained on our own text (see train_compression_dictionary).
+    Compressed values reference the dictionary id, so rows must never be edited or deleted while in use.
+    """
+    data = models.BinaryField()
+    sample_count = models.IntegerField(default=0)
+    is_active = models.BooleanField(default=True)  # Used for new writes
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'compression_dictionaries'
+        verbose_name_plural = "Compression dictionaries"
+
+    def __str__(self):
+        return f"Compression dictionary {self.id} ({len(self.data)} bytes, {self.sample_count} samples)"
+
+
+class CacheStats(models.Model):
+    """
+    Hit/miss counters for the application-level caches (extraction cache, LLM response cache).
+    Lookups are counted per process and added in batches, see api/cache_stats.py.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    hits = models.BigIntegerField(default=0)
+    misses = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'cache_stats'
+        verbose_name_plural = "Cache stats"
+
+    def __str__(self):
+        return f"{self.name}: {self.hits} hits / {self.misses} misses"
+
+    @classmethod
+    def add(cls, name, hits, misses):
+        """Atomically add hits and misses to the counters of a cache"""
+        increments = {'hits': models.F('hits') + hits, 'misses': models.F('misses') + misses, 'updated_at': timezone.now()}
+        updated = cls.objects.filter(name=name).update(**increments)
+        if not updated:
+            cls.objects.get_or_create(name=name)
+            cls.objects.filter(name=name).update(**increments)
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class ExtractionCacheEntry(models.Model):
+    """
+    Extraction results keyed by the SHA-256 of the uploaded file.
+    Uploads with the same text but different bytes are stored as aliases of a canonical entry,
+    found through a 64-bit SimHash split into four 16-bit bands.
+    """
+    content_sha256 = models.CharField(max_length=64, unique=True)
+    canonical = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='aliases')
+    simhash = models.BigIntegerField()
+    simhash_band0 = models.IntegerField(db_index=True)
+    simhash_band1 = models.IntegerField(db_index=True)
+    simhash_band2 = models.IntegerField(db_index=True)
+    simhash_band3 = models.IntegerField(db_index=True)
+    extracted_text = CompressedTextField(blank=True)
+    summary = CompressedTextField(blank=True, null=True)
+    size = models.IntegerField(default=0)  # Bytes of cached text, used for size-based eviction
+    hit_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        db_table = 'extraction_cache'
+        verbose_name_plural = "Extraction cache entries"
+
+    def __str__(self):
+        return f"Extraction cache entry {self.content_sha256[:12]} ({self.hit_count} hits)"
+
+
+class LLMResponseCacheEntry(models.Model):
+    """
+    Raw generator response keyed by a hash of (normalised input text, generator, parameters, model, prompt version).
+    Shared by all users; responses are validated and saved the same way whether they come from here or the model.
+    """
+    key = models.CharField(max_length=64, unique=True)
+    generator = models.CharField(max_length=50)  # quiz, flashcard, mnemonic or study_plan
+    model_name = models.CharField(max_length=100, blank=True)
+    prompt_version = models.CharField(max_length=50, blank=True)
+    response = models.JSONField()
+    size = models.IntegerField(default=0)  # Bytes of the serialised response, used for size-based eviction
+    hit_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    last_used_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        db_table = 'llm_response_cache'
+        verbose_name_plural = "LLM response cache entries"
+
+    def __str__(self):
+        return f"{self.generator} response {self.key[:12]} ({self.hit_count} hits)"
+
+
 class Quiz(models.Model):
     class Difficulty(models.TextChoices):
         EASY = 'easy', _('Easy')
@@ -41,7 +375,7 @@ class Quiz(models.Model):
     option4 = models.CharField(max_length=500)
     correct_option_index = models.IntegerField() # Index 0-3 corresponding to options 1-4
     hint = models.TextField(blank=True)
-    explanation = models.TextField(blank=True)
+    explanation = CompressedTextField(blank=True)
     keywords = models.JSONField(default=list) # Store keywords as a JSON list
     difficulty = models.CharField(
         max_length=10,
@@ -53,8 +387,14 @@ class Quiz(models.Model):
     # Spaced repetition field
     mastery_score = models.DecimalField(max_digits=3, decimal_places=2, default=0.00)
 
+    search_vector = SearchVectorField(null=True, editable=False)
+    minhash = models.JSONField(null=True, blank=True, editable=False)  # MinHash signature, see api.similarity
+
     class Meta:
         db_table = 'quizzes'
+        indexes = [
+            GinIndex(fields=['search_vector']),
+        ]
         verbose_name_plural = "Quizzes"
 
     def __str__(self):
@@ -62,33 +402,108 @@ class Quiz(models.Model):
     
 
 class UserTokenUsage(models.Model):
+    class PlanTier(models.TextChoices):
+        FREE = 'free', _('Free')
+        PRO = 'pro', _('Pro')
+
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='token_usage')
     tokens_used = models.IntegerField(default=0)
     last_reset = models.DateTimeField(default=timezone.now)
     max_tokens = models.IntegerField(default=25000)  # Default token limit per 24 hours 
+    plan_tier = models.CharField(max_length=20, choices=PlanTier.choices, default=PlanTier.FREE)
+    # Estimated tokens of model calls in flight, held against the limit (see api.tokens.reserve_tokens)
+    tokens_reserved = models.IntegerField(default=0)
+
+    # The count starts again from 0 once this long has passed since last_reset
+    WINDOW = timedelta(hours=24)
 
     class Meta:
         db_table = 'user_token_usage'
 
     def __str__(self):
         return f"Token usage for {self.user.username}: {self.tokens_used}/{self.max_tokens}"
-    
+
+    @classmethod
+    def rolled_window(cls, now):
+        """
+        Update expressions starting a new window when the row's current one has passed. Every write
+        goes through them, so a passed window is rolled over by the next write instead of by reads.
+        """
+        expired = Q(last_reset__lt=now - cls.WINDOW)
+        return {
+            'tokens_used': Case(When(expired, then=Value(0)), default=F('tokens_used')),
+            'last_reset': Case(When(expired, then=Value(now)), default=F('last_reset')),
+            # Holds of calls that outlived their window lapse with it, so a crashed worker's hold can't stick
+            'tokens_reserved': Case(When(expired, then=Value(0)), default=F('tokens_reserved')),
+        }
+
     def reset_if_needed(self):
-        """Reset token count if 24 hours have passed since last reset"""
+        """Reset token count if 24 hours have passed since last reset (on this instance only; see rolled_window)"""
         now = timezone.now()
-        if now - self.last_reset > timedelta(hours=24):
+        if now - self.last_reset > self.WINDOW:
             self.tokens_used = 0
+            self.tokens_reserved = 0
             self.last_reset = now
-            self.save()
             return True
         return False
     
     def add_tokens(self, token_count):
         """Add tokens to the usage count and check if limit is exceeded"""
-        self.reset_if_needed()
-        self.tokens_used += token_count
-        self.save()
+        # Usage of a call made under a hold (api.tokens.reserve_tokens) replaces that much of the hold
+        from .tokens import settle_held_tokens
+        held, held_since = settle_held_tokens(self.user_id, token_count)
+        # A single UPDATE, so concurrent calls of one user don't overwrite each other's counts
+        window = self.rolled_window(timezone.now())
+        UserTokenUsage.objects.filter(pk=self.pk).update(**{
+            **window,
+            'tokens_used': window['tokens_used'] + token_count,
+            'tokens_reserved': self._released(window, held, held_since) if held else window['tokens_reserved'],
+        })
+        self.refresh_from_db(fields=['tokens_used', 'tokens_reserved', 'last_reset'])
+        from .usage_ledger import record_usage_event
+        record_usage_event(self.user_id, token_count)
         return self.tokens_used <= self.max_tokens
+
+    @classmethod
+    def _released(cls, window, token_count, held_since):
+        """
+        tokens_reserved less `token_count` tokens of a hold taken in the window started at `held_since`.
+        Holds lapse when their window rolls over, so one taken in an earlier window is not subtracted
+        from the holds of the current one.
+        """
+        return Case(
+            When(last_reset=held_since, then=Greatest(window['tokens_reserved'] - token_count, Value(0))),
+            default=window['tokens_reserved'],
+        )
+
+    @classmethod
+    def reserve(cls, user, token_count):
+        """
+        Hold `token_count` tokens for the user if they fit beside the window's usage and the other
+        holds, checked and taken in one conditional UPDATE. Returns the start (last_reset) of the
+        window the hold was taken in, or None if the tokens don't fit.
+        """
+        window = cls.rolled_window(timezone.now())
+        held = cls.objects.filter(
+            LessThanOrEqual(window['tokens_used'] + window['tokens_reserved'] + token_count, F('max_tokens')),
+            user=user,
+        ).update(**{
+            **window,
+            'tokens_reserved': window['tokens_reserved'] + token_count,
+        })
+        if not held:
+            return None
+        return cls.objects.filter(user=user).values_list('last_reset', flat=True).first()
+
+    @classmethod
+    def release(cls, user, token_count, held_since):
+        """
+        Drop what is left of a hold taken with reserve() in the window started at `held_since`.
+        Nothing is dropped if the window has rolled over since: the hold lapsed with it.
+        """
+        cls.objects.filter(user=user, last_reset=held_since).update(
+            tokens_reserved=Greatest(F('tokens_reserved') - token_count, Value(0))
+        )
     
     def remaining_tokens(self):
         """Get remaining token count"""
@@ -100,7 +515,69 @@ class UserTokenUsage(models.Model):
         self.reset_if_needed()
         return (self.tokens_used + required_tokens) <= self.max_tokens
 
+    def unreserved_tokens(self):
+        """Remaining tokens not held by calls in flight"""
+        self.reset_if_needed()
+        return max(0, self.max_tokens - self.tokens_used - self.tokens_reserved)
+
+
+
+
+class TokenUsageEvent(models.Model):
+    """
+    Append-only ledger of model token usage: one row per recorded call, attributed to the feature
+    that made it. Written in batches, which also update TokenUsageHourly (see api/usage_ledger.py).
+    """
+    class Feature(models.TextChoices):
+        QUIZ = 'quiz', _('Quiz')
+        FLASHCARD = 'flashcard', _('Flashcard')
+        MNEMONIC = 'mnemonic', _('Mnemonic')
+        STUDY_PACK = 'study_pack', _('Study pack')
+        ADAPTIVE_QUIZ = 'adaptive_quiz', _('Adaptive quiz')
+        SUMMARY = 'summary', _('Summary')
+        STUDY_PLAN = 'study_plan', _('Study plan')
+        OTHER = 'other', _('Other')
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='token_usage_events')
+    feature = models.CharField(max_length=20, choices=Feature.choices)
+    tokens = models.IntegerField()
+    created_at = models.DateTimeField(default=timezone.now)  # When the usage was recorded, not when the batch was written
+
+    class Meta:
+        db_table = 'token_usage_events'
+        indexes = [
+            models.Index(fields=['created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.tokens} {self.feature} tokens for user {self.user_id} at {self.created_at}"
+
+
+class TokenUsageHourly(models.Model):
+    """Tokens and calls of the usage ledger per user, feature and hour, kept current as events are written"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='token_usage_hours')
+    feature = models.CharField(max_length=20, choices=TokenUsageEvent.Feature.choices)
+    hour = models.DateTimeField()  # Start of the hour
+    tokens = models.BigIntegerField(default=0)
+    calls = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'token_usage_hourly'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'hour', 'feature'], name='unique_token_usage_hour'),
+        ]
+
+    def __str__(self):
+        return f"{self.tokens} {self.feature} tokens for user {self.user_id} in the hour from {self.hour}"
 
+    @classmethod
+    def add(cls, user_id, feature, hour, tokens, calls):
+        """Atomically add tokens and calls to the rollup row of a user, feature and hour"""
+        increments = {'tokens': F('tokens') + tokens, 'calls': F('calls') + calls}
+        updated = cls.objects.filter(user_id=user_id, feature=feature, hour=hour).update(**increments)
+        if not updated:
+            cls.objects.get_or_create(user_id=user_id, feature=feature, hour=hour)
+            cls.objects.filter(user_id=user_id, feature=feature, hour=hour).update(**increments)
 
 
 class QuizSession(models.Model):
@@ -150,9 +627,14 @@ class Flashcard(models.Model):
         default=Difficulty.MEDIUM,
     )
     created_at = models.DateTimeField(auto_now_add=True)
+    search_vector = SearchVectorField(null=True, editable=False)
+    minhash = models.JSONField(null=True, blank=True, editable=False)  # MinHash signature, see api.similarity
 
     class Meta:
         db_table = 'flashcards'
+        indexes = [
+            GinIndex(fields=['search_vector']),
+        ]
 
     def __str__(self):
         return f"Flashcard for '{self.document.filename}' (User: {self.user.username})"
@@ -212,9 +694,14 @@ class Mnemonic(models.Model):
     mnemonic_explanation = models.TextField()  # How the mnemonic helps remember the content
     topic = models.CharField(max_length=255)  # The topic/concept this mnemonic covers
     created_at = models.DateTimeField(auto_now_add=True)
+    search_vector = SearchVectorField(null=True, editable=False)
+    minhash = models.JSONField(null=True, blank=True, editable=False)  # MinHash signature, see api.similarity
     
     class Meta:
         db_table = 'mnemonics'
+        indexes = [
+            GinIndex(fields=['search_vector']),
+        ]
         
     def __str__(self):
         return f"Mnemonic for '{self.topic}' in document '{self.document.filename}' (User: {self.user.username})"
@@ -304,7 +791,7 @@ class StudyPlanStep(models.Model):
     )
     
     title = models.CharField(max_length=255)
-    description = models.TextField()
+    description = CompressedTextField()
     topic = models.CharField(max_length=255)
     estimated_duration = models.FloatField()  # Hours
     
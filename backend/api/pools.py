@@ -0,0 +1,101 @@
+import json
+import logging
+from django.conf import settings
+from django.db import transaction
+
+from .models import GenerationJob, PooledItem, Quiz, Flashcard, UserTokenUsage
+from .similarity import SimilarityIndex, item_signature
+from .serializers import QuizItemSerializer, FlashcardItemSerializer
+
+logger = logging.getLogger(__name__)
+
+# Kinds kept in pools: (model the items are saved as, serializer validating generator output)
+POOLED_KINDS = {
+    GenerationJob.Kind.QUIZ: (Quiz, QuizItemSerializer),
+    GenerationJob.Kind.FLASHCARD: (Flashcard, FlashcardItemSerializer),
+}
+
+
+def pool_target(user):
+    """Items kept per pool of the user's documents, by plan tier (GENERATION_POOL_TARGETS)"""
+    tier = UserTokenUsage.objects.filter(user=user).values_list('plan_tier', flat=True).first()
+    return settings.GENERATION_POOL_TARGETS.get(tier or UserTokenUsage.PlanTier.FREE, 0)
+
+
+def pooled_count(document, kind, difficulty):
+    return PooledItem.objects.filter(document=document, kind=kind, difficulty=difficulty).count()
+
+
+def take_pooled_items(document, kind, difficulty, count):
+    """
+    Remove up to `count` of the oldest pooled items of a document and difficulty and return them.
+    Rows are locked with SKIP LOCKED, so concurrent requests never serve the same item.
+    """
+    with transaction.atomic():
+        pooled = list(
+            PooledItem.objects.select_for_update(skip_locked=True)
+            .filter(document=document, kind=kind, difficulty=difficulty)
+            .order_by('created_at')[:count]
+        )
+        PooledItem.objects.filter(id__in=[item.id for item in pooled]).delete()
+    return [item.item for item in pooled]
+
+
+def pool_similarity_index(document, kind, difficulty):
+    """
+    Similarity index of the document's saved items plus its pooled ones, for checking refill output.
+    Pooled items without a signature (their signatures were reset) are signed and saved on load.
+    """
+    model, serializer_class = POOLED_KINDS[kind]
+    index = SimilarityIndex(model, document.id)
+    missing = []
+    for pooled in PooledItem.objects.filter(document=document, kind=kind, difficulty=difficulty):
+        if pooled.minhash is None:
+            item_serializer = serializer_class(data=pooled.item)
+            if not item_serializer.is_valid():
+                continue  # Dropped when served
+            pooled.minhash = item_signature(_unsaved_item(model, item_serializer.validated_data, difficulty))
+            missing.append(pooled)
+        index.add(f'pooled:{pooled.id}', pooled.minhash)
+    if missing:
+        PooledItem.objects.bulk_update(missing, ['minhash'])
+    return index
+
+
+def add_to_pool(document, kind, difficulty, items, index, limit=None):
+    """
+    Validate generated items and pool the valid ones, skipping near duplicates of the document's
+    saved and pooled items and stopping after `limit` items. Returns (pooled items, error messages).
+    """
+    model, serializer_class = POOLED_KINDS[kind]
+    pooled = []
+    errors = []
+    for item in items:
+        if limit is not None and len(pooled) >= limit:
+            break
+        item_serializer = serializer_class(data=item)
+        if not item_serializer.is_valid():
+            errors.append(f"Invalid {kind} data received: {json.dumps(item_serializer.errors)}")
+            continue
+        # Sign the item as it will be saved, so served items compare the same way
+        signature = item_signature(_unsaved_item(model, item_serializer.validated_data, difficulty))
+        if index.find_duplicate(signature) is not None:
+            index.duplicates_dropped += 1
+            continue
+        pooled.append(PooledItem(document=document, kind=kind, difficulty=difficulty, item=item, minhash=signature))
+        index.add(f'pooled:{len(index.signatures)}', signature)
+    PooledItem.objects.bulk_create(pooled)
+    logger.info(f"Pooled {len(pooled)} {kind} items ({difficulty}) for document {document.id}")
+    return pooled, errors
+
+
+def _unsaved_item(model, validated_data, difficulty):
+    if model is Quiz:
+        options = validated_data["options"]
+        return Quiz(
+            question=validated_data["question"],
+            option1=options[0], option2=options[1], option3=options[2], option4=options[3],
+            correct_option_index=validated_data["correct_option_index"],
+            difficulty=difficulty,
+        )
+    return Flashcard(front=validated_data["front"], back=validated_data["back"], difficulty=difficulty)
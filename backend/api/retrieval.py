@@ -0,0 +1,268 @@
+import re
+import math
+import logging
+from collections import Counter
+from django.conf import settings
+from django.db.models import Sum
+
+from .models import DocumentChunk
+from .compression import decompress_text
+from .tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Weight of relevance against novelty when picking chunks (maximal marginal relevance)
+MMR_LAMBDA = 0.7
+# Query terms taken from the document itself when the request has no topics
+AUTO_QUERY_TERMS = 30
+# Items assumed for budgeting when a request has no item count (mnemonics)
+DEFAULT_CONTEXT_ITEMS = 5
+
+_TERM_RE = re.compile(r"[a-z][a-z0-9'\-]{2,}")
+STOP_WORDS = frozenset("""
+    about above after again against all also and any are because been before being below between both but
+    can could did does doing down during each few for from further had has have having her here hers herself
+    him himself his how into its itself just more most not now off once only other our ours out over own same
+    she should some such than that the their theirs them then there these they this those through too under
+    until very was were what when where which while who whom why will with would you your yours
+""".split())
+
+
+def term_counts(text):
+    """Term frequencies of a chunk for the BM25 index (lowercased words, stop words removed)"""
+    return dict(Counter(term for term in _TERM_RE.findall(text.lower()) if term not in STOP_WORDS))
+
+
+def _fill_chunk_counts(chunks):
+    """Compute counts missing on chunks stored before they were recorded at ingest"""
+    for chunk in chunks:
+        if not chunk['term_counts']:
+            chunk['term_counts'] = term_counts(chunk['text'])
+        if not chunk['token_count']:
+            chunk['token_count'] = count_tokens(chunk['text'])
+    return chunks
+
+
+class ChunkIndex:
+    """BM25 index over the chunks of one document, built from the term counts stored at ingest"""
+
+    def __init__(self, chunks):
+        # chunks: dicts with index, text, term_counts and token_count
+        self.chunks = chunks
+        for chunk in chunks:
+            chunk['length'] = sum(chunk['term_counts'].values())
+        self.average_length = sum(chunk['length'] for chunk in chunks) / len(chunks) if chunks else 0
+        self.document_frequency = Counter(term for chunk in chunks for term in chunk['term_counts'])
+
+    def idf(self, term):
+        n = self.document_frequency.get(term, 0)
+        return math.log(1 + (len(self.chunks) - n + 0.5) / (n + 0.5))
+
+    def score(self, chunk, query_terms):
+        counts = chunk['term_counts']
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * chunk['length'] / (self.average_length or 1))
+        total = 0.0
+        for term in query_terms:
+            tf = counts.get(term, 0)
+            if tf:
+                total += self.idf(term) * tf * (BM25_K1 + 1) / (tf + norm)
+        return total
+
+    def characteristic_terms(self, limit=AUTO_QUERY_TERMS):
+        """Terms that best describe the whole document (frequent overall, but not in every chunk)"""
+        totals = Counter()
+        for chunk in self.chunks:
+            totals.update(chunk['term_counts'])
+        return [term for term, _ in sorted(totals.items(), key=lambda item: -item[1] * self.idf(item[0]))[:limit]]
+
+
+def _similarity(a, b):
+    """Cosine similarity of two term-count vectors"""
+    if len(a) > len(b):
+        a, b = b, a
+    dot = sum(count * b.get(term, 0) for term, count in a.items())
+    if not dot:
+        return 0.0
+    return dot / (math.sqrt(sum(c * c for c in a.values())) * math.sqrt(sum(c * c for c in b.values())))
+
+
+def context_token_budget(number_of_items):
+    """Prompt budget for the document context: grows with the items requested, capped by the setting"""
+    return min(
+        settings.GENERATION_CONTEXT_TOKEN_BUDGET,
+        max(settings.GENERATION_CONTEXT_MIN_TOKENS, number_of_items * settings.GENERATION_CONTEXT_TOKENS_PER_ITEM),
+    )
+
+
+def estimate_context_tokens(document, number_of_items):
+    """Tokens select_generation_context will send, from the stored chunk counts without loading any text"""
+    total = DocumentChunk.objects.filter(document=document).aggregate(total=Sum('token_count'))['total'] or 0
+    return min(total, context_token_budget(number_of_items))
+
+
+def select_chunks(chunks, token_budget, query_text=None):
+    """
+    Pick a relevant but diverse subset of chunks that fits `token_budget`, returned in document order.
+    Relevance is BM25 against the query (or the document's own characteristic terms); each pick
+    is penalised by its similarity to chunks already chosen, so the context covers different sections.
+    """
+    index = ChunkIndex(chunks)
+    query_terms = list(term_counts(query_text or '')) or index.characteristic_terms()
+    relevance = {chunk['index']: index.score(chunk, query_terms) for chunk in chunks}
+    top_relevance = max(relevance.values(), default=0) or 1
+
+    selected = []
+    remaining = list(chunks)
+    novelty_penalty = {chunk['index']: 0.0 for chunk in chunks}
+    used_tokens = 0
+    while remaining:
+        best = max(
+            remaining,
+            key=lambda chunk: MMR_LAMBDA * relevance[chunk['index']] / top_relevance
+            - (1 - MMR_LAMBDA) * novelty_penalty[chunk['index']],
+        )
+        remaining.remove(best)
+        tokens = best['token_count']
+        if used_tokens + tokens > token_budget:
+            if selected:
+                continue
+            # Always return something, even if a single chunk is over budget
+            text = best['text'][:len(best['text']) * token_budget // tokens]
+            best = dict(best, text=text, token_count=count_tokens(text))
+            tokens = best['token_count']
+        selected.append(best)
+        used_tokens += tokens
+        for chunk in remaining:
+            similarity = _similarity(chunk['term_counts'], best['term_counts'])
+            if similarity > novelty_penalty[chunk['index']]:
+                novelty_penalty[chunk['index']] = similarity
+
+    return sorted(selected, key=lambda chunk: chunk['index'])
+
+
+def _generation_chunks(document, number_of_items, query_text=None, exclude_hashes=None):
+    """
+    Chunks of `document` to send to a generator, in document order: all of them if they fit
+    the budget, otherwise the ones chosen by select_chunks. Chunks whose content hash is in
+    `exclude_hashes` are left out. Returns (chunks, whole document?).
+    """
+    queryset = DocumentChunk.objects.filter(document=document)
+    if exclude_hashes is not None:
+        queryset = queryset.exclude(content_hash__in=exclude_hashes)
+    chunks = list(queryset.order_by('index').values('index', 'text', 'term_counts', 'token_count'))
+    for chunk in chunks:
+        chunk['text'] = decompress_text(chunk['text'])
+    if not chunks and exclude_hashes is None:
+        # Documents ingested before chunking are chunked on first use
+        from .chunking import create_document_chunks, load_document_text
+        text = load_document_text(document)
+        if not text:
+            return [], True
+        chunks = [
+            {'index': chunk.index, 'text': chunk.text, 'term_counts': chunk.term_counts, 'token_count': chunk.token_count}
+            for chunk in create_document_chunks(document, text)
+        ]
+    _fill_chunk_counts(chunks)
+
+    token_budget = context_token_budget(number_of_items)
+    if sum(chunk['token_count'] for chunk in chunks) <= token_budget:
+        return chunks, exclude_hashes is None
+
+    selected = select_chunks(chunks, token_budget, query_text)
+    logger.info(
+        f"Selected {len(selected)} of {len(chunks)} chunks of document {document.id} "
+        f"for a {token_budget}-token generation context"
+    )
+    return selected, False
+
+
+def _join_chunks(chunks, whole_document):
+    if whole_document:
+        # Consecutive chunks of the whole text join back into the original text
+        return ''.join(chunk['text'] for chunk in chunks)
+    return '\n\n'.join(chunk['text'].strip() for chunk in chunks)
+
+
+def select_generation_context(document, number_of_items, query_text=None):
+    """
+    Text of `document` to send to a generator: the whole text if it fits the budget, otherwise
+    the chunks chosen by select_chunks joined in document order.
+    Returns (text, token count); ('', 0) for documents without text.
+    """
+    chunks, whole_document = _generation_chunks(document, number_of_items, query_text)
+    return _join_chunks(chunks, whole_document), sum(chunk['token_count'] for chunk in chunks)
+
+
+def split_generation_context(document, item_counts, query_text=None, exclude_hashes=None):
+    """
+    Context for sum(item_counts) items split into one disjoint part per entry of `item_counts`,
+    each with a share of the chunks proportional to its item count. Parts follow document order.
+    Returns a list of (text, token count, item count); when there are fewer chunks than parts,
+    the items of parts left without text go to the part before. Empty for documents without text
+    (or without chunks outside `exclude_hashes`).
+    """
+    chunks, whole_document = _generation_chunks(document, sum(item_counts), query_text, exclude_hashes)
+    if not chunks:
+        return []
+
+    total_items = sum(item_counts)
+    total_tokens = sum(chunk['token_count'] for chunk in chunks)
+    parts = []
+    start = 0
+    running_tokens = 0
+    items_before = 0
+    for part_index, count in enumerate(item_counts):
+        items_before += count
+        later_parts = len(item_counts) - part_index - 1
+        target = total_tokens * items_before / total_items
+        end = start
+        # Take chunks until this part's share of the tokens is reached, leaving a chunk for each later part
+        while end < len(chunks) and (
+            end == start or (running_tokens < target and end < len(chunks) - later_parts) or not later_parts
+        ):
+            running_tokens += chunks[end]['token_count']
+            end += 1
+        part = chunks[start:end]
+        if part:
+            parts.append((_join_chunks(part, whole_document), sum(chunk['token_count'] for chunk in part), count))
+        else:
+            text, tokens, previous_count = parts[-1]
+            parts[-1] = (text, tokens, previous_count + count)
+        start = end
+    return parts
+
+
+class TopicMatcher:
+    """
+    Matches topics (e.g. of study plan activities) to documents by the terms of their filenames and
+    summaries. The term index is built once, so each match is a few dict lookups rather than a scan
+    over every summary.
+    """
+
+    def __init__(self, documents):
+        self.documents = list(documents)
+        self.postings = {}  # Term -> positions of the documents containing it
+        for position, document in enumerate(self.documents):
+            for term in term_counts(f"{document.filename} {document.summary or ''}"):
+                self.postings.setdefault(term, set()).add(position)
+        self._matches = {}
+
+    def match(self, topic):
+        """
+        Document sharing the most topic terms, terms found in fewer documents counting more;
+        the first document if none shares any, None without a topic or documents.
+        """
+        if not topic or not self.documents:
+            return None
+        key = topic.lower().strip()
+        if key not in self._matches:
+            scores = Counter()
+            for term in term_counts(key):
+                positions = self.postings.get(term, ())
+                for position in positions:
+                    scores[position] += 1 / len(positions)
+            best = min(scores, key=lambda position: (-scores[position], position)) if scores else 0
+            self._matches[key] = self.documents[best]
+        return self._matches[key]
@@ -0,0 +1,234 @@
+import json
+import base64
+import logging
+from django.conf import settings
+from django.contrib.postgres.search import SearchVector, SearchQuery, SearchRank, SearchHeadline
+from django.db import connection
+from django.db.models import F, Q, Value, TextField, FloatField
+from django.db.models.functions import Cast
+
+from .models import Document, DocumentChunk, Quiz, Flashcard, Mnemonic
+from .compression import decompress_text
+
+logger = logging.getLogger(__name__)
+
+CHUNK_INDEX_BATCH_SIZE = 500
+HEADLINE_OPTIONS = {'max_words': 35, 'min_words': 15, 'max_fragments': 2, 'start_sel': '<mark>', 'stop_sel': '</mark>'}
+
+
+class SearchCursorError(ValueError):
+    pass
+
+
+def _vector(*weighted_fields):
+    vector = None
+    for field, weight in weighted_fields:
+        part = SearchVector(field, weight=weight, config=settings.SEARCH_CONFIG)
+        vector = part if vector is None else vector + part
+    return vector
+
+
+# Columns indexed per model, with their weight. Document.summary and DocumentChunk.text are compressed
+# in the database, so documents and chunks are indexed from Python values instead.
+SEARCH_FIELDS = {
+    Quiz: [('question', 'A'), ('option1', 'C'), ('option2', 'C'), ('option3', 'C'), ('option4', 'C')],
+    Flashcard: [('front', 'A'), ('back', 'B')],
+    Mnemonic: [('topic', 'A'), ('mnemonic', 'B')],
+}
+
+
+def refresh_search_vectors(model, queryset=None):
+    """Recompute the search vector of the given rows (all rows of `model` by default) in one UPDATE"""
+    if model is Document:
+        return refresh_document_vectors(queryset)
+    if model is DocumentChunk:
+        return refresh_chunk_vectors(queryset)
+    queryset = model.objects.all() if queryset is None else queryset
+    return queryset.update(search_vector=_vector(*SEARCH_FIELDS[model]))
+
+
+def refresh_document_vectors(queryset=None):
+    """Recompute document vectors from filename and (decompressed) summary"""
+    queryset = Document.objects.all() if queryset is None else queryset
+    updated = 0
+    for document_id, filename, summary in queryset.values_list('id', 'filename', 'summary').iterator():
+        updated += Document.objects.filter(pk=document_id).update(search_vector=_vector(
+            (Value(filename, output_field=TextField()), 'A'),
+            (Value(decompress_text(summary) or '', output_field=TextField()), 'B'),
+        ))
+    return updated
+
+
+def refresh_chunk_vectors(queryset=None):
+    """Recompute chunk vectors from the (decompressed) chunk text, one UPDATE per CHUNK_INDEX_BATCH_SIZE chunks"""
+    queryset = DocumentChunk.objects.all() if queryset is None else queryset
+    updated = 0
+    batch = []
+    for row in queryset.values_list('id', 'text').iterator():
+        batch.append(row)
+        if len(batch) == CHUNK_INDEX_BATCH_SIZE:
+            updated += _update_chunk_vectors(batch)
+            batch = []
+    if batch:
+        updated += _update_chunk_vectors(batch)
+    return updated
+
+
+def _update_chunk_vectors(rows):
+    params = [settings.SEARCH_CONFIG]
+    for chunk_id, text in rows:
+        params += [chunk_id, decompress_text(text) or '']
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE "{DocumentChunk._meta.db_table}" AS chunk '
+            f"SET search_vector = setweight(to_tsvector(%s::regconfig, v.text), 'B') "
+            f"FROM (VALUES {', '.join(['(%s, %s)'] * len(rows))}) AS v(id, text) WHERE chunk.id = v.id",
+            params,
+        )
+        return cursor.rowcount
+
+
+def index_document(document):
+    """Index a document and all of its chunks, after ingestion or replacement"""
+    refresh_document_vectors(Document.objects.filter(pk=document.pk))
+    refresh_search_vectors(DocumentChunk, DocumentChunk.objects.filter(document=document))
+
+
+def index_items(items):
+    """Index freshly saved quizzes, flashcards or mnemonics"""
+    by_model = {}
+    for item in items:
+        by_model.setdefault(type(item), []).append(item.pk)
+    for model, ids in by_model.items():
+        refresh_search_vectors(model, model.objects.filter(pk__in=ids))
+
+
+def encode_cursor(rank, type_name, item_id):
+    payload = json.dumps([rank, type_name, item_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        rank, type_name, item_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return float(rank), str(type_name), int(item_id)
+    except (ValueError, TypeError) as e:
+        raise SearchCursorError("Invalid cursor.") from e
+
+
+def _after_cursor(type_name, cursor):
+    """Rows ordered after the cursor in (rank desc, type, id) order"""
+    rank, cursor_type, cursor_id = cursor
+    if type_name > cursor_type:
+        return Q(rank__lte=rank)
+    if type_name < cursor_type:
+        return Q(rank__lt=rank)
+    return Q(rank__lt=rank) | Q(rank=rank, id__gt=cursor_id)
+
+
+def _search_querysets(user):
+    return {
+        'document': (Document.objects.without_text().filter(user=user), 'filename'),
+        'document_text': (DocumentChunk.objects.filter(document__user=user), 'text'),
+        'quiz': (Quiz.objects.filter(user=user), 'question'),
+        'flashcard': (Flashcard.objects.filter(user=user), 'front'),
+        'mnemonic': (Mnemonic.objects.filter(user=user), 'topic'),
+    }
+
+
+SEARCH_TYPES = ('document', 'document_text', 'quiz', 'flashcard', 'mnemonic')
+
+
+def search(user, query_text, types=None, limit=None, cursor=None):
+    """
+    Ranked full-text search over a user's documents, document text and generated study items.
+    Each type is ranked by its own GIN-indexed query; the per-type top rows are merged in
+    (rank desc, type, id) order, which the opaque cursor continues from.
+    Returns (hits, next_cursor); snippets are only computed for the returned page.
+    """
+    query = SearchQuery(query_text, search_type='websearch', config=settings.SEARCH_CONFIG)
+    limit = limit or settings.SEARCH_PAGE_SIZE
+    cursor = decode_cursor(cursor) if cursor else None
+
+    candidates = []
+    querysets = _search_querysets(user)
+    for type_name in types or SEARCH_TYPES:
+        queryset, _ = querysets[type_name]
+        queryset = queryset.filter(search_vector=query).annotate(
+            # ts_rank is a float4; as float8 it round-trips exactly through the cursor
+            rank=Cast(SearchRank(F('search_vector'), query), FloatField())
+        )
+        if cursor:
+            queryset = queryset.filter(_after_cursor(type_name, cursor))
+        for item_id, rank in queryset.order_by('-rank', 'id').values_list('id', 'rank')[:limit + 1]:
+            candidates.append((-rank, type_name, item_id))
+
+    candidates.sort()
+    page = candidates[:limit]
+    next_cursor = None
+    if len(candidates) > limit:
+        rank, type_name, item_id = page[-1]
+        next_cursor = encode_cursor(-rank, type_name, item_id)
+
+    return _build_hits(querysets, query, query_text, page), next_cursor
+
+
+def _build_hits(querysets, query, query_text, page):
+    ids_by_type = {}
+    for _, type_name, item_id in page:
+        ids_by_type.setdefault(type_name, []).append(item_id)
+
+    rows = {}
+    for type_name, ids in ids_by_type.items():
+        queryset, headline_field = querysets[type_name]
+        if type_name == 'document':
+            # Summary is compressed in the database; highlight it from Python values
+            for document in queryset.filter(id__in=ids).only('id', 'filename', 'summary'):
+                rows[(type_name, document.id)] = {
+                    'document_id': document.id,
+                    'title': document.filename,
+                    'snippet': _headline_for_value(document.summary or document.filename, query_text),
+                }
+            continue
+
+        if type_name == 'document_text':
+            # Chunk text is compressed in the database too
+            chunks = queryset.filter(id__in=ids).select_related('document').only(
+                'id', 'page_number', 'text', 'document', 'document__filename'
+            )
+            for chunk in chunks:
+                rows[(type_name, chunk.id)] = {
+                    'document_id': chunk.document_id,
+                    'title': chunk.document.filename,
+                    'page': chunk.page_number,
+                    'snippet': _headline_for_value(chunk.text, query_text),
+                }
+            continue
+
+        queryset = queryset.filter(id__in=ids).annotate(
+            snippet=SearchHeadline(headline_field, query, config=settings.SEARCH_CONFIG, **HEADLINE_OPTIONS)
+        )
+        title_field = {'quiz': 'question', 'flashcard': 'front', 'mnemonic': 'topic'}[type_name]
+        for item in queryset.only('id', 'document_id', title_field):
+            rows[(type_name, item.id)] = {
+                'document_id': item.document_id,
+                'title': getattr(item, title_field),
+                'snippet': item.snippet,
+            }
+
+    hits = []
+    for negative_rank, type_name, item_id in page:
+        row = rows.get((type_name, item_id))
+        if row is not None:
+            hits.append({'type': type_name, 'id': item_id, 'rank': round(-negative_rank, 6), **row})
+    return hits
+
+
+def _headline_for_value(text, query_text):
+    options = 'MaxWords=35, MinWords=15, MaxFragments=2, StartSel=<mark>, StopSel=</mark>'
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT ts_headline(%s::regconfig, %s, websearch_to_tsquery(%s::regconfig, %s), %s)",
+            [settings.SEARCH_CONFIG, text, settings.SEARCH_CONFIG, query_text, options],
+        )
+        return cursor.fetchone()[0]
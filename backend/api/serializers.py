@@ -1,10 +1,13 @@
+from django.conf import settings
 from django.contrib.auth.models import User
 from rest_framework import serializers
 from .models import (
     Document, Quiz, UserTokenUsage, QuizAnswer, Flashcard, FlashcardReview, 
-    QuizSession, Mnemonic, StudyPlan, StudyPlanStep, StudyPlanResource
+    QuizSession, Mnemonic, StudyPlan, StudyPlanStep, StudyPlanResource, DocumentIngestionJob,
+    IngestionJobRange, DocumentVersion, GenerationJob
 )
 from django.shortcuts import get_object_or_404
+from .search import SEARCH_TYPES
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -51,6 +54,65 @@ class DocumentSerializer(serializers.ModelSerializer):
         return instance
 
 
+class IngestionJobRangeSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = IngestionJobRange
+        fields = ['index', 'first_page', 'last_page', 'status', 'attempts', 'error', 'finished_at']
+        read_only_fields = fields
+
+
+class DocumentIngestionJobSerializer(serializers.ModelSerializer):
+    """
+    Serializer for reporting the status of a queued document upload.
+    Large PDFs extracted in page ranges also report per-range status and overall progress (0-1).
+    """
+    job_id = serializers.IntegerField(source='id', read_only=True)
+    document_id = serializers.IntegerField(read_only=True, allow_null=True)
+    ranges = IngestionJobRangeSerializer(many=True, read_only=True)
+    progress = serializers.SerializerMethodField()
+
+    class Meta:
+        model = DocumentIngestionJob
+        fields = ['job_id', 'batch_id', 'status', 'original_filename', 'file_type', 'size', 'document_id',
+                  'error', 'ranges', 'progress', 'created_at', 'started_at', 'finished_at']
+        read_only_fields = fields
+
+    def get_progress(self, obj):
+        if obj.status == DocumentIngestionJob.Status.DONE:
+            return 1.0
+        ranges = obj.ranges.all()
+        if not ranges:
+            return 0.0
+        done = sum(1 for r in ranges if r.status == DocumentIngestionJob.Status.DONE)
+        return round(done / len(ranges), 2)
+
+
+class GenerationJobSerializer(serializers.ModelSerializer):
+    """
+    Serializer for reporting the status of a queued quiz, flashcard or mnemonic generation.
+    error_status is the HTTP status a failed generation maps to (e.g. 403 when the token limit is exceeded);
+    a done generation's result carries its own `status` (207 when some items failed validation or saving).
+    """
+    job_id = serializers.IntegerField(source='id', read_only=True)
+
+    class Meta:
+        model = GenerationJob
+        fields = ['job_id', 'kind', 'status', 'document_id', 'item_ids', 'result', 'error', 'error_status',
+                  'created_at', 'started_at', 'finished_at']
+        read_only_fields = fields
+
+
+class DocumentVersionSerializer(serializers.ModelSerializer):
+    """
+    Serializer for the version history of a document (archived text is not included).
+    """
+    class Meta:
+        model = DocumentVersion
+        fields = ['version', 'filename', 'size', 'file_type', 'uploaded_at', 'replaced_at',
+                  'changed_chunks', 'kept_items', 'stale_items', 'regeneration_status', 'regeneration_error']
+        read_only_fields = fields
+
+
 class QuizSerializer(serializers.ModelSerializer):
     options = serializers.SerializerMethodField()
 
@@ -77,6 +139,54 @@ class QuizGenerationRequestSerializer(serializers.Serializer):
     document_id = serializers.IntegerField(required=True)
     difficulty = serializers.ChoiceField(choices=Quiz.Difficulty.choices, required=True)
     number_of_quizzes = serializers.IntegerField(required=True, min_value=1, max_value=30) # Max 30 quizzes per request
+    use_cache = serializers.BooleanField(required=False, default=True)  # False skips the LLM response cache
+
+
+class SearchRequestSerializer(serializers.Serializer):
+    """
+    Serializer for validating search query parameters.
+    types is a comma-separated subset of document, document_text, quiz, flashcard, mnemonic.
+    """
+    q = serializers.CharField(required=True, max_length=200)
+    types = serializers.CharField(required=False)
+    limit = serializers.IntegerField(required=False, min_value=1, max_value=settings.SEARCH_MAX_PAGE_SIZE)
+    cursor = serializers.CharField(required=False)
+
+    def validate_types(self, value):
+        types = [t.strip() for t in value.split(',') if t.strip()]
+        unknown = [t for t in types if t not in SEARCH_TYPES]
+        if unknown:
+            raise serializers.ValidationError(f"Unknown search types: {', '.join(unknown)}")
+        return types
+
+
+class GenerationEstimateRequestSerializer(serializers.Serializer):
+    """
+    Serializer for validating a generation cost estimate request.
+    quiz/flashcard need document_id and number_of_items, mnemonic needs document_id (topics and
+    instructions optional), study_plan needs document_ids and days_until_exam.
+    """
+    KIND_CHOICES = [('quiz', 'Quiz'), ('flashcard', 'Flashcard'), ('mnemonic', 'Mnemonic'), ('study_plan', 'Study plan')]
+
+    kind = serializers.ChoiceField(choices=KIND_CHOICES, required=True)
+    document_id = serializers.IntegerField(required=False)
+    document_ids = serializers.ListField(child=serializers.IntegerField(), required=False, allow_empty=False)
+    number_of_items = serializers.IntegerField(required=False, min_value=1, max_value=30)
+    topics = serializers.ListField(child=serializers.CharField(max_length=255), required=False, allow_empty=True)
+    instructions = serializers.CharField(required=False, allow_blank=True, allow_null=True)
+    days_until_exam = serializers.IntegerField(required=False, min_value=1)
+
+    def validate(self, data):
+        required = {
+            'quiz': ['document_id', 'number_of_items'],
+            'flashcard': ['document_id', 'number_of_items'],
+            'mnemonic': ['document_id'],
+            'study_plan': ['document_ids', 'days_until_exam'],
+        }[data['kind']]
+        missing = {field: ["This field is required."] for field in required if field not in data}
+        if missing:
+            raise serializers.ValidationError(missing)
+        return data
 
 
 class QuizItemSerializer(serializers.Serializer):
@@ -108,16 +218,28 @@ class UserTokenUsageSerializer(serializers.ModelSerializer):
         model = UserTokenUsage
         fields = [
             'tokens_used', 
+            'tokens_reserved',
             'max_tokens',
             'remaining_tokens',
-            'last_reset'
+            'last_reset',
+            'plan_tier'
         ]
         read_only_fields = fields
 
+    def to_representation(self, instance):
+        # A passed window is only rolled over by the next write; show the new window already
+        instance.reset_if_needed()
+        return super().to_representation(instance)
+
     def get_remaining_tokens(self, obj):
         return obj.remaining_tokens()
 
 
+class TokenUsageBreakdownRequestSerializer(serializers.Serializer):
+    """Serializer for validating token usage breakdown query parameters"""
+    days = serializers.IntegerField(required=False, default=7, min_value=1, max_value=90)
+
+
 class AnswerSerializer(serializers.Serializer):
     quiz_id = serializers.IntegerField()
     selected_option_index = serializers.IntegerField(min_value=0, max_value=3)
@@ -133,7 +255,7 @@ class QuizSubmissionSerializer(serializers.Serializer):
         user = self.context['request'].user
 
         # Verify document exists and belongs to the user
-        document = get_object_or_404(Document, pk=document_id, user=user)
+        document = get_object_or_404(Document.objects.without_text(), pk=document_id, user=user)
         
         # Get all quizzes for this document and user
         quizzes = Quiz.objects.filter(document=document, user=user)
@@ -193,6 +315,7 @@ class FlashcardGenerationRequestSerializer(serializers.Serializer):
     document_id = serializers.IntegerField(required=True)
     difficulty = serializers.ChoiceField(choices=Flashcard.Difficulty.choices, required=True)
     number_of_flashcards = serializers.IntegerField(required=True, min_value=1, max_value=20) # Max 20 flashcards per request
+    use_cache = serializers.BooleanField(required=False, default=True)  # False skips the LLM response cache
 
 
 class FlashcardItemSerializer(serializers.Serializer):
@@ -249,7 +372,7 @@ class FlashcardReviewRequestSerializer(serializers.Serializer):
         user = self.context['request'].user
 
         # Verify document exists and belongs to the user
-        document = get_object_or_404(Document, pk=document_id, user=user)
+        document = get_object_or_404(Document.objects.without_text(), pk=document_id, user=user)
         
         # Get flashcard IDs in this document
         flashcards = Flashcard.objects.filter(document=document, user=user)
@@ -319,6 +442,31 @@ class MnemonicGenerationRequestSerializer(serializers.Serializer):
         allow_empty=True
     )
     instructions = serializers.CharField(required=False, allow_blank=True, allow_null=True)
+    use_cache = serializers.BooleanField(required=False, default=True)  # False skips the LLM response cache
+
+
+class StudyPackGenerationRequestSerializer(serializers.Serializer):
+    """
+    Serializer for validating the request body for study pack generation
+    (quizzes, flashcards and mnemonics of a document from one generator call).
+    number_of_mnemonics is used when no topics are given.
+    """
+    document_id = serializers.IntegerField(required=True)
+    difficulty = serializers.ChoiceField(choices=Quiz.Difficulty.choices, required=True)
+    number_of_quizzes = serializers.IntegerField(required=False, default=10, min_value=0, max_value=30)
+    number_of_flashcards = serializers.IntegerField(required=False, default=10, min_value=0, max_value=30)
+    number_of_mnemonics = serializers.IntegerField(required=False, default=5, min_value=0, max_value=15)
+    topics = serializers.ListField(
+        child=serializers.CharField(max_length=255),
+        required=False,
+        allow_empty=True
+    )
+    use_cache = serializers.BooleanField(required=False, default=True)  # False skips the LLM response cache
+
+    def validate(self, data):
+        if not (data['number_of_quizzes'] or data['number_of_flashcards'] or data['number_of_mnemonics'] or data.get('topics')):
+            raise serializers.ValidationError("Request at least one quiz, flashcard or mnemonic.")
+        return data
 
 
 class MnemonicItemSerializer(serializers.Serializer):
@@ -456,6 +604,11 @@ class StudyPlanGenerationRequestSerializer(serializers.Serializer):
         allow_blank=True,
         help_text="Additional context about the exam or study requirements"
     )
+    use_cache = serializers.BooleanField(
+        required=False,
+        default=True,
+        help_text="Set to false to skip the LLM response cache"
+    )
     
     def validate_document_ids(self, value):
         if not value:
@@ -0,0 +1,172 @@
+import re
+import random
+import hashlib
+import logging
+from django.conf import settings
+
+from .models import Quiz, Flashcard
+from .retrieval import STOP_WORDS
+
+logger = logging.getLogger(__name__)
+
+MINHASH_PERMUTATIONS = 64
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+# Fixed seed: signatures stored in the database must stay comparable across processes
+_rng = random.Random(20240601)
+_PERMUTATIONS = [
+    (_rng.randint(1, _MERSENNE_PRIME - 1), _rng.randint(0, _MERSENNE_PRIME - 1))
+    for _ in range(MINHASH_PERMUTATIONS)
+]
+
+_WORD_RE = re.compile(r'\w+')
+# Words are cut to this many letters, a crude stem so "produces" and "producing" match
+STEM_LETTERS = 5
+# Answers of at most this many words (a term, a name, a date) must match exactly for items to be compared
+ANSWER_KEY_MAX_WORDS = 6
+
+
+def item_text(item):
+    """Text an item is compared by: what the learner reads and the answer it expects"""
+    if isinstance(item, Quiz):
+        return f"{item.question} {item_answer(item)}"
+    if isinstance(item, Flashcard):
+        return f"{item.front} {item.back}"
+    return f"{item.topic} {item.mnemonic}"
+
+
+def item_answer(item):
+    """The answer an item expects: a quiz's correct option or a flashcard's back (mnemonics have none)"""
+    if isinstance(item, Quiz):
+        options = [item.option1, item.option2, item.option3, item.option4]
+        return options[item.correct_option_index] if 0 <= item.correct_option_index < 4 else ''
+    if isinstance(item, Flashcard):
+        return item.back
+    return ''
+
+
+def item_key(item):
+    """
+    What two items must share to be compared at all: their difficulty and, when it is short, their
+    exact answer. Different questions often share most of their words ("When did World War I begin?",
+    "When did World War II begin?") but not their answer, and a question asked at another difficulty
+    is kept for that difficulty.
+    """
+    answer = _WORD_RE.findall(item_answer(item).lower())
+    return f"{getattr(item, 'difficulty', '')}|{' '.join(answer) if len(answer) <= ANSWER_KEY_MAX_WORDS else ''}"
+
+
+def item_signature(item):
+    """MinHash signature an item is stored and compared with"""
+    return minhash_signature(item_text(item), key=item_key(item))
+
+
+def _terms(text):
+    # Short words only count if they are numerals or acronyms ("World War I", "UK")
+    return [
+        word.lower()[:STEM_LETTERS] for word in _WORD_RE.findall(text)
+        if (len(word) > 2 or word.isupper() or word.isdigit()) and word.lower() not in STOP_WORDS
+    ]
+
+
+def shingles(text):
+    """
+    Stemmed content words of the text, and each pair of adjacent ones. The words match rewordings,
+    which keep the terms but rarely their order; the pairs keep apart texts that share most of their
+    words but not how they go together.
+    """
+    terms = _terms(text)
+    return set(terms) | {f"{first} {second}" for first, second in zip(terms, terms[1:])}
+
+
+def minhash_signature(text, key=''):
+    """
+    MinHash signature of the text's shingles, a list of MINHASH_PERMUTATIONS 32-bit ints. Shingles
+    are hashed together with `key`, so texts of different keys share no values and never match.
+    """
+    hashes = [
+        int.from_bytes(hashlib.blake2b(f"{key}\x00{shingle}".encode('utf-8'), digest_size=8).digest(), 'big')
+        for shingle in shingles(text)
+    ]
+    if not hashes:
+        return [_MAX_HASH] * MINHASH_PERMUTATIONS
+    return [min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes) for a, b in _PERMUTATIONS]
+
+
+def estimated_similarity(a, b):
+    """Estimated Jaccard similarity of the shingle sets behind two signatures"""
+    return sum(1 for x, y in zip(a, b) if x == y) / MINHASH_PERMUTATIONS
+
+
+class SimilarityIndex:
+    """
+    MinHash signatures of one document's quizzes, flashcards or mnemonics, for checking new items
+    before they are saved. Items stored before signatures existed are signed (and saved) on load.
+    """
+
+    def __init__(self, model, document_id, exclude_ids=()):
+        self.model = model
+        self.signatures = {}
+        self.duplicates_dropped = 0
+
+        missing = []
+        queryset = model.objects.filter(document_id=document_id).exclude(id__in=exclude_ids)
+        for item in queryset.defer('search_vector'):
+            if item.minhash is None:
+                item.minhash = item_signature(item)
+                missing.append(item)
+            self.signatures[item.pk] = item.minhash
+        if missing:
+            model.objects.bulk_update(missing, ['minhash'], batch_size=500)
+
+    def find_duplicate(self, signature):
+        """Id of the most similar indexed item at or above SIMILARITY_DUPLICATE_THRESHOLD, or None"""
+        best_id, best_similarity = None, settings.SIMILARITY_DUPLICATE_THRESHOLD
+        for item_id, indexed in self.signatures.items():
+            similarity = estimated_similarity(signature, indexed)
+            if similarity >= best_similarity:
+                best_id, best_similarity = item_id, similarity
+        return best_id
+
+    def add(self, item_id, signature):
+        self.signatures[item_id] = signature
+
+
+def remove_new_duplicates(model, document_id, new_ids):
+    """
+    Delete freshly saved items (e.g. from the adaptive generator, which saves on its own) that
+    near-duplicate an older item of the document or an earlier new item; sign the ones kept.
+    Returns the ids kept.
+    """
+    new_ids = sorted(new_ids)
+    index = SimilarityIndex(model, document_id, exclude_ids=new_ids)
+    kept, duplicates = [], []
+    for item in model.objects.filter(id__in=new_ids).defer('search_vector').order_by('id'):
+        item.minhash = item_signature(item)
+        if index.find_duplicate(item.minhash) is not None:
+            duplicates.append(item.pk)
+            continue
+        index.add(item.pk, item.minhash)
+        kept.append(item)
+    model.objects.bulk_update(kept, ['minhash'])
+    if duplicates:
+        model.objects.filter(id__in=duplicates).delete()
+        logger.info(f"Removed {len(duplicates)} near-duplicate new {model._meta.verbose_name_plural.lower()} of document {document_id}")
+    return [item.pk for item in kept]
+
+
+def near_duplicates(model, document_id):
+    """
+    Near-duplicate items of a document as {duplicate id: id of the item it repeats}. Items are
+    compared oldest first, so the item kept of each group is the one created first.
+    """
+    index = SimilarityIndex(model, document_id)
+    signatures, index.signatures = index.signatures, {}
+    duplicates = {}
+    for item_id in sorted(signatures):
+        keeper_id = index.find_duplicate(signatures[item_id])
+        if keeper_id is None:
+            index.add(item_id, signatures[item_id])
+        else:
+            duplicates[item_id] = keeper_id
+    return duplicates
@@ -0,0 +1,74 @@
+import json
+import time
+import logging
+from django.conf import settings
+from rest_framework.renderers import BaseRenderer
+
+from .models import GenerationJob, Quiz, Flashcard, Mnemonic
+from .serializers import QuizSerializer, FlashcardSerializer, MnemonicSerializer
+
+logger = logging.getLogger(__name__)
+
+ITEM_MODELS = {
+    GenerationJob.Kind.QUIZ: (Quiz, QuizSerializer),
+    GenerationJob.Kind.FLASHCARD: (Flashcard, FlashcardSerializer),
+    GenerationJob.Kind.MNEMONIC: (Mnemonic, MnemonicSerializer),
+    GenerationJob.Kind.ADAPTIVE_QUIZ: (Quiz, QuizSerializer),
+}
+
+# Delay EventSource clients wait before reconnecting once a stream window closes
+RECONNECT_MILLISECONDS = 500
+
+
+class EventStreamRenderer(BaseRenderer):
+    """Lets views accept `Accept: text/event-stream`; event bodies are written by the streaming response itself"""
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Only error responses (e.g. 404) are rendered; send them as a single error event
+        return sse_event('error', data)
+
+
+def sse_event(event, data, event_id=None):
+    id_line = f"id: {event_id}\n" if event_id is not None else ''
+    return f"{id_line}event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def generation_job_events(job, last_event_id=0):
+    """
+    Server-Sent Events for a generation job: one `item` event per saved item as the worker saves
+    it, then `done` with the job result (whose `status` is 207 if some items failed) or `error` with
+    the failure and its HTTP status.
+    A stream stays open for at most GENERATION_STREAM_WINDOW seconds, so it holds a web worker for
+    a few seconds rather than the whole generation. Item events are numbered by their position in
+    job.item_ids; the client reconnects with the last number it saw as `last_event_id` and only
+    gets the items after it. The job row is re-read every GENERATION_STREAM_POLL_INTERVAL seconds.
+    Study packs save all their items at once and leave item_ids empty, so they only send `done`.
+    """
+    model, serializer_class = ITEM_MODELS.get(job.kind, (None, None))
+    sent = last_event_id
+    started = time.monotonic()
+    yield f"retry: {RECONNECT_MILLISECONDS}\n\n"
+    while True:
+        job.refresh_from_db(fields=['status', 'item_ids', 'result', 'error', 'error_status'])
+
+        new_ids = job.item_ids[sent:]
+        if new_ids:
+            items = model.objects.in_bulk(new_ids)
+            for item_id in new_ids:
+                sent += 1
+                if item_id in items:
+                    yield sse_event('item', serializer_class(items[item_id]).data, event_id=sent)
+
+        if job.status == GenerationJob.Status.DONE:
+            yield sse_event('done', {**job.result, 'item_ids': job.item_ids})
+            return
+        if job.status == GenerationJob.Status.FAILED:
+            yield sse_event('error', {'error': job.error, 'status': job.error_status})
+            return
+        if time.monotonic() - started >= settings.GENERATION_STREAM_WINDOW:
+            # The job keeps running; the client reconnects and continues after the last item it got
+            return
+        time.sleep(settings.GENERATION_STREAM_POLL_INTERVAL)
@@ -0,0 +1,106 @@
+import json
+import logging
+import threading
+from django.conf import settings
+from openai import AzureOpenAI
+
+from .models import Mnemonic
+from .tokens import count_tokens, estimate_study_pack_tokens, record_token_usage
+from .llm_gateway import llm_call
+
+logger = logging.getLogger(__name__)
+
+
+class StudyPackGenerationError(Exception):
+    """Study pack generation failed; status_code is the HTTP status to report"""
+    def __init__(self, message, status_code=500):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+# The document comes first and the task after it, so the long part of the prompt is an identical
+# prefix across requests for the same document (and eligible for the provider's prompt caching)
+SYSTEM_PROMPT = """You are an expert educator creating study material from a document.
+Use only facts stated in the document. Reply with a single JSON object and nothing else."""
+
+TASK_PROMPT = """From the document above, create a study pack at {difficulty} difficulty:
+- {number_of_quizzes} multiple-choice quizzes
+- {number_of_flashcards} flashcards
+- {mnemonic_task}
+Quizzes, flashcards and mnemonics must not repeat each other's questions.
+
+Return JSON of this shape:
+{{
+  "quizzes": [{{"question": "...", "options": ["...", "...", "...", "..."], "correct_option_index": 0,
+                "hint": "...", "explanation": "...", "keywords": ["..."]}}],
+  "flashcards": [{{"front": "...", "back": "...", "hint": "...", "keywords": ["..."]}}],
+  "mnemonics": [{{"mnemonic": "...", "mnemonic_type": "one of {mnemonic_types}",
+                  "mnemonic_explanation": "...", "topic": "..."}}]
+}}"""
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def _get_client():
+    """Azure OpenAI client, created once per process"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = AzureOpenAI(
+                    azure_endpoint=settings.AZURE_OPENAI_ENDPOINT,
+                    api_key=settings.AZURE_OPENAI_API_KEY,
+                    api_version=settings.AZURE_OPENAI_API_VERSION,
+                )
+    return _client
+
+
+def _messages(text_content, difficulty, number_of_quizzes, number_of_flashcards, number_of_mnemonics, topics):
+    if topics:
+        mnemonic_task = f"one mnemonic for each of these topics: {', '.join(topics)}"
+    else:
+        mnemonic_task = f"{number_of_mnemonics} mnemonics for the document's key facts"
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": f"Document:\n\"\"\"\n{text_content}\n\"\"\""},
+        {"role": "user", "content": TASK_PROMPT.format(
+            difficulty=difficulty,
+            number_of_quizzes=number_of_quizzes,
+            number_of_flashcards=number_of_flashcards,
+            mnemonic_task=mnemonic_task,
+            mnemonic_types=', '.join(Mnemonic.MnemonicType.values),
+        )},
+    ]
+
+
+def generate_study_pack_from_text(text_content, difficulty, number_of_quizzes, number_of_flashcards,
+                                  number_of_mnemonics, topics, user):
+    """
+    Generate quizzes, flashcards and mnemonics for `text_content` in one model call, made through
+    the LLM gateway (which retries overload errors). Tokens used are added to the user's usage.
+    Returns {"quizzes": [...], "flashcards": [...], "mnemonics": [...]}; raises
+    StudyPackGenerationError if the response can't be used.
+    """
+    messages = _messages(text_content, difficulty, number_of_quizzes, number_of_flashcards, number_of_mnemonics, topics)
+    item_counts = {'quiz': number_of_quizzes, 'flashcard': number_of_flashcards, 'mnemonic': number_of_mnemonics or len(topics or [])}
+    response = llm_call(
+        lambda: _get_client().chat.completions.create(
+            model=settings.LLM_MODEL,
+            messages=messages,
+            response_format={"type": "json_object"},
+        ),
+        estimated_tokens=estimate_study_pack_tokens(count_tokens(text_content), item_counts)['total_tokens'],
+        label='study pack',
+    )
+
+    if response.usage:
+        record_token_usage(user, response.usage.total_tokens)
+    try:
+        data = json.loads(response.choices[0].message.content)
+    except (TypeError, ValueError) as e:
+        logger.warning(f"Study pack response is not valid JSON: {e}")
+        raise StudyPackGenerationError("The AI returned an invalid study pack.", status_code=502)
+    if not isinstance(data, dict):
+        raise StudyPackGenerationError("The AI returned an invalid study pack.", status_code=502)
+    return {key: data.get(key) or [] for key in ('quizzes', 'flashcards', 'mnemonics')}
@@ -1,3 +1,1421 @@
-from django.test import TestCase
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+import jwt
+from pypdf import PdfWriter
+from rest_framework.exceptions import AuthenticationFailed, PermissionDenied
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from backend.supabase_auth import SupabaseJWTAuthentication, VerifiedTokenCache
+
+from .buffering import BufferedWriter
+from .cache_stats import flush_cache_stats, record_cache_lookup
+from .chunking import create_document_chunks, load_document_text, read_document_page, read_document_range, split_into_chunks
+from .compression import TextCompressionError, compress_text, decompress_text, is_compressed, reset_dictionary_cache
+from .extraction_cache import (
+    NEAR_DUPLICATE_MAX_DISTANCE, compute_simhash, hamming_distance, lookup_extraction_cache, store_extraction_result,
+)
+from .generation import (
+    GENERATORS, _generation_estimate, generation_part_counts, enqueue_adaptive_quiz_job, enqueue_generation_job, enqueue_pool_refill, prewarm_document_pools,
+    _job_parts, record_regeneration, run_generation_job, run_pool_refill_job, run_study_pack_job,
+)
+from .ingestion import abandon_ingestion_job, claimable_ingestion_jobs, enqueue_document_batch, run_ingestion_job
+from .jobs import claim_jobs, mark_job_done, mark_job_failed, requeue_stale_jobs
+from .llm_gateway import CircuitBreaker, LLMGateway, LLMUnavailable
+from .models import (
+    BackgroundJob, CacheStats, CompressionDictionary, Document, DocumentChunk, DocumentIngestionJob, ExtractionCacheEntry, Flashcard,
+    GenerationJob, Quiz, StudyPlan, TokenUsageEvent, TokenUsageHourly, UserTokenUsage,
+)
+from .pools import add_to_pool, pool_similarity_index, pooled_count, take_pooled_items
+from .retrieval import TopicMatcher, select_chunks, split_generation_context, term_counts
+from .search import SearchCursorError, decode_cursor, encode_cursor, index_items, search
+from .similarity import SimilarityIndex, estimated_similarity, item_signature, minhash_signature
+from .streaming import generation_job_events
+from .tokens import record_token_usage, reserve_tokens
+from .usage_ledger import flush_usage_events, record_usage_event, usage_feature
+from .versioning import attribute_to_chunks, enqueue_regeneration_jobs, replace_document_content
+from .views import (
+    DocumentProcessView, GenerationEstimateView, GenerationJobView, QuizGenerationView, StudyPlanGenerateView, TokenUsageBreakdownView,
+)
+
+
+def _ingestion_job(user, name='notes.pdf', **fields):
+    fields.setdefault('spool_path', f'/tmp/{name}')
+    return DocumentIngestionJob.objects.create(user=user, original_filename=name, file_type='pdf', size=1.0, **fields)
+
+
+class ClaimJobsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='worker-test')
+
+    def test_claims_oldest_queued_jobs_and_marks_them_running(self):
+        first = _ingestion_job(self.user, 'a.pdf')
+        second = _ingestion_job(self.user, 'b.pdf')
+        _ingestion_job(self.user, 'c.pdf', status=BackgroundJob.Status.DONE)
+
+        jobs = claim_jobs(DocumentIngestionJob.objects.all(), 'host:1', limit=5)
+
+        self.assertEqual([job.id for job in jobs], [first.id, second.id])
+        first.refresh_from_db()
+        self.assertEqual(first.status, BackgroundJob.Status.RUNNING)
+        self.assertEqual(first.locked_by, 'host:1')
+        self.assertEqual(first.attempts, 1)
+        self.assertIsNotNone(first.started_at)
+
+    def test_claimed_jobs_are_not_claimed_again(self):
+        _ingestion_job(self.user)
+        self.assertEqual(len(claim_jobs(DocumentIngestionJob.objects.all(), 'host:1')), 1)
+        self.assertEqual(claim_jobs(DocumentIngestionJob.objects.all(), 'host:2'), [])
+
+    def test_requeue_stale_jobs(self):
+        stale = _ingestion_job(self.user, 'stale.pdf', status=BackgroundJob.Status.RUNNING, locked_by='host:1')
+        fresh = _ingestion_job(self.user, 'fresh.pdf', status=BackgroundJob.Status.RUNNING, locked_by='host:1')
+        DocumentIngestionJob.objects.filter(pk=stale.pk).update(started_at=timezone.now() - timedelta(hours=2))
+        DocumentIngestionJob.objects.filter(pk=fresh.pk).update(started_at=timezone.now())
+
+        self.assertEqual(requeue_stale_jobs(DocumentIngestionJob.objects.all(), timedelta(hours=1)), 1)
+        stale.refresh_from_db()
+        self.assertEqual((stale.status, stale.locked_by), (BackgroundJob.Status.QUEUED, ''))
+
+    @override_settings(STALE_JOB_MAX_ATTEMPTS=2)
+    def test_stale_job_is_abandoned_after_its_last_attempt(self):
+        with tempfile.NamedTemporaryFile(delete=False) as spooled:
+            pass
+        retried = _ingestion_job(self.user, 'retried.pdf', status=BackgroundJob.Status.RUNNING, attempts=1)
+        given_up = _ingestion_job(self.user, 'huge.pdf', status=BackgroundJob.Status.RUNNING, attempts=2, spool_path=spooled.name)
+        DocumentIngestionJob.objects.update(started_at=timezone.now() - timedelta(hours=2))
+
+        requeued = requeue_stale_jobs(DocumentIngestionJob.objects.all(), timedelta(hours=1), abandon=abandon_ingestion_job)
+
+        self.assertEqual(requeued, 1)
+        retried.refresh_from_db()
+        given_up.refresh_from_db()
+        self.assertEqual(retried.status, BackgroundJob.Status.QUEUED)
+        self.assertEqual(given_up.status, BackgroundJob.Status.FAILED)
+        self.assertIn('stopped responding', given_up.error)
+        self.assertFalse(os.path.exists(spooled.name))
+
+
+@skipUnless(connection.vendor == 'postgresql', "SKIP LOCKED needs PostgreSQL")
+class ClaimJobsConcurrencyTests(TransactionTestCase):
+    def test_rows_locked_by_another_worker_are_skipped(self):
+        user = User.objects.create(username='worker-test')
+        locked = _ingestion_job(user, 'a.pdf')
+        free = _ingestion_job(user, 'b.pdf')
+        row_locked = threading.Event()
+        release = threading.Event()
+
+        def hold_lock():
+            try:
+                with transaction.atomic():
+                    list(DocumentIngestionJob.objects.select_for_update().filter(pk=locked.pk))
+                    row_locked.set()
+                    release.wait(10)
+            finally:
+                connection.close()
+
+        holder = threading.Thread(target=hold_lock)
+        holder.start()
+        try:
+            self.assertTrue(row_locked.wait(10))
+            jobs = claim_jobs(DocumentIngestionJob.objects.all(), 'host:2')
+        finally:
+            release.set()
+            holder.join()
+
+        self.assertEqual([job.id for job in jobs], [free.id])
+
+
+class ExtractionCacheTests(TestCase):
+    def setUp(self):
+        self.addCleanup(flush_cache_stats)
+        self.text = ' '.join(f"lecture{i % 211} covers topic{i % 173} in depth" for i in range(600))
+
+    def test_edited_text_keeps_its_own_entry(self):
+        words = self.text.split()
+        for i in range(0, len(words), len(words) // 20):
+            words[i] = 'corrected'
+        edited = ' '.join(words)
+        # Close enough to be an alias candidate
+        self.assertLessEqual(hamming_distance(compute_simhash(self.text), compute_simhash(edited)), NEAR_DUPLICATE_MAX_DISTANCE)
+
+        store_extraction_result('a' * 64, self.text, 'original summary')
+        entry = store_extraction_result('b' * 64, edited, 'edited summary')
+
+        self.assertIsNone(entry.canonical_id)
+        self.assertEqual(lookup_extraction_cache('a' * 64), (self.text, 'original summary'))
+        self.assertEqual(lookup_extraction_cache('b' * 64), (edited, 'edited summary'))
+
+    def test_same_text_with_different_bytes_is_stored_as_alias(self):
+        original = store_extraction_result('a' * 64, self.text, 'summary')
+        alias = store_extraction_result('b' * 64, self.text.replace(' ', '\n', 50), 'other summary')
+
+        self.assertEqual(alias.canonical_id, original.id)
+        self.assertEqual(lookup_extraction_cache('b' * 64), (self.text, 'summary'))
+        self.assertEqual(ExtractionCacheEntry.objects.get(pk=original.pk).hit_count, 1)
+
+    def test_miss(self):
+        self.assertIsNone(lookup_extraction_cache('c' * 64))
+        flush_cache_stats()
+        self.assertEqual(CacheStats.objects.values_list('name', 'hits', 'misses').get(), ('extraction', 0, 1))
+
+
+@override_settings(BUFFER_BATCH_SIZE=3, BUFFER_FLUSH_SECONDS=60)
+class BufferedWriterTests(SimpleTestCase):
+    def setUp(self):
+        self.batches = []
+        self.written = threading.Event()
+        self.buffer = BufferedWriter(self.write, 'BUFFER_BATCH_SIZE', 'BUFFER_FLUSH_SECONDS')
+
+    def write(self, records):
+        self.batches.append(records)
+        self.written.set()
+        return len(records)
+
+    def test_full_batch_is_written_right_away(self):
+        for record in range(4):
+            self.buffer.add(record)
+
+        self.assertEqual(self.batches, [[0, 1, 2]])
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(self.buffer.flush(), 0)
+        self.assertEqual(self.batches, [[0, 1, 2], [3]])
+
+    @override_settings(BUFFER_FLUSH_SECONDS=0.01)
+    def test_records_are_written_after_the_flush_interval(self):
+        self.buffer.add('event')
+
+        self.assertTrue(self.written.wait(timeout=5))
+        self.assertEqual(self.batches, [['event']])
+
+
+class CacheStatsTests(TestCase):
+    def setUp(self):
+        self.addCleanup(flush_cache_stats)
+
+    @override_settings(CACHE_STATS_BATCH_SIZE=100, CACHE_STATS_FLUSH_SECONDS=60)
+    def test_lookups_are_written_in_one_update_per_cache(self):
+        CacheStats.objects.bulk_create([CacheStats(name='llm:quiz'), CacheStats(name='extraction')])
+        for hit in [True, True, False]:
+            record_cache_lookup('llm:quiz', hit)
+        record_cache_lookup('extraction', False)
+        self.assertEqual(CacheStats.objects.filter(hits=0, misses=0).count(), 2)
+
+        with self.assertNumQueries(2):
+            self.assertEqual(flush_cache_stats(), 4)
+        self.assertEqual(
+            list(CacheStats.objects.order_by('name').values_list('name', 'hits', 'misses')),
+            [('extraction', 0, 1), ('llm:quiz', 2, 1)],
+        )
+
+    @override_settings(CACHE_STATS_BATCH_SIZE=3, CACHE_STATS_FLUSH_SECONDS=60)
+    def test_full_batch_is_written_right_away(self):
+        CacheStats.objects.create(name='llm:quiz', hits=10)
+        for _ in range(3):
+            record_cache_lookup('llm:quiz', True)
+        self.assertEqual(CacheStats.objects.get(name='llm:quiz').hits, 13)
+
+
+def _paged_text(pages=3, paragraphs=6):
+    return '\f'.join(
+        '\n\n'.join(f"Page {page} paragraph {paragraph}. " + 'Cells divide by mitosis. ' * 12 for paragraph in range(paragraphs))
+        for page in range(1, pages + 1)
+    )
+
+
+class SplitIntoChunksTests(SimpleTestCase):
+    def test_chunks_reproduce_the_text_and_never_cross_pages(self):
+        text = _paged_text()
+        chunks = split_into_chunks(text, target_chars=500)
+
+        self.assertEqual(''.join(chunk['text'] for chunk in chunks), text)
+        self.assertEqual([chunk['index'] for chunk in chunks], list(range(len(chunks))))
+        for chunk in chunks:
+            self.assertEqual(text[chunk['start_offset']:chunk['end_offset']], chunk['text'])
+            self.assertNotIn('\f', chunk['text'].rstrip('\f'))
+            self.assertIn(f"Page {chunk['page_number']} ", chunk['text'])
+        self.assertEqual({chunk['page_number'] for chunk in chunks}, {1, 2, 3})
+
+    def test_long_pages_are_cut_at_paragraph_breaks(self):
+        chunks = split_into_chunks(_paged_text(pages=1), target_chars=500)
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks[1:]:
+            self.assertTrue(chunk['text'].startswith('Page 1 paragraph'))
+
+    def test_content_hash_ignores_whitespace(self):
+        first, = split_into_chunks('Cells  divide\nby mitosis.')
+        second, = split_into_chunks('Cells divide by   mitosis.')
+        self.assertEqual(first['content_hash'], second['content_hash'])
+
+    def test_empty_text(self):
+        self.assertEqual(split_into_chunks(''), [])
+
+
+@mock.patch('api.chunking.index_document')
+class DocumentRangeReadTests(TestCase):
+    def setUp(self):
+        user = User.objects.create(username='reader')
+        self.text = _paged_text()
+        self.document = Document.objects.create(user=user, filename='notes.pdf', size=1.0, file_type='pdf', extracted_text='')
+
+    def test_range_and_page_reads_match_the_text(self, index_document):
+        create_document_chunks(self.document, self.text)
+
+        for start, end in [(0, 10), (450, 1900), (0, len(self.text)), (len(self.text) - 5, len(self.text) + 50)]:
+            self.assertEqual(read_document_range(self.document, start, end), self.text[start:end])
+        self.assertEqual(read_document_page(self.document, 2), self.text.split('\f')[1] + '\f')
+        self.assertIsNone(read_document_page(self.document, 9))
+        self.assertEqual(load_document_text(self.document), self.text)
+
+    def test_chunk_text_is_stored_compressed(self, index_document):
+        create_document_chunks(self.document, self.text)
+        stored = DocumentChunk.objects.filter(document=self.document).values_list('text', flat=True)
+        self.assertTrue(all(is_compressed(value) for value in stored))
+
+
+class TextCompressionTests(TestCase):
+    text = 'The mitochondria is the powerhouse of the cell. ' * 40
+
+    def tearDown(self):
+        reset_dictionary_cache()
+
+    def test_round_trip(self):
+        for value in ['', 'short', self.text, '\x00starts with NUL ' * 10, '\x00', 'ünïcödé ' * 30]:
+            self.assertEqual(decompress_text(compress_text(value)), value)
+
+    def test_short_values_are_stored_as_plain_text(self):
+        self.assertEqual(compress_text('short'), b'short')
+        self.assertFalse(is_compressed(compress_text('short')))
+
+    def test_long_values_are_compressed(self):
+        encoded = compress_text(self.text)
+        self.assertTrue(is_compressed(encoded))
+        self.assertLess(len(encoded), len(self.text) // 5)
+
+    def test_preset_dictionary(self):
+        dictionary = CompressionDictionary.objects.create(data=b'powerhouse of the cell mitochondria')
+        encoded = compress_text(self.text, dictionary=(dictionary.id, bytes(dictionary.data)))
+        self.assertEqual(encoded[:2], b'\x00d')
+        reset_dictionary_cache()
+        self.assertEqual(decompress_text(encoded), self.text)
+
+    def test_legacy_values(self):
+        self.assertEqual(decompress_text('plain text row'), 'plain text row')
+        self.assertEqual(decompress_text(memoryview(b'utf-8 bytes')), 'utf-8 bytes')
+        self.assertIsNone(decompress_text(None))
+
+    def test_unknown_format(self):
+        with self.assertRaises(TextCompressionError):
+            decompress_text(b'\x00?garbage')
+
+
+class CompressedTextFieldTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='reader')
+        self.text = 'Photosynthesis converts light into chemical energy. ' * 50
+
+    def test_round_trip(self):
+        document = Document.objects.create(user=self.user, filename='a.pdf', size=1.0, file_type='pdf', extracted_text=self.text)
+
+        stored = Document.objects.filter(pk=document.pk).values_list('extracted_text', flat=True).get()
+        self.assertTrue(is_compressed(stored))
+        self.assertEqual(Document.objects.get(pk=document.pk).extracted_text, self.text)
+
+    def test_unread_values_are_saved_back_unchanged(self):
+        document = Document.objects.create(user=self.user, filename='a.pdf', size=1.0, file_type='pdf', extracted_text=self.text)
+        stored = Document.objects.filter(pk=document.pk).values_list('extracted_text', flat=True).get()
+
+        loaded = Document.objects.get(pk=document.pk)
+        loaded.filename = 'b.pdf'
+        with mock.patch('api.fields.compress_text') as compress:
+            loaded.save()
+        compress.assert_not_called()
+        self.assertEqual(Document.objects.filter(pk=document.pk).values_list('extracted_text', flat=True).get(), stored)
+
+
+@skipUnless(connection.vendor == 'postgresql', "Migration 0015 only converts columns on PostgreSQL")
+class CompressedColumnsMigrationTests(TransactionTestCase):
+    before = [('api', '0014_document_chunk')]
+    after = [('api', '0015_compressed_text_columns')]
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_existing_text_is_kept(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        old_apps = executor.loader.project_state(self.before).apps
+        user = old_apps.get_model('auth', 'User').objects.create(username='legacy')
+        text = 'C:\\notes\\week1 \\x00 stays intact'
+        document = old_apps.get_model('api', 'Document').objects.create(
+            user_id=user.id, filename='a.pdf', size=1.0, file_type='pdf', extracted_text=text, summary=None
+        )
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.after)
+        new_apps = executor.loader.project_state(self.after).apps
+        migrated = new_apps.get_model('api', 'Document').objects.get(pk=document.pk)
+        self.assertEqual(decompress_text(migrated.extracted_text), text)
+        self.assertIsNone(migrated.summary)
+
+
+@override_settings(INGESTION_RANGE_PAGES=2, INGESTION_RANGE_RETRIES=0, INGESTION_JOB_MAX_ATTEMPTS=2)
+@mock.patch('api.ingestion.prewarm_document_pools')
+@mock.patch('api.chunking.index_document')
+class PageRangeIngestionTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='uploader')
+        spool_dir = tempfile.mkdtemp()
+        self.spool_path = os.path.join(spool_dir, 'lecture.pdf')
+        writer = PdfWriter()
+        for _ in range(5):
+            writer.add_blank_page(width=200, height=200)
+        with open(self.spool_path, 'wb') as pdf_file:
+            writer.write(pdf_file)
+        self.job = DocumentIngestionJob.objects.create(
+            user=self.user, original_filename='lecture.pdf', file_type='pdf', size=1.0, spool_path=self.spool_path
+        )
+        self.calls = 0
+        self.calls_lock = threading.Lock()
+
+    def extract(self, content, user, fail_call=None):
+        # Ranges are extracted on pool threads
+        with self.calls_lock:
+            self.calls += 1
+            call = self.calls
+        if call == fail_call:
+            return {'error': 'Azure returned 500'}
+        return {'text': f'range {call}', 'summary': ''}
+
+    def run_claimed_job(self):
+        job, = claim_jobs(claimable_ingestion_jobs().filter(pk=self.job.pk), 'host:1')
+        return run_ingestion_job(job)
+
+    def test_failed_range_requeues_the_job_and_keeps_the_spooled_file(self, index_document, prewarm):
+        with mock.patch('api.ingestion.extract_and_preprocess_text', side_effect=lambda c, u: self.extract(c, u, fail_call=2)):
+            self.assertIsNone(self.run_claimed_job())
+
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, BackgroundJob.Status.QUEUED)
+        self.assertTrue(os.path.exists(self.spool_path))
+        self.assertEqual(
+            sorted(self.job.ranges.values_list('status', flat=True)),
+            [BackgroundJob.Status.DONE, BackgroundJob.Status.DONE, BackgroundJob.Status.FAILED],
+        )
+
+        with mock.patch('api.ingestion.extract_and_preprocess_text', side_effect=self.extract):
+            document = self.run_claimed_job()
+
+        # Only the failed range was extracted again
+        self.assertEqual(self.calls, 4)
+        self.assertEqual(document.extracted_text.count('range'), 3)
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, BackgroundJob.Status.DONE)
+        self.assertFalse(os.path.exists(self.spool_path))
+        self.assertFalse(self.job.ranges.exists())
+
+    def test_job_is_abandoned_after_its_last_attempt(self, index_document, prewarm):
+        with mock.patch('api.ingestion.extract_and_preprocess_text', return_value={'error': 'Azure returned 500'}):
+            self.run_claimed_job()
+            self.run_claimed_job()
+
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.status, self.job.attempts), (BackgroundJob.Status.FAILED, 2))
+        self.assertFalse(os.path.exists(self.spool_path))
+
+
+@mock.patch('api.ingestion.refresh_search_vectors')
+@mock.patch('api.ingestion.refresh_document_vectors')
+@mock.patch('api.ingestion.prewarm_document_pools')
+class DocumentBatchTests(TestCase):
+    def setUp(self):
+        self.addCleanup(flush_cache_stats)
+
+    def upload(self, name, sha256):
+        uploaded_file = SimpleUploadedFile(name, b'%PDF-1.4 ' + name.encode())
+        uploaded_file.sha256 = sha256
+        return uploaded_file
+
+    def test_cached_files_become_documents_with_prewarmed_pools(self, prewarm, *refresh):
+        user = User.objects.create(username='uploader')
+        store_extraction_result('a' * 64, 'Cached lecture text. ' * 20, 'summary')
+
+        with override_settings(INGESTION_SPOOL_DIR=tempfile.mkdtemp()):
+            _, results = enqueue_document_batch(user, [self.upload('cached.pdf', 'a' * 64), self.upload('new.pdf', 'b' * 64)])
+
+        document, job = results
+        self.assertIsInstance(document, Document)
+        self.assertIsInstance(job, DocumentIngestionJob)
+        self.assertEqual(DocumentChunk.objects.filter(document=document).count(), 1)
+        prewarm.assert_called_once_with(document)
+
+
+@override_settings(FILE_UPLOAD_HANDLERS=['api.upload_handlers.HashingTemporaryFileUploadHandler'], FILE_UPLOAD_TEMP_DIR=tempfile.gettempdir())
+class HashingUploadHandlerTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='uploader')
+        # Larger than one 64 KB upload chunk, so the digest spans several
+        self.content = b'%PDF-1.4 ' + os.urandom(200 * 1024)
+
+    def post(self, view):
+        request = APIRequestFactory().post('/api/documents/process/', {'file': SimpleUploadedFile('notes.pdf', self.content)}, format='multipart')
+        force_authenticate(request, self.user)
+        return view(request)
+
+    def test_streamed_digest_matches_the_file(self):
+        request = RequestFactory().post('/api/documents/process/', {'file': SimpleUploadedFile('notes.pdf', self.content)})
+        uploaded_file = request.FILES['file']
+
+        self.assertEqual(uploaded_file.sha256, hashlib.sha256(self.content).hexdigest())
+        self.assertFalse(uploaded_file.exceeds_size_limit)
+        with open(uploaded_file.temporary_file_path(), 'rb') as spooled:
+            self.assertEqual(spooled.read(), self.content)
+
+    def test_upload_over_the_size_cap_is_rejected_with_413(self):
+        with override_settings(MAX_UPLOAD_SIZE_BYTES=100 * 1024):
+            request = RequestFactory().post('/api/documents/process/', {'file': SimpleUploadedFile('notes.pdf', self.content)})
+            uploaded_file = request.FILES['file']
+            self.assertTrue(uploaded_file.exceeds_size_limit)
+            self.assertLessEqual(os.path.getsize(uploaded_file.temporary_file_path()), 100 * 1024)
+
+            response = self.post(DocumentProcessView.as_view())
+
+        self.assertEqual(response.status_code, 413)
+        self.assertFalse(DocumentIngestionJob.objects.exists())
+
+
+class SearchCursorTests(SimpleTestCase):
+    def test_round_trip(self):
+        self.assertEqual(decode_cursor(encode_cursor(0.0759909, 'quiz', 42)), (0.0759909, 'quiz', 42))
+
+    def test_invalid_cursor(self):
+        for cursor in ['not base64!', encode_cursor(0.1, 'quiz', 'x'), 'WzEsIDJd']:
+            with self.assertRaises(SearchCursorError):
+                decode_cursor(cursor)
+
+
+@skipUnless(connection.vendor == 'postgresql', "Full-text search needs PostgreSQL")
+class SearchPaginationTests(TestCase):
+    def test_pages_cover_every_hit_once(self):
+        user = User.objects.create(username='searcher')
+        document = Document.objects.create(user=user, filename='biology', size=1.0, file_type='pdf', extracted_text='')
+        cards = [
+            # Equal fronts give equal ranks, so the cursor has to break ties by type and id
+            Flashcard(user=user, document=document, front='Osmosis' if i % 2 else 'Osmosis and diffusion', back='Water moves')
+            for i in range(7)
+        ]
+        Flashcard.objects.bulk_create(cards)
+        index_items(cards)
+        create_document_chunks(document, 'Osmosis moves water across a membrane. ' * 5)
+
+        expected, _ = search(user, 'osmosis', limit=100)
+        seen = []
+        cursor = None
+        while True:
+            hits, cursor = search(user, 'osmosis', limit=3, cursor=cursor)
+            seen += [(hit['type'], hit['id']) for hit in hits]
+            if cursor is None:
+                break
+
+        self.assertEqual(len(expected), 8)
+        self.assertEqual(seen, [(hit['type'], hit['id']) for hit in expected])
+
+
+def _chunk(index, text, token_count=100):
+    return {'index': index, 'text': text, 'term_counts': term_counts(text), 'token_count': token_count}
+
+
+class SelectChunksTests(SimpleTestCase):
+    def setUp(self):
+        self.chunks = [
+            _chunk(0, 'Chlorophyll absorbs light during photosynthesis in the chloroplast. ' * 3),
+            _chunk(1, 'The French revolution began with the storming of the Bastille. ' * 3),
+            _chunk(2, 'Chlorophyll absorbs light during photosynthesis in the chloroplast. ' * 3),
+            _chunk(3, 'Photosynthesis releases oxygen and produces glucose from carbon dioxide. ' * 3),
+        ]
+
+    def test_fits_the_budget_in_document_order(self):
+        selected = select_chunks(self.chunks, token_budget=250, query_text='photosynthesis')
+        self.assertEqual(len(selected), 2)
+        self.assertEqual([chunk['index'] for chunk in selected], sorted(chunk['index'] for chunk in selected))
+
+    def test_prefers_relevant_chunks_over_repeats(self):
+        selected = select_chunks(self.chunks, token_budget=200, query_text='chlorophyll photosynthesis glucose')
+        # Chunk 2 repeats chunk 0 word for word; the diversity penalty picks the glucose chunk instead
+        self.assertEqual([chunk['index'] for chunk in selected], [0, 3])
+
+    def test_without_query_uses_the_document_terms(self):
+        selected = select_chunks(self.chunks, token_budget=100)
+        self.assertEqual(len(selected), 1)
+
+    def test_single_chunk_over_budget_is_truncated(self):
+        selected = select_chunks([_chunk(0, 'Mitosis divides the nucleus. ' * 40, token_count=400)], token_budget=100)
+        self.assertEqual(len(selected), 1)
+        self.assertLessEqual(selected[0]['token_count'], 100)
+        self.assertTrue(selected[0]['text'].startswith('Mitosis divides'))
+
+
+class AttributeToChunksTests(SimpleTestCase):
+    chunks = [
+        'Chlorophyll absorbs light during photosynthesis in the chloroplast.',
+        'The storming of the Bastille began the French revolution.',
+        'Mitochondria produce energy during cellular respiration.',
+    ]
+
+    def test_items_go_to_the_chunk_with_their_rare_words(self):
+        self.assertEqual(
+            attribute_to_chunks(['Which pigment absorbs light in the chloroplast?', 'What began with the storming of the Bastille?'], self.chunks),
+            [0, 1],
+        )
+
+    def test_items_spread_over_chunks_are_not_attributed(self):
+        item = 'Chlorophyll, the Bastille and mitochondria'
+        self.assertEqual(attribute_to_chunks([item, 'Unrelated wording here'], self.chunks), [None, None])
+        with mock.patch('api.versioning.ATTRIBUTION_MIN_OVERLAP', 0.3):
+            self.assertEqual(attribute_to_chunks([item], self.chunks), [0])
+
+
+class ReplaceDocumentContentTests(TestCase):
+    pages = [
+        'Mitochondria produce energy during cellular respiration. ' * 3,
+        'The storming of the Bastille began the French revolution. ' * 3,
+        'Chlorophyll absorbs light during photosynthesis in the chloroplast. ' * 3,
+    ]
+
+    def setUp(self):
+        for target in ('api.chunking.index_document', 'api.versioning.index_document'):
+            patcher = mock.patch(target)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.user = User.objects.create(username='learner')
+        self.document = Document.objects.create(
+            user=self.user, filename='notes', size=1.0, file_type='pdf', extracted_text='\f'.join(self.pages)
+        )
+        create_document_chunks(self.document, self.document.extracted_text)
+        self.kept = _quiz(self.user, self.document, 'What do mitochondria produce during respiration?', difficulty='medium')
+        self.stale = _quiz(self.user, self.document, 'What began with the storming of the Bastille?', answer='Revolution', difficulty='hard')
+        self.new_page = 'World War I began in 1914 after the assassination in Sarajevo. ' * 3
+
+    def replace(self):
+        new_text = '\f'.join([self.pages[0], self.new_page, self.pages[2]])
+        return replace_document_content(self.document, _ingestion_job(self.user, 'notes-v2.pdf'), new_text, 'Summary')
+
+    def test_items_of_changed_chunks_are_removed_and_regenerated_from_the_changed_text(self):
+        document, version = self.replace()
+
+        self.assertEqual(list(Quiz.objects.filter(document=document)), [self.kept])
+        self.assertEqual(
+            (version.kept_items, version.stale_items, version.regeneration_status),
+            (1, {'quizzes': {'hard': 1}, 'flashcards': {}, 'mnemonics': []}, 'queued'),
+        )
+        self.assertEqual((document.version, document.filename), (2, 'notes-v2'))
+
+        [job] = enqueue_regeneration_jobs(version)
+        self.assertEqual((job.kind, job.params['difficulty'], job.params['number_of_quizzes']), (GenerationJob.Kind.QUIZ, 'hard', 1))
+        [(text, _, count)] = _job_parts(job, document, 1)
+        self.assertEqual((text, count), (self.new_page.strip(), 1))
+
+    def test_regeneration_outcome_is_recorded_when_its_last_job_ends(self):
+        self.document.quizzes.create(
+            user=self.user, question='Who stormed the Bastille?', option1='Parisians', option2='DNA', option3='RNA',
+            option4='NADH', correct_option_index=0, difficulty='medium',
+        )
+        _, version = self.replace()
+        first, second = enqueue_regeneration_jobs(version)
+
+        mark_job_done(first)
+        record_regeneration(version.id)
+        version.refresh_from_db()
+        self.assertEqual(version.regeneration_status, 'queued')
+
+        mark_job_failed(second, 'Token limit exceeded', error_status=403)
+        record_regeneration(version.id)
+        version.refresh_from_db()
+        self.assertEqual((version.regeneration_status, version.regeneration_error), ('failed', 'Token limit exceeded'))
+
+
+@override_settings(TOKEN_LEDGER_BATCH_SIZE=100, TOKEN_LEDGER_FLUSH_SECONDS=60)
+class TokenUsageLedgerTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='learner')
+        self.addCleanup(flush_usage_events)
+
+    def record(self, at, tokens, feature=TokenUsageEvent.Feature.QUIZ):
+        with mock.patch('django.utils.timezone.now', return_value=at), usage_feature(feature):
+            record_usage_event(self.user.id, tokens)
+
+    def breakdown(self, days):
+        request = APIRequestFactory().get('/api/token-usage/breakdown/', {'days': days})
+        force_authenticate(request, self.user)
+        return TokenUsageBreakdownView.as_view()(request)
+
+    def test_flush_writes_the_events_and_their_hourly_rollups(self):
+        hour = datetime(2026, 3, 10, 9, tzinfo=dt_timezone.utc)
+        self.record(hour + timedelta(minutes=5), 100)
+        self.record(hour + timedelta(minutes=50), 50)
+        self.record(hour + timedelta(minutes=55), 30, TokenUsageEvent.Feature.FLASHCARD)
+        self.record(hour + timedelta(hours=1), 20)
+        self.record(hour, 0)  # Nothing to record
+        self.assertFalse(TokenUsageEvent.objects.exists())
+
+        self.assertEqual(flush_usage_events(), 4)
+        self.assertEqual(
+            list(TokenUsageHourly.objects.order_by('hour', 'feature').values_list('hour', 'feature', 'tokens', 'calls')),
+            [
+                (hour, 'flashcard', 30, 1),
+                (hour, 'quiz', 150, 2),
+                (hour + timedelta(hours=1), 'quiz', 20, 1),
+            ],
+        )
+
+        self.record(hour + timedelta(minutes=10), 5)
+        flush_usage_events()
+        self.assertEqual(TokenUsageHourly.objects.get(hour=hour, feature='quiz').tokens, 155)
+        self.assertEqual(TokenUsageEvent.objects.count(), 5)
+
+    @override_settings(TIME_ZONE='America/New_York')
+    def test_breakdown_groups_by_day_in_the_current_time_zone(self):
+        now = datetime(2026, 3, 10, 15, tzinfo=dt_timezone.utc)  # 11:00 in New York
+        for at, tokens, feature in [
+            (datetime(2026, 3, 9, 3, tzinfo=dt_timezone.utc), 40, TokenUsageEvent.Feature.QUIZ),  # March 8 in New York
+            (datetime(2026, 3, 10, 3, tzinfo=dt_timezone.utc), 100, TokenUsageEvent.Feature.QUIZ),  # March 9 in New York
+            (datetime(2026, 3, 10, 5, tzinfo=dt_timezone.utc), 70, TokenUsageEvent.Feature.FLASHCARD),
+            (datetime(2026, 3, 10, 14, tzinfo=dt_timezone.utc), 10, TokenUsageEvent.Feature.QUIZ),
+        ]:
+            self.record(at, tokens, feature)
+        flush_usage_events()
+
+        with mock.patch('django.utils.timezone.now', return_value=now):
+            today = self.breakdown(days=1).data
+            two_days = self.breakdown(days=2).data
+
+        self.assertEqual(today['since'], datetime(2026, 3, 10, 4, tzinfo=dt_timezone.utc))
+        self.assertEqual(today['total_tokens'], 80)
+        self.assertEqual(today['daily'], [{'date': '2026-03-10', 'total_tokens': 80, 'features': {'flashcard': 70, 'quiz': 10}}])
+        self.assertEqual(
+            [(feature['feature'], feature['tokens'], feature['calls']) for feature in two_days['features']],
+            [('quiz', 110, 2), ('flashcard', 70, 1)],
+        )
+        self.assertEqual([day['date'] for day in two_days['daily']], ['2026-03-09', '2026-03-10'])
+
+
+class TopicMatcherTests(SimpleTestCase):
+    def setUp(self):
+        self.biology = Document(filename='Cell biology', summary='The cell membrane and mitochondria.')
+        self.genetics = Document(filename='Genetics', summary='DNA replication in the cell nucleus.')
+        self.matcher = TopicMatcher([self.biology, self.genetics])
+
+    def test_rare_terms_count_more(self):
+        # "cell" is in both documents and counts half; "membrane" and "replication" each pick one
+        self.assertIs(self.matcher.match('Cell membrane'), self.biology)
+        self.assertIs(self.matcher.match('Cell replication'), self.genetics)
+        self.assertIs(self.matcher.match('cell'), self.biology)
+
+    def test_topics_without_shared_terms_fall_back_to_the_first_document(self):
+        self.assertIs(self.matcher.match('The French revolution'), self.biology)
+        self.assertIsNone(self.matcher.match(''))
+        self.assertIsNone(TopicMatcher([]).match('Cell membrane'))
+
+
+class StudyPlanStepsTests(TestCase):
+    def test_steps_and_resources_are_saved_with_one_insert_each(self):
+        user = User.objects.create(username='learner')
+        biology = Document.objects.create(user=user, filename='Cell biology', size=1.0, file_type='pdf', extracted_text='', summary='Cell membranes.')
+        genetics = Document.objects.create(user=user, filename='Genetics', size=1.0, file_type='pdf', extracted_text='', summary='DNA replication.')
+        study_plan = StudyPlan.objects.create(user=user, title='Finals', daily_study_hours=2, days_until_exam=2, exam_type='mixed')
+        activity = {'type': 'reading', 'title': 'Read', 'topic': 'DNA replication', 'duration_minutes': 30,
+                    'resources': [{'type': 'video', 'title': 'Replication explained', 'url': 'https://example.com/dna'}]}
+        plan_data = {'daily_schedule': [
+            {'day': 1, 'morning_session': {'activities': [activity, {**activity, 'topic': 'Cell membranes', 'resources': []}]}},
+            {'day': 2, 'evening_session': {'activities': [activity]}, 'afternoon_session': None},
+            None,
+        ]}
+
+        with self.assertNumQueries(2):
+            created = StudyPlanGenerateView()._create_study_plan_steps(study_plan, plan_data, [biology, genetics])
+
+        self.assertEqual(created, 3)
+        steps = list(study_plan.steps.order_by('day_number', 'step_order'))
+        self.assertEqual(
+            [(step.day_number, step.step_order, step.related_document_id) for step in steps],
+            [(1, 1, genetics.id), (1, 2, biology.id), (2, 1, genetics.id)],
+        )
+        self.assertEqual([step.resources.count() for step in steps], [1, 0, 1])
+
+
+class GenerationJobEventsTests(TestCase):
+    def setUp(self):
+        user = User.objects.create(username='learner')
+        document = Document.objects.create(user=user, filename='notes', size=1.0, file_type='pdf', extracted_text='')
+        self.quizzes = Quiz.objects.bulk_create([
+            Quiz(user=user, document=document, question=f'Question {i}?', option1='a', option2='b', option3='c',
+                 option4='d', correct_option_index=0)
+            for i in range(3)
+        ])
+        self.job = GenerationJob.objects.create(
+            user=user, document=document, kind=GenerationJob.Kind.QUIZ, item_ids=[quiz.pk for quiz in self.quizzes[:1]]
+        )
+
+    def events(self, last_event_id=0):
+        return list(generation_job_events(self.job, last_event_id))
+
+    @override_settings(GENERATION_STREAM_WINDOW=0)
+    def test_window_closes_while_the_job_runs(self):
+        events = self.events()
+        self.assertTrue(events[0].startswith('retry: '))
+        self.assertEqual(len(events), 2)
+        self.assertTrue(events[1].startswith('id: 1\nevent: item\n'))
+
+    def test_reconnect_resumes_after_the_last_event_id(self):
+        GenerationJob.objects.filter(pk=self.job.pk).update(
+            status=GenerationJob.Status.DONE, item_ids=[quiz.pk for quiz in self.quizzes], result={'message': 'ok'}
+        )
+        events = self.events(last_event_id=1)
+
+        self.assertEqual([event.split('\n')[0] for event in events[1:3]], ['id: 2', 'id: 3'])
+        self.assertIn('"Question 2?"', events[2])
+        self.assertTrue(events[3].startswith('event: done\n'))
+
+
+def _quiz(user, document, question, answer='ATP', **fields):
+    return Quiz.objects.create(
+        user=user, document=document, question=question, option1=answer, option2='DNA', option3='RNA',
+        option4='NADH', correct_option_index=0, **fields
+    )
+
+
+def _quiz_signature(question, answer, difficulty='medium'):
+    return item_signature(Quiz(
+        question=question, option1=answer, option2='DNA', option3='RNA', option4='NADH',
+        correct_option_index=0, difficulty=difficulty,
+    ))
+
+
+class SimilarityIndexTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='learner')
+        self.document = Document.objects.create(user=self.user, filename='notes', size=1.0, file_type='pdf', extracted_text='')
+
+    def test_rewording_keeps_most_of_the_signature(self):
+        signature = _quiz_signature('What do mitochondria produce for the cell?', 'ATP')
+        self.assertEqual(estimated_similarity(signature, _quiz_signature('what do MITOCHONDRIA produce for the cell', 'ATP')), 1.0)
+        self.assertGreaterEqual(
+            estimated_similarity(signature, _quiz_signature('Which molecule do mitochondria produce for the cell?', 'ATP')),
+            settings.SIMILARITY_DUPLICATE_THRESHOLD,
+        )
+        self.assertLess(
+            estimated_similarity(signature, _quiz_signature('Which molecule stores the energy the cell uses?', 'ATP')), 0.2
+        )
+
+    def test_near_misses_are_not_duplicates(self):
+        pairs = [
+            (('When did World War I begin?', '1914'), ('When did World War II begin?', '1939')),
+            (('What is the capital of France?', 'Paris'), ('What is the capital of Germany?', 'Berlin')),
+            (('Who was the first president of the United States?', 'George Washington'),
+             ('Who was the second president of the United States?', 'John Adams')),
+        ]
+        for first, second in pairs:
+            with self.subTest(first=first[0]):
+                self.assertLess(
+                    estimated_similarity(_quiz_signature(*first), _quiz_signature(*second)), settings.SIMILARITY_DUPLICATE_THRESHOLD
+                )
+
+    def test_word_order_separates_texts_with_the_same_words(self):
+        self.assertLess(
+            estimated_similarity(minhash_signature('dog bites man'), minhash_signature('man bites dog')),
+            settings.SIMILARITY_DUPLICATE_THRESHOLD,
+        )
+
+    def test_same_question_at_another_difficulty_is_not_a_duplicate(self):
+        question = ('What do mitochondria produce for the cell?', 'ATP')
+        self.assertEqual(estimated_similarity(_quiz_signature(*question), _quiz_signature(*question, difficulty='hard')), 0.0)
+
+    def test_find_duplicate_returns_the_closest_item(self):
+        original = _quiz(self.user, self.document, 'What do mitochondria produce for the cell?', difficulty='medium')
+        _quiz(self.user, self.document, 'Who wrote the Declaration of Independence?', answer='Jefferson', difficulty='medium')
+        index = SimilarityIndex(Quiz, self.document.id)
+
+        self.assertEqual(index.find_duplicate(_quiz_signature('Which molecule do mitochondria produce for the cell?', 'ATP')), original.pk)
+        self.assertIsNone(index.find_duplicate(_quiz_signature('What do mitochondria produce for the cell?', 'NADH')))
+        self.assertIsNone(index.find_duplicate(_quiz_signature('When did the Roman Empire fall?', '476')))
+
+    def test_items_without_a_signature_are_signed_on_load(self):
+        quiz = _quiz(self.user, self.document, 'What do mitochondria produce for the cell?', difficulty='medium')
+        self.assertIsNone(quiz.minhash)
+
+        index = SimilarityIndex(Quiz, self.document.id)
+
+        quiz.refresh_from_db()
+        self.assertEqual(quiz.minhash, _quiz_signature('What do mitochondria produce for the cell?', 'ATP'))
+        self.assertEqual(index.signatures, {quiz.pk: quiz.minhash})
+
+
+class GenerationCacheKeyTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='learner')
+        self.document = Document.objects.create(user=self.user, filename='notes', size=1.0, file_type='pdf', extracted_text='')
+        self.calls = []
+
+    def run_job(self, difficulty='medium', job=None):
+        def generator(job, text, count, offset, use_cache=True, existing_items=None):
+            self.calls.append((use_cache, existing_items))
+            return [], {}
+
+        job = job or GenerationJob.objects.create(
+            user=self.user, document=self.document, kind=GenerationJob.Kind.QUIZ,
+            params={'difficulty': difficulty, 'number_of_quizzes': 2},
+        )
+        with mock.patch('api.generation._job_parts', return_value=[('Mitochondria produce ATP.', 10, 2)]), \
+                mock.patch.dict(GENERATORS, {GenerationJob.Kind.QUIZ: generator}):
+            run_generation_job(job)
+        return job
+
+    def test_saved_items_change_the_cache_key(self):
+        self.run_job()
+        _quiz(self.user, self.document, 'What do mitochondria produce?')
+        self.run_job()
+
+        (first_cached, first_key), (second_cached, second_key) = self.calls
+        self.assertTrue(first_cached and second_cached)
+        self.assertNotEqual(first_key, second_key)
+
+    def test_items_of_another_difficulty_keep_the_key(self):
+        self.run_job()
+        _quiz(self.user, self.document, 'What do mitochondria produce?', difficulty='hard')
+        self.run_job()
+
+        self.assertEqual(self.calls[0], self.calls[1])
+
+    def test_retried_job_keeps_its_key(self):
+        job = self.run_job()
+        job.item_ids = [_quiz(self.user, self.document, 'What do mitochondria produce?').pk]
+        job.params['number_of_quizzes'] = 3
+        self.run_job(job=job)
+
+        self.assertEqual(self.calls[0], self.calls[1])
+
+    def test_repeated_request_returns_the_earlier_job(self):
+        params = {'difficulty': 'medium', 'number_of_quizzes': 2, 'use_cache': True}
+        with mock.patch('api.generation._check_generation_budget'):
+            job = enqueue_generation_job(self.user, self.document, GenerationJob.Kind.QUIZ, params)
+            self.assertEqual(enqueue_generation_job(self.user, self.document, GenerationJob.Kind.QUIZ, dict(params)), job)
+            other = enqueue_generation_job(self.user, self.document, GenerationJob.Kind.QUIZ, {**params, 'number_of_quizzes': 5})
+            self.assertNotEqual(other, job)
+
+            GenerationJob.objects.filter(pk=job.pk).update(status=GenerationJob.Status.FAILED)
+            self.assertNotEqual(enqueue_generation_job(self.user, self.document, GenerationJob.Kind.QUIZ, params), job)
+
+
+def _quiz_item(question, answer):
+    return {
+        'question': question, 'options': [answer, 'DNA', 'RNA', 'NADH'], 'correct_option_index': 0,
+        'hint': 'See the notes.', 'explanation': 'As the notes say.', 'keywords': [],
+    }
+
+
+@override_settings(GENERATION_POOL_TARGETS={'free': 0})
+class GenerationEstimateTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='learner')
+        self.usage = UserTokenUsage.objects.create(user=self.user, max_tokens=25000)
+        self.document = Document.objects.create(user=self.user, filename='notes', size=1.0, file_type='pdf', extracted_text='')
+        with mock.patch('api.chunking.index_document'):
+            create_document_chunks(self.document, 'Mitochondria produce ATP during cellular respiration. ' * 40)
+
+    def post(self, view, data):
+        request = APIRequestFactory().post('/api/generate/', data, format='json')
+        force_authenticate(request, self.user)
+        return view.as_view()(request)
+
+    def test_estimate_reports_the_fanned_out_cost_and_the_remaining_tokens(self):
+        UserTokenUsage.objects.filter(pk=self.usage.pk).update(tokens_used=5000)
+
+        response = self.post(GenerationEstimateView, {'kind': 'quiz', 'document_id': self.document.id, 'number_of_items': 10})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            set(response.data), {'kind', 'prompt_tokens', 'completion_tokens', 'total_tokens', 'remaining_tokens', 'within_budget'}
+        )
+        self.assertEqual(response.data, {
+            'kind': 'quiz',
+            **_generation_estimate(self.document, GenerationJob.Kind.QUIZ, 10),
+            'remaining_tokens': 20000,
+            'within_budget': True,
+        })
+
+    def test_request_over_the_remaining_tokens_is_rejected_when_queued(self):
+        estimate = _generation_estimate(self.document, GenerationJob.Kind.QUIZ, 10)['total_tokens']
+        UserTokenUsage.objects.filter(pk=self.usage.pk).update(tokens_used=25000 - estimate + 1)
+
+        estimated = self.post(GenerationEstimateView, {'kind': 'quiz', 'document_id': self.document.id, 'number_of_items': 10})
+        response = self.post(QuizGenerationView, {'document_id': self.document.id, 'difficulty': 'medium', 'number_of_quizzes': 10})
+
+        self.assertFalse(estimated.data['within_budget'])
+        self.assertEqual(response.status_code, 403)
+        self.assertTrue(response.data['error'].startswith(f"Token limit exceeded. This request needs about {estimate} tokens"))
+        self.assertFalse(GenerationJob.objects.exists())
+
+
+@override_settings(
+    GENERATION_POOL_TARGETS={'free': 10}, GENERATION_POOL_PREWARM_DIFFICULTIES=['medium'],
+    GENERATION_POOL_MIN_REFILL=5, GENERATION_POOL_KEPT_BUDGET_SHARE=0.5,
+)
+class GenerationPoolTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='learner')
+        self.usage = UserTokenUsage.objects.create(user=self.user, max_tokens=25000)
+        self.document = Document.objects.create(user=self.user, filename='notes', size=1.0, file_type='pdf', extracted_text='')
+        self.addCleanup(flush_usage_events)
+
+    def refills(self):
+        return GenerationJob.objects.filter(document=self.document, is_refill=True)
+
+    def test_add_to_pool_skips_near_duplicates_of_saved_and_pooled_items(self):
+        _quiz(self.user, self.document, 'What do mitochondria produce for the cell?', difficulty='medium')
+        index = pool_similarity_index(self.document, GenerationJob.Kind.QUIZ, 'medium')
+        items = [
+            _quiz_item('Which molecule do mitochondria produce for the cell?', 'ATP'),
+            _quiz_item('When did World War I begin?', '1914'),
+            _quiz_item('In which year did World War I begin?', '1914'),
+            _quiz_item('When did World War II begin?', '1939'),
+        ]
+
+        pooled, errors = add_to_pool(self.document, GenerationJob.Kind.QUIZ, 'medium', items, index)
+
+        self.assertEqual([item.item['options'][0] for item in pooled], ['1914', '1939'])
+        self.assertEqual((errors, index.duplicates_dropped), ([], 2))
+        self.assertEqual(len(take_pooled_items(self.document, GenerationJob.Kind.QUIZ, 'medium', 1)), 1)
+        self.assertEqual(pooled_count(self.document, GenerationJob.Kind.QUIZ, 'medium'), 1)
+
+    def test_refill_is_sized_to_the_owners_spare_tokens(self):
+        spare = 3200
+        UserTokenUsage.objects.filter(pk=self.usage.pk).update(tokens_used=25000 - 12500 - spare)
+
+        job = enqueue_pool_refill(self.document, GenerationJob.Kind.QUIZ, 'medium')
+
+        size = job.params['number_of_quizzes']
+        self.assertTrue(5 <= size < 10)
+        self.assertLessEqual(_generation_estimate(self.document, GenerationJob.Kind.QUIZ, size)['total_tokens'], spare)
+        self.assertGreater(_generation_estimate(self.document, GenerationJob.Kind.QUIZ, size + 1)['total_tokens'], spare)
+
+    def test_no_refill_from_the_tokens_kept_for_the_owner(self):
+        UserTokenUsage.objects.filter(pk=self.usage.pk).update(tokens_used=12000)
+
+        self.assertIsNone(enqueue_pool_refill(self.document, GenerationJob.Kind.QUIZ, 'medium'))
+        self.assertFalse(self.refills().exists())
+
+    @override_settings(GENERATION_POOL_PREWARM_DIFFICULTIES=['medium', 'hard'])
+    def test_one_refill_per_document_is_pending(self):
+        prewarm_document_pools(self.document)
+        prewarm_document_pools(self.document)
+        enqueue_pool_refill(self.document, GenerationJob.Kind.FLASHCARD, 'easy')
+
+        self.assertEqual(
+            list(self.refills().values_list('kind', 'params__difficulty')), [(GenerationJob.Kind.QUIZ, 'medium')]
+        )
+
+    def test_finished_refill_prewarms_the_next_pool(self):
+        prewarm_document_pools(self.document)
+        job = self.refills().get()
+        items = [_quiz_item(f'Which organelle is described in section {n}?', f'Organelle {n}') for n in range(10)]
+
+        with mock.patch('api.generation._job_parts', return_value=[('Mitochondria produce ATP.', 10, 10)]), \
+                mock.patch('api.generation._generated_parts', return_value=[(0, items, {})]):
+            run_pool_refill_job(job)
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.result['pooled_count']), (GenerationJob.Status.DONE, 10))
+        self.assertEqual(
+            list(self.refills().filter(status=GenerationJob.Status.QUEUED).values_list('kind', 'params__difficulty')),
+            [(GenerationJob.Kind.FLASHCARD, 'medium')],
+        )
+
+
+@override_settings(
+    GENERATION_STREAM_LEAD_ITEMS=3, GENERATION_FANOUT_ITEMS=8, GENERATION_FANOUT_SPARE_ITEMS=1, GENERATION_FANOUT_CONCURRENCY=4,
+)
+class GenerationFanOutTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='learner')
+        self.document = Document.objects.create(user=self.user, filename='notes', size=1.0, file_type='pdf', extracted_text='')
+        self.addCleanup(flush_usage_events)
+
+    def test_part_counts(self):
+        self.assertEqual(generation_part_counts(GenerationJob.Kind.QUIZ, 5), [5])
+        # A lead call, then the rest in calls of at most 8 items, each with a spare item
+        self.assertEqual(generation_part_counts(GenerationJob.Kind.QUIZ, 20), [4, 7, 7, 6])
+        self.assertEqual(generation_part_counts(GenerationJob.Kind.MNEMONIC, 10), [10])
+        self.assertEqual(generation_part_counts(GenerationJob.Kind.MNEMONIC, 7, topics=['topic'] * 7), [3, 4])
+
+    def test_items_of_parts_without_chunks_go_to_the_part_before(self):
+        pages = ['Mitochondria produce ATP during cellular respiration. ', 'Chlorophyll absorbs light in the chloroplast. ']
+        with mock.patch('api.chunking.index_document'):
+            create_document_chunks(self.document, '\f'.join(pages))
+
+        parts = split_generation_context(self.document, [4, 7, 7, 6])
+
+        self.assertEqual([(text.strip(), count) for text, _, count in parts], [(pages[0].strip(), 4), (pages[1].strip(), 20)])
+
+    def run_job(self, generator, number_of_quizzes=10):
+        job = GenerationJob.objects.create(
+            user=self.user, document=self.document, kind=GenerationJob.Kind.QUIZ,
+            params={'difficulty': 'medium', 'number_of_quizzes': number_of_quizzes},
+        )
+        parts = [('Mitochondria produce ATP.', 10, 4), ('Chlorophyll absorbs light.', 10, 8)]
+        with mock.patch('api.generation._job_parts', return_value=parts), mock.patch('api.generation.index_items'), \
+                mock.patch.dict(GENERATORS, {GenerationJob.Kind.QUIZ: generator}):
+            run_generation_job(job)
+        job.refresh_from_db()
+        return job
+
+    def test_merged_parts_are_trimmed_to_the_requested_count(self):
+        def generator(job, text, count, offset, use_cache=True, existing_items=None):
+            return [_quiz_item(f'Which process is described in sentence {n}?', f'Process {n}') for n in range(offset, offset + count)], {}
+
+        job = self.run_job(generator)
+
+        self.assertEqual(job.status, GenerationJob.Status.DONE)
+        self.assertEqual(len(job.item_ids), 10)
+        self.assertEqual(Quiz.objects.filter(document=self.document).count(), 10)
+        self.assertEqual(job.result['status'], 200)
+
+    def test_failed_lead_call_fails_the_job(self):
+        def generator(job, text, count, offset, use_cache=True, existing_items=None):
+            if offset == 0:
+                raise LLMUnavailable()
+            return [_quiz_item(f'Which process is described in sentence {n}?', f'Process {n}') for n in range(offset, offset + count)], {}
+
+        job = self.run_job(generator)
+
+        self.assertEqual((job.status, job.error_status), (GenerationJob.Status.FAILED, 503))
+        self.assertLessEqual(Quiz.objects.filter(document=self.document).count(), 8)
+
+
+class GenerationJobResultTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='learner')
+        self.document = Document.objects.create(user=self.user, filename='notes', size=1.0, file_type='pdf', extracted_text='')
+
+    def run_job(self, items):
+        job = GenerationJob.objects.create(
+            user=self.user, document=self.document, kind=GenerationJob.Kind.QUIZ,
+            params={'difficulty': 'medium', 'number_of_quizzes': 2},
+        )
+        with mock.patch('api.generation._job_parts', return_value=[('Mitochondria produce ATP.', 10, 2)]), \
+                mock.patch.dict(GENERATORS, {GenerationJob.Kind.QUIZ: lambda *args, **kwargs: (items, {})}):
+            run_generation_job(job)
+        return job
+
+    def test_item_errors_make_a_multi_status_result(self):
+        job = self.run_job([{'question': 'What do mitochondria produce?'}])
+
+        request = APIRequestFactory().get(f'/api/generate/jobs/{job.pk}/')
+        force_authenticate(request, self.user)
+        response = GenerationJobView.as_view()(request, job_id=job.pk)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], GenerationJob.Status.DONE)
+        self.assertEqual(response.data['result']['status'], 207)
+        self.assertEqual(len(response.data['result']['errors']), 1)
+
+        done = list(generation_job_events(job))[-1]
+        self.assertTrue(done.startswith('event: done\n'))
+        self.assertIn('"status": 207', done)
+
+    def test_result_without_errors(self):
+        job = self.run_job([])
+        job.refresh_from_db()
+        self.assertEqual(job.result['status'], 200)
+        self.assertNotIn('errors', job.result)
+
+
+class StudyPackShapeTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='learner')
+        self.document = Document.objects.create(user=self.user, filename='notes', size=1.0, file_type='pdf', extracted_text='')
+        self.job = GenerationJob.objects.create(
+            user=self.user, document=self.document, kind=GenerationJob.Kind.STUDY_PACK,
+            params={'difficulty': 'medium', 'number_of_quizzes': 2, 'number_of_flashcards': 2, 'number_of_mnemonics': 1},
+        )
+
+    def run_job(self, pack):
+        with mock.patch('api.generation.select_generation_context', return_value=('Mitochondria produce ATP.', 10)), \
+                mock.patch('api.generation.cached_llm_call', return_value=pack):
+            run_study_pack_job(self.job)
+        self.job.refresh_from_db()
+
+    def test_malformed_sections_are_item_errors(self):
+        self.run_job({'quizzes': 'none', 'mnemonics': [{'topic': 'Cell energy'}]})
+
+        self.assertEqual(self.job.status, GenerationJob.Status.DONE)
+        self.assertEqual(self.job.result['quiz_ids'], [])
+        self.assertEqual(self.job.result['errors'][:2], [
+            'Invalid quizzes data received: expected a list, got str.',
+            'No flashcards data received.',
+        ])
+        self.assertTrue(self.job.result['errors'][2].startswith('Invalid mnemonic data received'))
+
+    def test_response_that_is_not_an_object(self):
+        self.run_job(['not', 'a', 'pack'])
+
+        self.assertEqual(self.job.status, GenerationJob.Status.DONE)
+        self.assertEqual(len(self.job.result['errors']), 3)
+
+
+class ServiceError(Exception):
+    status_code = 503
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def test_opens_after_consecutive_failures(self):
+        circuit = CircuitBreaker(failure_threshold=2, reset_seconds=60)
+        circuit.record_failure()
+        self.assertFalse(circuit.before_call())
+        circuit.record_failure()
+
+        self.assertEqual(circuit.state, CircuitBreaker.OPEN)
+        with self.assertRaises(LLMUnavailable):
+            circuit.before_call()
+
+    def test_trial_call_closes_or_reopens_the_circuit(self):
+        circuit = CircuitBreaker(failure_threshold=1, reset_seconds=0)
+        circuit.record_failure()
+
+        self.assertTrue(circuit.before_call())
+        with self.assertRaises(LLMUnavailable):
+            circuit.before_call()  # Only one trial at a time
+        circuit.record_failure()
+        self.assertEqual(circuit.state, CircuitBreaker.OPEN)
+
+        self.assertTrue(circuit.before_call())
+        circuit.record_success()
+        self.assertEqual(circuit.state, CircuitBreaker.CLOSED)
+
+    def test_abandoned_trial_reopens_the_circuit(self):
+        circuit = CircuitBreaker(failure_threshold=1, reset_seconds=0)
+        circuit.record_failure()
+        opened_at = circuit.opened_at
+
+        circuit.before_call()
+        circuit.abandon_trial()
+
+        self.assertEqual(circuit.state, CircuitBreaker.OPEN)
+        self.assertGreater(circuit.opened_at, opened_at)
+
+
+class LLMGatewayTests(SimpleTestCase):
+    def gateway(self, **limits):
+        options = dict(
+            max_concurrency=1, tokens_per_minute=0, max_retries=1, backoff_base=0, backoff_max=0,
+            failure_threshold=1, reset_seconds=0, queue_timeout=0,
+        )
+        return LLMGateway(**{**options, **limits})
+
+    def test_retryable_failures_end_in_unavailable(self):
+        gateway = self.gateway()
+        calls = []
+
+        def fail():
+            calls.append(1)
+            raise ServiceError()
+
+        with self.assertRaises(LLMUnavailable):
+            gateway.call(fail)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(gateway.circuit.state, CircuitBreaker.OPEN)
+
+    def test_trial_that_times_out_waiting_reopens_the_circuit(self):
+        gateway = self.gateway()
+        gateway.circuit.record_failure()
+        gateway.slots.acquire()  # Every slot is busy
+
+        with self.assertRaises(LLMUnavailable):
+            gateway.call(lambda: 'ok')
+        self.assertEqual(gateway.circuit.state, CircuitBreaker.OPEN)
+
+        gateway.slots.release()
+        self.assertEqual(gateway.call(lambda: 'ok'), 'ok')
+        self.assertEqual(gateway.circuit.state, CircuitBreaker.CLOSED)
+
+    def test_interrupted_trial_reopens_the_circuit(self):
+        gateway = self.gateway()
+        gateway.circuit.record_failure()
+
+        def interrupted():
+            raise KeyboardInterrupt
+
+        with self.assertRaises(KeyboardInterrupt):
+            gateway.call(interrupted)
+        self.assertEqual(gateway.circuit.state, CircuitBreaker.OPEN)
+
+
+class ReserveTokensTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='learner')
+        UserTokenUsage.objects.create(user=self.user, max_tokens=1000)
+        self.addCleanup(flush_usage_events)
+
+    def usage(self):
+        return UserTokenUsage.objects.get(user=self.user)
+
+    def test_hold_counts_against_the_limit_until_released(self):
+        with reserve_tokens(self.user, {'total_tokens': 600}):
+            self.assertEqual(self.usage().tokens_reserved, 600)
+            with self.assertRaises(PermissionDenied):
+                with reserve_tokens(self.user, {'total_tokens': 500}):
+                    pass
+        self.assertEqual(self.usage().tokens_reserved, 0)
+
+    def test_recorded_usage_replaces_the_hold(self):
+        with reserve_tokens(self.user, {'total_tokens': 600}):
+            record_token_usage(self.user, 500)
+            usage = self.usage()
+            self.assertEqual((usage.tokens_used, usage.tokens_reserved), (500, 100))
+            # Counted once, the remaining budget still fits this
+            self.assertIsNotNone(UserTokenUsage.reserve(self.user, 400))
+        usage = self.usage()
+        self.assertEqual((usage.tokens_used, usage.tokens_reserved), (500, 400))
+
+    def test_usage_over_the_estimate_only_settles_the_hold(self):
+        with reserve_tokens(self.user, {'total_tokens': 300}):
+            record_token_usage(self.user, 200)
+            record_token_usage(self.user, 200)
+            usage = self.usage()
+            self.assertEqual((usage.tokens_used, usage.tokens_reserved), (400, 0))
+        self.assertEqual(self.usage().tokens_reserved, 0)
+
+    def test_hold_of_a_rolled_window_is_not_released_from_the_new_one(self):
+        with reserve_tokens(self.user, {'total_tokens': 600}):
+            UserTokenUsage.objects.filter(user=self.user).update(last_reset=timezone.now() - UserTokenUsage.WINDOW - timedelta(minutes=1))
+            self.assertIsNotNone(UserTokenUsage.reserve(self.user, 300))  # Rolls the window over
+            record_token_usage(self.user, 100)
+            usage = self.usage()
+            self.assertEqual((usage.tokens_used, usage.tokens_reserved), (100, 300))
+        self.assertEqual(self.usage().tokens_reserved, 300)
+
+
+class VerifiedTokenCacheTests(SimpleTestCase):
+    def test_entry_expires_with_the_token(self):
+        cache = VerifiedTokenCache(max_entries=10, ttl=300)
+        cache.set('key', {'exp': time.time() + 60}, ['values'])
+        self.assertEqual(cache.get('key')[2], ['values'])
+
+        with mock.patch('backend.supabase_auth.time.time', return_value=time.time() + 61):
+            self.assertIsNone(cache.get('key'))
+        self.assertNotIn('key', cache.entries)
+
+    def test_entry_expires_after_the_ttl_before_the_token(self):
+        cache = VerifiedTokenCache(max_entries=10, ttl=30)
+        cache.set('key', {'exp': time.time() + 3600}, [])
+
+        with mock.patch('backend.supabase_auth.time.time', return_value=time.time() + 31):
+            self.assertIsNone(cache.get('key'))
+
+    def test_token_without_expiry_is_not_cached(self):
+        cache = VerifiedTokenCache(max_entries=10, ttl=30)
+        cache.set('key', {}, [])
+        self.assertIsNone(cache.get('key'))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = VerifiedTokenCache(max_entries=2, ttl=300)
+        payload = {'exp': time.time() + 60}
+        cache.set('a', payload, [])
+        cache.set('b', payload, [])
+        cache.get('a')
+        cache.set('c', payload, [])
+
+        self.assertEqual(list(cache.entries), ['a', 'c'])
+
+
+class SupabaseJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch('backend.supabase_auth._token_cache', VerifiedTokenCache(max_entries=10, ttl=300))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def authenticate(self, token):
+        request = APIRequestFactory().get('/api/documents/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        return SupabaseJWTAuthentication().authenticate(request)
+
+    def token(self, expires_in=60, secret=None):
+        return jwt.encode(
+            {'sub': 'supabase-user-1', 'email': 'learner@example.com', 'aud': 'authenticated', 'exp': int(time.time()) + expires_in},
+            secret or os.environ['SUPABASE_JWT_SECRET'], algorithm='HS256',
+        )
+
+    def test_verified_token_is_served_from_the_cache(self):
+        token = self.token()
+        user, _ = self.authenticate(token)
+        self.assertEqual((user.username, user.email), ('supabase-user-1', 'learner@example.com'))
+
+        with self.assertNumQueries(0):
+            cached_user, _ = self.authenticate(token)
+        self.assertEqual(cached_user.pk, user.pk)
+
+    def test_cached_token_is_rejected_once_expired(self):
+        token = self.token(expires_in=60)
+        self.authenticate(token)
+
+        # Past its exp the token is verified again, which rejects it
+        with mock.patch('backend.supabase_auth.time.time', return_value=time.time() + 120), \
+                mock.patch('backend.supabase_auth.jwt.decode', side_effect=jwt.ExpiredSignatureError) as decode:
+            with self.assertRaisesMessage(AuthenticationFailed, 'Token expired'):
+                self.authenticate(token)
+        decode.assert_called_once()
+
+    def test_invalid_signature_is_rejected(self):
+        with self.assertRaisesMessage(AuthenticationFailed, 'Invalid token'):
+            self.authenticate(self.token(secret='another-secret-another-secret-xx'))
+
+
+class AdaptiveQuizJobTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='learner')
+        self.document = Document.objects.create(user=self.user, filename='notes', size=1.0, file_type='pdf', extracted_text='')
+
+    def claim(self):
+        return claim_jobs(GenerationJob.objects.all(), 'host:1')[0]
+
+    def test_submissions_coalesce_into_the_queued_job(self):
+        job = enqueue_adaptive_quiz_job(self.user, self.document)
+
+        self.assertIsNotNone(job)
+        self.assertIsNone(enqueue_adaptive_quiz_job(self.user, self.document))
+        self.assertEqual(GenerationJob.objects.count(), 1)
+
+    def test_submission_after_the_job_started_queues_another(self):
+        enqueue_adaptive_quiz_job(self.user, self.document)
+        self.claim()
+
+        self.assertIsNotNone(enqueue_adaptive_quiz_job(self.user, self.document))
+
+    def test_stale_job_with_a_newer_one_queued_is_not_requeued(self):
+        stale = enqueue_adaptive_quiz_job(self.user, self.document)
+        self.claim()
+        GenerationJob.objects.filter(pk=stale.pk).update(started_at=timezone.now() - timedelta(hours=1))
+        newer = enqueue_adaptive_quiz_job(self.user, self.document)
+        other_document = Document.objects.create(user=self.user, filename='other', size=1.0, file_type='pdf', extracted_text='')
+        other = GenerationJob.objects.create(
+            user=self.user, document=other_document, kind=GenerationJob.Kind.ADAPTIVE_QUIZ,
+            status=GenerationJob.Status.RUNNING, attempts=1, started_at=timezone.now() - timedelta(hours=1),
+        )
+
+        self.assertEqual(requeue_stale_jobs(GenerationJob.objects.all(), timedelta(minutes=15)), 1)
+
+        stale.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(stale.status, GenerationJob.Status.FAILED)
+        self.assertEqual(other.status, GenerationJob.Status.QUEUED)
+        self.assertEqual(GenerationJob.objects.get(pk=newer.pk).status, GenerationJob.Status.QUEUED)
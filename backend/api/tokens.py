@@ -0,0 +1,180 @@
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.utils import timezone
+from rest_framework.exceptions import PermissionDenied
+
+from .models import UserTokenUsage
+
+logger = logging.getLogger(__name__)
+
+CHARS_PER_TOKEN = 4
+
+# Fixed prompt tokens (instructions and output schema) sent with each kind of generation request,
+# and typical completion tokens per generated item. Measured from generator calls; used for estimates only.
+PROMPT_OVERHEAD_TOKENS = {
+    'quiz': 700,
+    'flashcard': 550,
+    'mnemonic': 600,
+    'study_plan': 900,
+    'study_pack': 1100,
+}
+COMPLETION_TOKENS_PER_ITEM = {
+    'quiz': 220,
+    'flashcard': 110,
+    'mnemonic': 160,
+    'study_plan': 250,  # per day of the plan
+}
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    """Load the tiktoken encoding once per process; False if it is unavailable (e.g. no network to fetch it)"""
+    global _encoding
+    if _encoding is None:
+        with _encoding_lock:
+            if _encoding is None:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding(settings.TOKENIZER_ENCODING)
+                except Exception as e:
+                    logger.warning(f"Tokenizer '{settings.TOKENIZER_ENCODING}' unavailable, estimating tokens from length: {e}")
+                    _encoding = False
+    return _encoding
+
+
+def count_tokens(text):
+    """Number of model tokens in `text`"""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def estimate_generation_tokens(kind, context_tokens, number_of_items, calls=1):
+    """Expected prompt and completion tokens of a generation request made in `calls` calls over disjoint context"""
+    prompt_tokens = PROMPT_OVERHEAD_TOKENS[kind] * calls + context_tokens
+    completion_tokens = COMPLETION_TOKENS_PER_ITEM[kind] * number_of_items
+    return {
+        'prompt_tokens': prompt_tokens,
+        'completion_tokens': completion_tokens,
+        'total_tokens': prompt_tokens + completion_tokens,
+    }
+
+
+def estimate_call_tokens(kind, text, number_of_items):
+    """Expected total tokens of one generator call on `text`, for pacing it against the deployment's quota"""
+    return estimate_generation_tokens(kind, count_tokens(text), number_of_items)['total_tokens']
+
+
+def estimate_study_pack_tokens(context_tokens, item_counts):
+    """Expected prompt and completion tokens of a study pack: one call, the items of each kind in `item_counts`"""
+    prompt_tokens = PROMPT_OVERHEAD_TOKENS['study_pack'] + context_tokens
+    completion_tokens = sum(COMPLETION_TOKENS_PER_ITEM[kind] * count for kind, count in item_counts.items())
+    return {
+        'prompt_tokens': prompt_tokens,
+        'completion_tokens': completion_tokens,
+        'total_tokens': prompt_tokens + completion_tokens,
+    }
+
+
+def record_token_usage(user, total_tokens):
+    """Add the tokens of a model call made outside the utils generators (which track their own) to the user's usage"""
+    usage, _ = UserTokenUsage.objects.get_or_create(user=user)
+    usage.add_tokens(total_tokens)
+    return usage
+
+
+def _reset_message(usage):
+    # UserTokenUsage resets 24 hours after last_reset
+    seconds = max(int((usage.last_reset + UserTokenUsage.WINDOW - timezone.now()).total_seconds()), 0)
+    hours, minutes = divmod(seconds // 60, 60)
+    return f"{hours} hours {minutes} minutes"
+
+
+def _token_limit_exceeded(user, usage, total_tokens):
+    remaining = usage.unreserved_tokens()
+    logger.info(f"Rejected generation for user {user.id}: needs ~{total_tokens} tokens, {remaining} remaining")
+    return PermissionDenied(
+        f"Token limit exceeded. This request needs about {total_tokens} tokens but only "
+        f"{remaining} remain. Your limit will reset in approximately {_reset_message(usage)}."
+    )
+
+
+def check_token_budget(user, estimate):
+    """
+    Reject a generation request before any outbound call if its estimated cost exceeds the
+    user's remaining tokens (less those held by calls in flight). Raises PermissionDenied with
+    the 'Token limit exceeded' message the frontend recognises.
+    """
+    usage, _ = UserTokenUsage.objects.get_or_create(user=user)
+    if estimate['total_tokens'] <= usage.unreserved_tokens():
+        return usage
+    raise _token_limit_exceeded(user, usage, estimate['total_tokens'])
+
+
+class TokenHold:
+    """Tokens held by reserve_tokens, counted down as the calls made under the hold record their usage"""
+
+    def __init__(self, user_id, tokens, held_since):
+        self.user_id = user_id
+        self.tokens = tokens
+        self.held_since = held_since  # Start of the usage window the hold was taken in
+        self.lock = threading.Lock()  # Fanned-out calls settle concurrently
+
+    def settle(self, token_count):
+        """Take up to `token_count` tokens off the hold; returns how many were taken"""
+        with self.lock:
+            taken = min(token_count, self.tokens)
+            self.tokens -= taken
+            return taken
+
+
+# Hold that usage recorded on the current thread is counted against; threads running calls for
+# the block (e.g. fanned-out generator calls) run in a copy of the context that took it
+_hold = ContextVar('token_hold', default=None)
+
+
+def settle_held_tokens(user_id, token_count):
+    """
+    Count `token_count` tokens of actual usage against the hold of the current context, if it is
+    the user's. Returns (tokens taken off the hold, start of the hold's window), or (0, None).
+    """
+    hold = _hold.get()
+    if hold is None or hold.user_id != user_id:
+        return 0, None
+    return hold.settle(token_count), hold.held_since
+
+
+@contextmanager
+def reserve_tokens(user, estimate):
+    """
+    Hold the estimated tokens of the model calls made inside the block against the user's limit,
+    so parallel generations of one user can't together overspend it. Taken atomically before
+    the calls; raises PermissionDenied like check_token_budget if they don't fit. The calls record
+    their actual usage as they return (the generators' own tracking, record_token_usage), and
+    each record moves that many tokens from the hold to the usage in the same UPDATE, so usage
+    is never counted twice. What is left of the hold is released when the block exits, whether
+    the calls succeeded or failed, unless the usage window rolled over meanwhile.
+    """
+    total_tokens = estimate['total_tokens']
+    if total_tokens <= 0:
+        yield
+        return
+    UserTokenUsage.objects.get_or_create(user=user)
+    held_since = UserTokenUsage.reserve(user, total_tokens)
+    if held_since is None:
+        raise _token_limit_exceeded(user, UserTokenUsage.objects.get(user=user), total_tokens)
+    hold = TokenHold(user.id, total_tokens, held_since)
+    context_token = _hold.set(hold)
+    try:
+        yield
+    finally:
+        _hold.reset(context_token)
+        UserTokenUsage.release(user, hold.tokens, held_since)
@@ -0,0 +1,35 @@
+import hashlib
+from django.conf import settings
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+
+
+class HashingTemporaryFileUploadHandler(TemporaryFileUploadHandler):
+    """
+    Streams every upload straight to a temporary file on disk, hashing it as it is written.
+
+    The resulting TemporaryUploadedFile carries two extra attributes:
+    - sha256: hex digest of the uploaded bytes
+    - exceeds_size_limit: True if the upload was larger than MAX_UPLOAD_SIZE_BYTES
+      (anything past the limit is discarded rather than written)
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.sha256 = hashlib.sha256()
+        self.bytes_received = 0
+        self.exceeds_size_limit = False
+
+    def receive_data_chunk(self, raw_data, start):
+        self.bytes_received += len(raw_data)
+        if self.bytes_received > settings.MAX_UPLOAD_SIZE_BYTES:
+            self.exceeds_size_limit = True
+            return None
+
+        self.sha256.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        uploaded_file = super().file_complete(file_size)
+        uploaded_file.sha256 = self.sha256.hexdigest()
+        uploaded_file.exceeds_size_limit = self.exceeds_size_limit
+        return uploaded_file
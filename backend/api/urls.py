@@ -1,11 +1,22 @@
 from django.urls import path
 from .views import (
     DocumentProcessView,
+    DocumentBatchProcessView,
+    DocumentIngestionJobView,
+    DocumentIngestionBatchView,
+    DocumentTextView,
+    DocumentReplaceView,
+    DocumentVersionListView,
+    SearchView,
+    GenerationEstimateView,
+    GenerationJobView,
+    GenerationJobStreamView,
     UserDocumentsListView,
     DocumentDeleteView,
     QuizGenerationView,
     DocumentQuizzesListView,
     UserTokenUsageView,
+    TokenUsageBreakdownView,
     QuizSubmissionView,
     QuizHistoryListView,
     QuizHistoryDetailView,
@@ -13,6 +24,7 @@ from .views import (
     DocumentFlashcardsListView,
     FlashcardReviewView,
     MnemonicGenerationView,
+    StudyPackGenerationView,
     DocumentMnemonicsListView,
     MnemonicDocumentsListView,
     ReviewDocumentsTodayView,
@@ -32,11 +44,27 @@ urlpatterns = [
 
     # User endpoints
     path("token-usage/", UserTokenUsageView.as_view(), name="token-usage"),
+    path("token-usage/breakdown/", TokenUsageBreakdownView.as_view(), name="token-usage-breakdown"),
     
     # Document endpoints
     path("documents/process/", DocumentProcessView.as_view(), name="process-document"),
+    path("documents/process-batch/", DocumentBatchProcessView.as_view(), name="process-document-batch"),
+    path("documents/jobs/<int:job_id>/", DocumentIngestionJobView.as_view(), name="document-ingestion-job"),
+    path("documents/batches/<uuid:batch_id>/", DocumentIngestionBatchView.as_view(), name="document-ingestion-batch"),
     path("documents/", UserDocumentsListView.as_view(), name="get-documents"),
     path("documents/delete/<int:id>/", DocumentDeleteView.as_view(),name="delete-document"),
+    path("documents/<int:document_id>/text/", DocumentTextView.as_view(), name="document-text"),
+    path("documents/<int:document_id>/replace/", DocumentReplaceView.as_view(), name="replace-document"),
+    path("documents/<int:document_id>/versions/", DocumentVersionListView.as_view(), name="document-versions"),
+
+    # Search
+    path("search/", SearchView.as_view(), name="search"),
+
+    # Generation cost estimate
+    path("generate/estimate/", GenerationEstimateView.as_view(), name="generation-estimate"),
+    # Status of a queued quiz, flashcard or mnemonic generation
+    path("generate/jobs/<int:job_id>/", GenerationJobView.as_view(), name="generation-job"),
+    path("generate/jobs/<int:job_id>/stream/", GenerationJobStreamView.as_view(), name="generation-job-stream"),
 
     # Quiz endpoints
     path("generate-quiz/", QuizGenerationView.as_view(), name="generate-quiz"),
@@ -57,6 +85,9 @@ urlpatterns = [
     path("get-mnemonics/<int:document_id>/", DocumentMnemonicsListView.as_view(), name="get-mnemonics"),
     path("mnemonic-documents/", MnemonicDocumentsListView.as_view(), name="mnemonic-documents"),
 
+    # Quizzes, flashcards and mnemonics from one generator call
+    path("generate-study-pack/", StudyPackGenerationView.as_view(), name="generate-study-pack"),
+
     # Review endpoints
     path("review/today/", ReviewDocumentsTodayView.as_view(), name="review-today"),
     path("review/date/", ReviewDocumentsByDateView.as_view(), name="review-by-date"),
@@ -0,0 +1,62 @@
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+
+from .buffering import BufferedWriter
+from .models import TokenUsageEvent, TokenUsageHourly
+
+logger = logging.getLogger(__name__)
+
+# Feature that token usage recorded on the current thread is attributed to
+_feature = ContextVar('token_usage_feature', default=TokenUsageEvent.Feature.OTHER)
+
+
+@contextmanager
+def usage_feature(feature):
+    """Attribute the token usage recorded inside the block (on this thread) to `feature`"""
+    token = _feature.set(feature)
+    try:
+        yield
+    finally:
+        _feature.reset(token)
+
+
+def record_usage_event(user_id, tokens):
+    """
+    Add a usage event to the ledger buffer. The buffer is written once TOKEN_LEDGER_BATCH_SIZE
+    events are waiting, or TOKEN_LEDGER_FLUSH_SECONDS after the first of them, whichever is sooner.
+    """
+    if tokens <= 0:
+        return
+    _events.add(TokenUsageEvent(user_id=user_id, feature=_feature.get(), tokens=tokens, created_at=timezone.now()))
+
+
+def _write_events(events):
+    rollups = {}
+    for event in events:
+        key = (event.user_id, event.feature, event.created_at.replace(minute=0, second=0, microsecond=0))
+        tokens, calls = rollups.get(key, (0, 0))
+        rollups[key] = (tokens + event.tokens, calls + 1)
+    try:
+        with transaction.atomic():
+            TokenUsageEvent.objects.bulk_create(events)
+            for (user_id, feature, hour), (tokens, calls) in rollups.items():
+                TokenUsageHourly.add(user_id, feature, hour, tokens, calls)
+    except DatabaseError as e:
+        # The limits are enforced by UserTokenUsage; only the reporting misses these events
+        logger.error(f"Failed to write {len(events)} token usage events: {e}")
+        return 0
+    return len(events)
+
+
+_events = BufferedWriter(_write_events, 'TOKEN_LEDGER_BATCH_SIZE', 'TOKEN_LEDGER_FLUSH_SECONDS')
+
+
+def flush_usage_events():
+    """
+    Write the buffered events with one bulk insert and add them to their hourly rollups, in one
+    transaction. Returns the number of events written.
+    """
+    return _events.flush()
@@ -0,0 +1,171 @@
+import os
+import re
+import math
+import logging
+from collections import Counter
+from django.db import transaction
+
+from .models import Document, DocumentChunk, DocumentVersion, GenerationJob, Quiz, Flashcard, Mnemonic
+from .chunking import split_into_chunks, load_document_text
+from .compression import decompress_text
+from .search import index_document
+from .generation import COUNT_PARAMS
+
+logger = logging.getLogger(__name__)
+
+# An item is attributed to a chunk only if the chunk covers at least this share of the item's (IDF-weighted) words;
+# items below it are treated as drawing on the whole document and are kept
+ATTRIBUTION_MIN_OVERLAP = 0.5
+
+_WORD_RE = re.compile(r'\w{4,}')
+
+
+def _words(text):
+    return set(_WORD_RE.findall((text or '').lower()))
+
+
+def _quiz_text(quiz):
+    return ' '.join([quiz.question, quiz.option1, quiz.option2, quiz.option3, quiz.option4, quiz.explanation or ''])
+
+
+def _flashcard_text(flashcard):
+    return f"{flashcard.front} {flashcard.back}"
+
+
+def _mnemonic_text(mnemonic):
+    return f"{mnemonic.topic} {mnemonic.mnemonic_explanation}"
+
+
+def attribute_to_chunks(item_texts, chunk_texts):
+    """
+    Guess the source chunk of each generated item from word overlap, weighting rare words higher.
+    Returns a list with the best chunk position for each item, or None where no chunk clearly matches.
+    """
+    chunk_words = [_words(text) for text in chunk_texts]
+    document_frequency = Counter(word for words in chunk_words for word in words)
+    chunk_count = len(chunk_words)
+
+    attributions = []
+    for text in item_texts:
+        weights = {
+            word: math.log(1 + chunk_count / document_frequency[word])
+            for word in _words(text) if word in document_frequency
+        }
+        total = sum(weights.values())
+        best, best_score = None, 0.0
+        if total:
+            for position, words in enumerate(chunk_words):
+                score = sum(weight for word, weight in weights.items() if word in words) / total
+                if score > best_score:
+                    best, best_score = position, score
+        attributions.append(best if best_score >= ATTRIBUTION_MIN_OVERLAP else None)
+    return attributions
+
+
+def _stale_items(items, item_text, chunk_texts, changed_positions):
+    attributions = attribute_to_chunks([item_text(item) for item in items], chunk_texts)
+    return [item for item, position in zip(items, attributions) if position in changed_positions]
+
+
+def replace_document_content(document, job, extracted_text, summary):
+    """
+    Replace a document's file with a new version, keeping generated items whose source chunks did not change.
+    The previous content is archived as a DocumentVersion that also records the stale items removed,
+    which enqueue_regeneration_jobs later replaces from the changed text only.
+    """
+    old_chunks = [
+        (decompress_text(text), content_hash) for text, content_hash in document.chunks.values_list('text', 'content_hash')
+    ]
+    if not old_chunks:
+        # Documents ingested before chunking
+        old_chunks = [(chunk['text'], chunk['content_hash']) for chunk in split_into_chunks(load_document_text(document))]
+    new_chunks = split_into_chunks(extracted_text)
+
+    old_hashes = {content_hash for _, content_hash in old_chunks}
+    new_hashes = {chunk['content_hash'] for chunk in new_chunks}
+    changed_positions = {position for position, (_, content_hash) in enumerate(old_chunks) if content_hash not in new_hashes}
+    added_chunks = sum(1 for chunk in new_chunks if chunk['content_hash'] not in old_hashes)
+    old_texts = [text for text, _ in old_chunks]
+
+    stale_quizzes = stale_flashcards = stale_mnemonics = []
+    if changed_positions:
+        stale_quizzes = _stale_items(list(document.quizzes.all()), _quiz_text, old_texts, changed_positions)
+        stale_flashcards = _stale_items(list(document.flashcards.all()), _flashcard_text, old_texts, changed_positions)
+        stale_mnemonics = _stale_items(list(document.mnemonics.all()), _mnemonic_text, old_texts, changed_positions)
+    stale_count = len(stale_quizzes) + len(stale_flashcards) + len(stale_mnemonics)
+
+    stale_items = {
+        'quizzes': dict(Counter(quiz.difficulty for quiz in stale_quizzes)),
+        'flashcards': dict(Counter(flashcard.difficulty for flashcard in stale_flashcards)),
+        'mnemonics': [mnemonic.topic for mnemonic in stale_mnemonics],
+    }
+    item_count = document.quizzes.count() + document.flashcards.count() + document.mnemonics.count()
+
+    with transaction.atomic():
+        document = Document.objects.select_for_update().get(pk=document.pk)
+        version = DocumentVersion.objects.create(
+            document=document,
+            version=document.version,
+            filename=document.filename,
+            size=document.size,
+            file_type=document.file_type,
+            extracted_text=''.join(old_texts),
+            summary=document.summary,
+            uploaded_at=document.upload_date,
+            changed_chunks=added_chunks,
+            kept_items=item_count - stale_count,
+            stale_items=stale_items,
+            regeneration_status='queued' if stale_count and added_chunks else 'skipped',
+        )
+
+        # Answers and reviews of stale items go with them
+        Quiz.objects.filter(id__in=[quiz.id for quiz in stale_quizzes]).delete()
+        Flashcard.objects.filter(id__in=[flashcard.id for flashcard in stale_flashcards]).delete()
+        Mnemonic.objects.filter(id__in=[mnemonic.id for mnemonic in stale_mnemonics]).delete()
+
+        document.filename, _ = os.path.splitext(job.original_filename)
+        document.size = job.size
+        document.file_type = job.file_type
+        document.extracted_text = extracted_text
+        document.summary = summary
+        document.version += 1
+        document.save(update_fields=['filename', 'size', 'file_type', 'extracted_text', 'summary', 'version'])
+
+        DocumentChunk.objects.filter(document=document).delete()
+        DocumentChunk.objects.bulk_create([DocumentChunk(document=document, **chunk) for chunk in new_chunks])
+        index_document(document)
+
+    logger.info(
+        f"Document {document.id} replaced with version {document.version}: {len(changed_positions)} chunks changed, "
+        f"{added_chunks} added, {stale_count} of {item_count} generated items stale"
+    )
+    return document, version
+
+
+def enqueue_regeneration_jobs(version):
+    """
+    Queue generation jobs replacing the items removed as stale when `version` was replaced, one per
+    kind and difficulty. They draw only on the text that changed, run under the owner's token
+    reservations like any request, and record their outcome on the version when the last one ends.
+    Returns the jobs.
+    """
+    if version.regeneration_status != 'queued':
+        return []
+
+    document = version.document
+    jobs = []
+    for kind, stale in ((GenerationJob.Kind.QUIZ, 'quizzes'), (GenerationJob.Kind.FLASHCARD, 'flashcards')):
+        for difficulty, count in version.stale_items.get(stale, {}).items():
+            jobs.append(GenerationJob(
+                user=document.user, document=document, kind=kind, document_version=version,
+                params={'difficulty': difficulty, COUNT_PARAMS[kind]: count, 'use_cache': False},
+            ))
+    topics = version.stale_items.get('mnemonics', [])
+    if topics:
+        jobs.append(GenerationJob(
+            user=document.user, document=document, kind=GenerationJob.Kind.MNEMONIC, document_version=version,
+            params={'topics': topics, 'mnemonic_types': None, 'instructions': None, 'use_cache': False},
+        ))
+    GenerationJob.objects.bulk_create(jobs)
+    logger.info(f"Queued {len(jobs)} regeneration jobs for changed sections of document {document.id}")
+    return jobs
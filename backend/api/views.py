@@ -1,53 +1,67 @@
-import os
 import json
-import uuid
 import logging
 from datetime import datetime, date, timedelta
 from typing import Dict, Any
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import Q, F, Prefetch, Sum
+from django.db.models.functions import TruncDate
+from django.urls import reverse
+from django.http import StreamingHttpResponse
 
 from rest_framework import generics, status 
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.parsers import MultiPartParser, FormParser
-from rest_framework.exceptions import ValidationError, PermissionDenied, NotFound
+from rest_framework.renderers import JSONRenderer
+from rest_framework.exceptions import ValidationError, PermissionDenied, NotFound, APIException
 
 from .serializers import (
     UserSerializer, DocumentSerializer, QuizSerializer, UserTokenUsageSerializer,
-    QuizGenerationRequestSerializer, QuizItemSerializer, QuizSubmissionSerializer,
+    QuizGenerationRequestSerializer, QuizSubmissionSerializer,
     QuizAnswerSerializer, FlashcardSerializer, FlashcardGenerationRequestSerializer,
-    FlashcardItemSerializer, FlashcardReviewRequestSerializer, FlashcardReviewSerializer,
+    FlashcardReviewRequestSerializer, FlashcardReviewSerializer,
     QuizSessionHistorySerializer, QuizSessionDetailSerializer, MnemonicSerializer,
-    MnemonicGenerationRequestSerializer, MnemonicItemSerializer, DocumentWithMnemonicsStatusSerializer,
+    MnemonicGenerationRequestSerializer, DocumentWithMnemonicsStatusSerializer,
     StudyPlanSerializer, StudyPlanGenerationRequestSerializer, StudyPlanUpdateSerializer, 
-    StudyPlanStepUpdateSerializer, StudyPlanStepSerializer
+    StudyPlanStepUpdateSerializer, StudyPlanStepSerializer, DocumentIngestionJobSerializer,
+    DocumentVersionSerializer, SearchRequestSerializer, GenerationEstimateRequestSerializer,
+    GenerationJobSerializer, StudyPackGenerationRequestSerializer, TokenUsageBreakdownRequestSerializer
 )
 
-from utils.doc_processor import extract_and_preprocess_text
-from utils.quiz_generator import generate_quizzes_from_text, QuizGenerationError, DEFAULT_QUIZ_GENERATION_RETRIES
-from utils.adaptive_quiz_generator import (
-    generate_adaptive_quizzes, 
-    save_adaptive_quizzes, 
-)
-from utils.flashcard_generator import generate_flashcards_from_text, FlashcardGenerationError, DEFAULT_FLASHCARD_GENERATION_RETRIES
-from utils.mnemonic_generator import generate_mnemonics_from_text, MnemonicGenerationError, DEFAULT_MNEMONIC_GENERATION_RETRIES
 from utils.mastery_calculator import calculate_quiz_mastery_score, calculate_document_mastery_score, needs_more_questions, update_review_schedule
 from utils.study_planner import generate_study_plan, validate_study_plan_data, StudyPlannerError
-from .models import Document, Quiz, UserTokenUsage, QuizSession, QuizAnswer, Flashcard, FlashcardSession, FlashcardReview, Mnemonic, StudyPlan, StudyPlanStep, StudyPlanResource
+from .models import Document, Quiz, UserTokenUsage, QuizSession, QuizAnswer, Flashcard, FlashcardSession, FlashcardReview, Mnemonic, StudyPlan, StudyPlanStep, StudyPlanResource, DocumentIngestionJob, DocumentVersion, GenerationJob, TokenUsageEvent, TokenUsageHourly
+from .ingestion import enqueue_document_upload, enqueue_document_batch, create_document_from_cache
+from .search import search, SearchCursorError
+from .retrieval import select_generation_context, TopicMatcher, DEFAULT_CONTEXT_ITEMS
+from .tokens import count_tokens, estimate_generation_tokens
+from .generation import enqueue_generation_job, enqueue_adaptive_quiz_job, generation_part_counts
+from .streaming import EventStreamRenderer, generation_job_events
+from .llm_cache import cached_llm_call
+from .llm_gateway import llm_call, LLMUnavailable, PERPLEXITY
+from .usage_ledger import usage_feature
+from .chunking import load_document_text, read_document_range, read_document_page, document_text_length, create_document_chunks
 
 
 logger = logging.getLogger(__name__)
 
 
+class UploadTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = "File is too large."
+    default_code = 'upload_too_large'
+
+
 class UserDocumentsListView(generics.ListAPIView):
     serializer_class = DocumentSerializer
     permission_classes = [IsAuthenticated]
     
     def get_queryset(self):
-        return Document.objects.filter(user=self.request.user)
+        return Document.objects.without_text().filter(user=self.request.user)
 
 class CreateUserView(generics.CreateAPIView):
     queryset = User.objects.all()
@@ -56,7 +70,7 @@ class CreateUserView(generics.CreateAPIView):
 
 
 class DocumentDeleteView(generics.DestroyAPIView):
-    queryset = Document.objects.all()
+    queryset = Document.objects.without_text()
     serializer_class = DocumentSerializer
     permission_classes = [IsAuthenticated]
     lookup_field = 'id'
@@ -64,7 +78,23 @@ class DocumentDeleteView(generics.DestroyAPIView):
     def get_queryset(self):
         return self.queryset.filter(user=self.request.user)
 
+def validate_uploaded_file(uploaded_file, user):
+    """Raises a 400/413 error for an empty upload or one over MAX_UPLOAD_SIZE_BYTES."""
+    if not uploaded_file.size:
+        logger.warning(f"Uploaded file '{uploaded_file.name}' is empty for user {user.id}")
+        raise ValidationError({"file": ["Uploaded file is empty."]})
+
+    if getattr(uploaded_file, 'exceeds_size_limit', False):
+        logger.warning(f"Uploaded file '{uploaded_file.name}' exceeds the size limit for user {user.id}")
+        raise UploadTooLarge(f"File is too large. The maximum upload size is {settings.MAX_UPLOAD_SIZE_BYTES // (1024 * 1024)} MB.")
+
+
 class DocumentProcessView(generics.CreateAPIView):
+    """
+    Accepts a document upload and queues it for background extraction.
+    Returns 202 with a job id; poll DocumentIngestionJobView for the resulting Document id.
+    Files that were extracted before are served from the extraction cache with 201 and the Document id.
+    """
     serializer_class = DocumentSerializer
     permission_classes = [IsAuthenticated]
     parser_classes = (MultiPartParser, FormParser)
@@ -72,58 +102,312 @@ class DocumentProcessView(generics.CreateAPIView):
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        self.perform_create(serializer)
-        headers = self.get_success_headers(serializer.data)
-        return Response({'id': serializer.instance.id}, status=status.HTTP_201_CREATED, headers=headers)
+        uploaded_file = self.get_uploaded_file()
 
-    def perform_create(self, serializer):
-        """
-        Handles document upload, extraction, and saving the Document instance.
-        Called by CreateAPIView after serializer validation.
-        """
+        document = create_document_from_cache(request.user, uploaded_file)
+        if document is not None:
+            return Response(
+                {'id': document.id, 'document_id': document.id, 'status': DocumentIngestionJob.Status.DONE},
+                status=status.HTTP_201_CREATED
+            )
+
+        job = self.perform_create(uploaded_file)
+        return Response(
+            {'job_id': job.id, 'status': job.status},
+            status=status.HTTP_202_ACCEPTED,
+            headers={'Location': reverse('document-ingestion-job', kwargs={'job_id': job.id})}
+        )
+
+    def get_uploaded_file(self):
+        """Returns the validated upload from the request or raises a 400/413 error."""
         uploaded_file = self.request.FILES.get('file')
         if not uploaded_file:
             logger.warning(f"File not found in request for user {self.request.user.id}")
             raise ValidationError({"file": ["No file was submitted."]})
 
-        original_filename = uploaded_file.name
-        file_content_bytes = uploaded_file.read()
-        file_size_bytes = uploaded_file.size
-        filename_without_ext, file_extension = os.path.splitext(original_filename)
-        file_extension = file_extension.lstrip('.')
+        validate_uploaded_file(uploaded_file, self.request.user)
+        return uploaded_file
+
+    def perform_create(self, uploaded_file):
+        """
+        Hands the uploaded file to the ingestion queue.
+        Extraction itself runs in the process_ingestion_jobs worker.
+        """
+        try:
+            return enqueue_document_upload(self.request.user, uploaded_file)
+        except OSError as e:
+            logger.exception(f"Failed to spool upload '{uploaded_file.name}' for user {self.request.user.id}: {e}")
+            raise ValidationError({"detail": "An unexpected error occurred while saving the upload."})
+
+
+class DocumentBatchProcessView(generics.GenericAPIView):
+    """
+    Accepts many files in one multipart request (repeated 'files' field) and ingests them together.
+    Cached files become Documents right away; the rest are queued for the ingestion worker,
+    which extracts up to INGESTION_MAX_RUNNING_JOBS_PER_USER of a user's files at a time.
+    Returns a result per file, in upload order; poll DocumentIngestionBatchView for queued files.
+    Responds 201 when every file is done, 202 when some are queued, and 207 when some files failed.
+    """
+    permission_classes = [IsAuthenticated]
+    parser_classes = (MultiPartParser, FormParser)
+
+    def post(self, request, *args, **kwargs):
+        uploaded_files = request.FILES.getlist('files')
+        if not uploaded_files:
+            raise ValidationError({"files": ["No files were submitted."]})
+        if len(uploaded_files) > settings.INGESTION_BATCH_MAX_FILES:
+            raise ValidationError({"files": [f"At most {settings.INGESTION_BATCH_MAX_FILES} files can be uploaded at once."]})
+
+        results = [None] * len(uploaded_files)
+        accepted = []
+        for position, uploaded_file in enumerate(uploaded_files):
+            try:
+                validate_uploaded_file(uploaded_file, request.user)
+                accepted.append(position)
+            except APIException as e:
+                detail = e.detail.get('file', e.detail) if isinstance(e.detail, dict) else e.detail
+                results[position] = str(detail[0] if isinstance(detail, list) else detail)
+
+        batch_id, outcomes = enqueue_document_batch(request.user, [uploaded_files[i] for i in accepted])
+        for position, outcome in zip(accepted, outcomes):
+            results[position] = outcome
+
+        response_results = []
+        for uploaded_file, outcome in zip(uploaded_files, results):
+            if isinstance(outcome, Document):
+                response_results.append({'filename': uploaded_file.name, 'status': DocumentIngestionJob.Status.DONE, 'document_id': outcome.id})
+            elif isinstance(outcome, DocumentIngestionJob):
+                response_results.append({'filename': uploaded_file.name, 'status': outcome.status, 'job_id': outcome.id})
+            else:
+                response_results.append({'filename': uploaded_file.name, 'status': DocumentIngestionJob.Status.FAILED, 'error': outcome})
+
+        failed = sum(1 for result in response_results if result['status'] == DocumentIngestionJob.Status.FAILED)
+        queued = any('job_id' in result for result in response_results)
+        if failed == len(response_results):
+            response_status = status.HTTP_400_BAD_REQUEST
+        elif failed:
+            response_status = status.HTTP_207_MULTI_STATUS
+        elif queued:
+            response_status = status.HTTP_202_ACCEPTED
+        else:
+            response_status = status.HTTP_201_CREATED
+
+        headers = {}
+        if queued:
+            headers['Location'] = reverse('document-ingestion-batch', kwargs={'batch_id': batch_id})
+        return Response({'batch_id': batch_id, 'results': response_results}, status=response_status, headers=headers)
+
+
+class DocumentIngestionBatchView(generics.ListAPIView):
+    """
+    Reports the status of every queued file of a batch upload.
+    """
+    serializer_class = DocumentIngestionJobSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return DocumentIngestionJob.objects.filter(
+            user=self.request.user, batch_id=self.kwargs['batch_id']
+        ).prefetch_related('ranges').order_by('id')
+
+
+class DocumentReplaceView(DocumentProcessView):
+    """
+    Uploads a corrected file for an existing document and queues it as a new version.
+    Generated items whose source text did not change are kept; the rest are regenerated
+    from the changed sections once extraction finishes. Returns 202 with a job id.
+    """
+
+    def create(self, request, *args, **kwargs):
+        document = get_object_or_404(Document.objects.without_text(), pk=kwargs['document_id'], user=request.user)
+        uploaded_file = self.get_uploaded_file()
 
-        if not file_content_bytes:
-            logger.warning(f"Uploaded file '{original_filename}' is empty for user {self.request.user.id}")
-            raise ValidationError({"file": ["Uploaded file is empty."]})
+        pending = DocumentIngestionJob.objects.filter(
+            target_document=document,
+            status__in=[DocumentIngestionJob.Status.QUEUED, DocumentIngestionJob.Status.RUNNING],
+        )
+        if pending.exists():
+            return Response(
+                {"error": "A new version of this document is already being processed."},
+                status=status.HTTP_409_CONFLICT
+            )
 
         try:
-            result = extract_and_preprocess_text(file_content_bytes, self.request.user) # Updated function call with user
-
-            if result.get('error'):
-                logger.error(f"Document processing failed for '{original_filename}' user {self.request.user.id}: {result['error']}")
-                if "client not initialized" in result['error']:
-                    raise ValidationError({"detail": "Document processing service configuration error."})
-                else:
-                    raise ValidationError({"detail": "Failed to process document content."})
-
-            extracted_text = result.get('text', '')
-            summary = result.get('summary', '')
-
-            serializer.save(
-                user=self.request.user,
-                filename=filename_without_ext,
-                size=file_size_bytes,
-                file_type=file_extension,
-                extracted_text=extracted_text,
-                summary=summary
+            job = enqueue_document_upload(request.user, uploaded_file, target_document=document)
+        except OSError as e:
+            logger.exception(f"Failed to spool replacement upload '{uploaded_file.name}' for document {document.id}: {e}")
+            raise ValidationError({"detail": "An unexpected error occurred while saving the upload."})
+
+        return Response(
+            {'job_id': job.id, 'document_id': document.id, 'status': job.status},
+            status=status.HTTP_202_ACCEPTED,
+            headers={'Location': reverse('document-ingestion-job', kwargs={'job_id': job.id})}
+        )
+
+
+class DocumentVersionListView(generics.ListAPIView):
+    """
+    Lists the earlier versions of a document, newest first.
+    """
+    serializer_class = DocumentVersionSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        document = get_object_or_404(Document.objects.without_text(), pk=self.kwargs['document_id'], user=self.request.user)
+        return DocumentVersion.objects.filter(document=document).defer('extracted_text', 'summary')
+
+
+class DocumentIngestionJobView(generics.RetrieveAPIView):
+    """
+    Reports the status of a queued document upload (queued/running/done/failed).
+    Once done, document_id holds the id of the created Document.
+    """
+    serializer_class = DocumentIngestionJobSerializer
+    permission_classes = [IsAuthenticated]
+    lookup_url_kwarg = 'job_id'
+
+    def get_queryset(self):
+        return DocumentIngestionJob.objects.filter(user=self.request.user).prefetch_related('ranges')
+
+
+class DocumentTextView(generics.GenericAPIView):
+    """
+    Reads part of a document's extracted text, loading only the chunks that cover it.
+    Query parameters: page (1-based page number) or start/end character offsets.
+    Ranges are capped at DOCUMENT_RANGE_MAX_CHARS characters per request.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, document_id):
+        document = get_object_or_404(Document.objects.without_text(), pk=document_id, user=request.user)
+
+        total_length = document_text_length(document)
+        if not total_length:
+            # Documents ingested before chunked storage are chunked on first read
+            create_document_chunks(document, load_document_text(document))
+            total_length = document_text_length(document)
+
+        page = request.query_params.get('page')
+        if page is not None:
+            try:
+                page = int(page)
+            except ValueError:
+                return Response({'error': 'page must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+
+            text = read_document_page(document, page)
+            if text is None:
+                return Response({'error': f'Page {page} not found in this document.'}, status=status.HTTP_404_NOT_FOUND)
+            return Response({
+                'document_id': document.id,
+                'page': page,
+                'text': text,
+                'total_length': total_length,
+            })
+
+        try:
+            start = int(request.query_params.get('start', 0))
+            end = int(request.query_params.get('end', start + settings.DOCUMENT_RANGE_MAX_CHARS))
+        except ValueError:
+            return Response({'error': 'start and end must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+
+        if start < 0 or end < start:
+            return Response({'error': 'Invalid range: expected 0 <= start <= end'}, status=status.HTTP_400_BAD_REQUEST)
+
+        end = min(end, start + settings.DOCUMENT_RANGE_MAX_CHARS, total_length)
+        return Response({
+            'document_id': document.id,
+            'start': start,
+            'end': max(end, start),
+            'text': read_document_range(document, start, end),
+            'total_length': total_length,
+            'has_more': end < total_length,
+        })
+
+
+class SearchView(generics.GenericAPIView):
+    """
+    Full-text search across the user's documents (filename, summary and extracted text)
+    and generated quizzes, flashcards and mnemonics.
+    Query parameters: q (web-search syntax: quotes, OR, -word), types, limit, cursor.
+    Returns ranked hits with highlighted snippets and a next_cursor for the following page.
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = SearchRequestSerializer
+
+    def get(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+
+        try:
+            hits, next_cursor = search(
+                request.user,
+                params['q'],
+                types=params.get('types'),
+                limit=params.get('limit'),
+                cursor=params.get('cursor'),
             )
-            logger.info(f"Successfully processed and saved document '{filename_without_ext}' for user {self.request.user.id}")
+        except SearchCursorError as e:
+            raise ValidationError({"cursor": [str(e)]})
+
+        return Response({'results': hits, 'next_cursor': next_cursor})
+
+
+def generation_job_accepted(job):
+    """
+    202 response pointing the client at the status endpoint of a queued generation job
+    (200 if the job was served from the pool and is already done)
+    """
+    return Response(
+        {
+            'job_id': job.id,
+            'kind': job.kind,
+            'document_id': job.document_id,
+            'status': job.status,
+            'stream_url': reverse('generation-job-stream', kwargs={'job_id': job.id}),
+        },
+        status=status.HTTP_200_OK if job.status == GenerationJob.Status.DONE else status.HTTP_202_ACCEPTED,
+        headers={'Location': reverse('generation-job', kwargs={'job_id': job.id})}
+    )
+
+
+class GenerationJobView(generics.RetrieveAPIView):
+    """
+    Reports the status of a queued quiz, flashcard or mnemonic generation (queued/running/done/failed).
+    Once done, item_ids holds the ids of the saved items and result the generation summary, with
+    the per-item errors and the status (200, or 207 if some items failed) the synchronous endpoint returned.
+    """
+    serializer_class = GenerationJobSerializer
+    permission_classes = [IsAuthenticated]
+    lookup_url_kwarg = 'job_id'
+
+    def get_queryset(self):
+        return GenerationJob.objects.filter(user=self.request.user)
+
+
+class GenerationJobStreamView(generics.GenericAPIView):
+    """
+    Streams the items of a generation job as Server-Sent Events while the worker saves them:
+    `item` events with each saved item, then `done` (the job result) or `error`.
+    Each response covers a short window; clients reconnect with the Last-Event-ID header or the
+    `last_event_id` query parameter until `done` or `error`.
+    Clients that can't keep a connection open poll GenerationJobView instead.
+    """
+    permission_classes = [IsAuthenticated]
+    renderer_classes = [EventStreamRenderer, JSONRenderer]
+
+    def get(self, request, job_id, *args, **kwargs):
+        job = get_object_or_404(GenerationJob, pk=job_id, user=request.user)
+        last_event_id = request.headers.get('Last-Event-ID') or request.query_params.get('last_event_id') or 0
+        try:
+            last_event_id = max(int(last_event_id), 0)
+        except ValueError:
+            return Response({'error': 'last_event_id must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        response = StreamingHttpResponse(generation_job_events(job, last_event_id), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # Don't let nginx buffer the stream
+        return response
 
-        except ValidationError:
-            raise
-        except Exception as e:
-            logger.exception(f"Unexpected error during document processing for '{original_filename}' user {self.request.user.id}: {e}")
-            raise ValidationError({"detail": "An unexpected error occurred during document processing."})
 
 class QuizGenerationView(generics.GenericAPIView):
     """
@@ -132,6 +416,7 @@ class QuizGenerationView(generics.GenericAPIView):
     Generates quizzes for a specific document using Azure OpenAI Models via a POST request.
     Requires document_id, difficulty, and number_of_quizzes in the request body.
     Tracks token usage and enforces user limits.
+    Generation runs in the background: returns 202 with a job id to poll (see GenerationJobView).
     """
     permission_classes = [IsAuthenticated]
     serializer_class = QuizGenerationRequestSerializer # Use the new serializer for input validation
@@ -147,105 +432,21 @@ class QuizGenerationView(generics.GenericAPIView):
 
         # Get the document and verify ownership
         try:
-            document = get_object_or_404(Document, pk=document_id, user=request.user)
+            document = get_object_or_404(Document.objects.without_text(), pk=document_id, user=request.user)
         except Document.DoesNotExist: # Although get_object_or_404 raises Http404, catch explicitly for clarity
              raise NotFound(detail="Document not found or you do not have permission.")
 
-        if not document.extracted_text:
-            logger.warning(f"Document ID {document_id} has no extracted text for quiz generation.")
-            return Response(
-                {"error": "Document content is empty or not processed."},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-          
         try:
-            # Pass the user and number_of_quizzes to track token usage and control generation
-            quiz_data = generate_quizzes_from_text(
-                text_content=document.extracted_text,
-                difficulty=difficulty,
-                number_of_quizzes=number_of_quizzes, # Pass the requested number
-                user=request.user,  # Pass user for token tracking
-                retries=DEFAULT_QUIZ_GENERATION_RETRIES
-            )
+            # Rejected up front if the estimated cost exceeds the remaining tokens
+            job = enqueue_generation_job(request.user, document, GenerationJob.Kind.QUIZ, {
+                'difficulty': difficulty,
+                'number_of_quizzes': number_of_quizzes,
+                'use_cache': validated_data['use_cache'],
+            })
         except PermissionDenied as e:
-            # Handle token limit exceeded exception from token_tracking utility
             return Response({"error": str(e)}, status=status.HTTP_403_FORBIDDEN)
-        except QuizGenerationError as e:
-            logger.error(f"Quiz generation failed for doc {document_id}: {e}")
-            return Response({"error": str(e)}, status=e.status_code)
-        except Exception as e:
-            logger.exception(f"Unexpected error calling quiz generation utility for doc {document_id}: {e}")
-            return Response(
-                {"error": "An unexpected error occurred during quiz generation."},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
-
-        # Process the generated quiz data
-        generated_quizzes = quiz_data.get("quizzes", [])
-        saved_count = 0
-        # TODO: Remove this uuid later
-        overall_quiz_id = str(uuid.uuid4())  
-        errors = []
-        # Limit saving to the number requested, even if the AI returned more
-        quizzes_to_save = generated_quizzes[:number_of_quizzes] # Limit to requested number
-
-        successfully_saved_quizzes = []
-        for item in quizzes_to_save:
-            item_serializer = QuizItemSerializer(data=item)
-            if item_serializer.is_valid():
-                validated_item_data = item_serializer.validated_data
-                try:
-                    # Handle explanation field - convert JSON to string if needed
-                    explanation_data = validated_item_data.get("explanation")
-                    explanation_str = explanation_data
-                    if isinstance(explanation_data, dict):
-                        # Convert JSON object to string for storage in TextField
-                        explanation_str = json.dumps(explanation_data)
-                    
-                    quiz_instance = Quiz.objects.create(
-                        user=request.user,
-                        document=document,
-                        question=validated_item_data["question"],
-                        option1=validated_item_data["options"][0],
-                        option2=validated_item_data["options"][1],
-                        option3=validated_item_data["options"][2],
-                        option4=validated_item_data["options"][3],
-                        correct_option_index=validated_item_data["correct_option_index"],
-                        hint=validated_item_data.get("hint"),
-                        explanation=explanation_str,
-                        keywords=validated_item_data.get("keywords", []),
-                        difficulty=difficulty # Use difficulty from original request
-                    )
-                    successfully_saved_quizzes.append(quiz_instance)
-                    saved_count += 1
-                except Exception as e:
-                    # Log error during DB save
-                    logger.error(f"Failed to save validated quiz item for doc {document_id}: {validated_item_data.get('question', 'N/A')}. Error: {e}")
-                    errors.append(f"Error saving quiz: {validated_item_data.get('question', 'N/A')}")
-            else:
-                # Log validation error from QuizItemSerializer
-                error_detail = json.dumps(item_serializer.errors)
-                logger.warning(f"Invalid quiz item structure received from AI for doc {document_id}. Errors: {error_detail}. Item: {str(item)[:200]}...")
-                errors.append(f"Invalid quiz data received: {error_detail}")
-
-        logger.info(f"Requested {number_of_quizzes} quizzes for document {document_id}. Attempted to save {len(quizzes_to_save)}. Successfully saved {saved_count}. Encountered {len(errors)} issues during validation or saving.")
-
-        # Use QuizSerializer to format the successfully saved quizzes for the response
-        # response_quiz_serializer = QuizSerializer(successfully_saved_quizzes, many=True) # No longer needed for response
-
-        response_data = {
-            "message": f"Quiz generation process completed for document {document_id}. {saved_count} of {number_of_quizzes} requested quizzes were successfully saved.",
-            "quiz_session_id": overall_quiz_id,
-            "document_id": document_id,
-            "difficulty": difficulty,
-            "requested_count": number_of_quizzes,
-            # "generated_quizzes": response_quiz_serializer.data, # Removed as per feedback
-        }
-        if errors:
-            response_data["errors"] = errors # Still include validation/saving errors
-
-        return Response(response_data, status=status.HTTP_200_OK if not errors else status.HTTP_207_MULTI_STATUS) # Use 207 if there were errors
 
+        return generation_job_accepted(job)
 
 class DocumentQuizzesListView(generics.ListAPIView):
     """
@@ -256,7 +457,7 @@ class DocumentQuizzesListView(generics.ListAPIView):
 
     def get_queryset(self):
         document_id = self.kwargs.get('document_id')
-        document = get_object_or_404(Document, pk=document_id, user=self.request.user)
+        document = get_object_or_404(Document.objects.without_text(), pk=document_id, user=self.request.user)
         return Quiz.objects.filter(
             document=document, 
             mastery_score__lt=0.8
@@ -273,6 +474,54 @@ class DocumentQuizzesListView(generics.ListAPIView):
             return Response({"error": "You do not have permission to access quizzes for this document."}, status=status.HTTP_403_FORBIDDEN)
 
 
+class GenerationEstimateView(generics.GenericAPIView):
+    """
+    Estimates the prompt and completion tokens of a quiz, flashcard, mnemonic or study plan request
+    without calling the model, and whether it fits the user's remaining token allowance.
+    Takes the same parameters as the matching generation endpoint.
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = GenerationEstimateRequestSerializer
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        kind = data['kind']
+
+        if kind == 'study_plan':
+            documents = Document.objects.without_text().filter(id__in=data['document_ids'], user=request.user)
+            context_tokens = sum(
+                count_tokens(f"{summary['filename']}\n{summary['summary']}")
+                for summary in study_plan_document_summaries(documents)
+            )
+            number_of_items = data['days_until_exam']
+            calls = 1
+        else:
+            document = get_object_or_404(Document.objects.without_text(), pk=data['document_id'], user=request.user)
+            topics = data.get('topics', [])
+            if kind == 'mnemonic':
+                number_of_items = len(topics) or DEFAULT_CONTEXT_ITEMS
+                query_text = ' '.join(topics + [data.get('instructions') or '']) or document.summary
+            else:
+                number_of_items = data['number_of_items']
+                query_text = document.summary
+            _, context_tokens = select_generation_context(document, number_of_items, query_text=query_text)
+            part_counts = generation_part_counts(kind, number_of_items, topics)
+            # Fanned-out requests pay the fixed prompt once per call, plus a few spare items
+            number_of_items, calls = sum(part_counts), len(part_counts)
+
+        estimate = estimate_generation_tokens(kind, context_tokens, number_of_items, calls)
+        usage, _ = UserTokenUsage.objects.get_or_create(user=request.user)
+        remaining_tokens = usage.remaining_tokens()
+        return Response({
+            'kind': kind,
+            **estimate,
+            'remaining_tokens': remaining_tokens,
+            'within_budget': estimate['total_tokens'] <= remaining_tokens,
+        })
+
+
 class UserTokenUsageView(generics.RetrieveAPIView):
     """
     Get current user's token usage details
@@ -286,6 +535,47 @@ class UserTokenUsageView(generics.RetrieveAPIView):
         return obj
 
 
+class TokenUsageBreakdownView(generics.GenericAPIView):
+    """
+    Tokens used over the last `days` days, per feature (quiz, flashcard, summary, study plan, ...)
+    and per day. Read from the hourly rollups of the usage ledger only, never the raw events.
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = TokenUsageBreakdownRequestSerializer
+
+    def get(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        days = serializer.validated_data['days']
+        # Days start at midnight in the current time zone, the same days TruncDate groups by
+        since = (timezone.localtime() - timedelta(days=days - 1)).replace(hour=0, minute=0, second=0, microsecond=0)
+
+        rows = (
+            TokenUsageHourly.objects.filter(user=request.user, hour__gte=since)
+            .annotate(day=TruncDate('hour'))
+            .values('day', 'feature')
+            .annotate(day_tokens=Sum('tokens'), day_calls=Sum('calls'))
+            .order_by('day', 'feature')
+        )
+        features = {}
+        daily = {}
+        for row in rows:
+            feature = features.setdefault(row['feature'], {'feature': row['feature'], 'tokens': 0, 'calls': 0})
+            feature['tokens'] += row['day_tokens']
+            feature['calls'] += row['day_calls']
+            day = daily.setdefault(row['day'], {'date': row['day'].isoformat(), 'total_tokens': 0, 'features': {}})
+            day['features'][row['feature']] = row['day_tokens']
+            day['total_tokens'] += row['day_tokens']
+
+        return Response({
+            'days': days,
+            'since': since,
+            'total_tokens': sum(feature['tokens'] for feature in features.values()),
+            'features': sorted(features.values(), key=lambda feature: feature['tokens'], reverse=True),
+            'daily': list(daily.values()),
+        })
+
+
 class QuizSubmissionView(generics.GenericAPIView):
     permission_classes = [IsAuthenticated]
     serializer_class = QuizSubmissionSerializer
@@ -307,7 +597,7 @@ class QuizSubmissionView(generics.GenericAPIView):
         answers_data = data['answers']
 
         # Get document and quizzes (already validated by serializer)
-        document = get_object_or_404(Document, pk=document_id, user=user)
+        document = get_object_or_404(Document.objects.without_text(), pk=document_id, user=user)
 
 
         '''comment  out  the code below when we want only 1 submission per document'''
@@ -321,39 +611,39 @@ class QuizSubmissionView(generics.GenericAPIView):
         # Calculate total questions available vs questions answered
         total_questions_available = quizzes.count()
         questions_answered = len(answers_data)
-        
-        # Create a new quiz session with questions_answered (not all questions)
-        quiz_session = QuizSession.objects.create(
-            user=user, 
-            document=document,
-            total_questions=questions_answered  # Only count answered questions for this session
-        )
+        answered_quizzes = quizzes.in_bulk([answer_data['quiz_id'] for answer_data in answers_data])
 
         # Process each answer
-        correct_count = 0
-
+        answers = []
         for answer_data in answers_data:
-            quiz_id = answer_data['quiz_id']
-            selected_option_index = answer_data['selected_option_index']
-            time_taken = answer_data['time_taken']
-            quiz = quizzes.get(id=quiz_id)
-            is_correct = (selected_option_index == quiz.correct_option_index)
-            QuizAnswer.objects.create(
-                quiz_session=quiz_session,
+            quiz = answered_quizzes[answer_data['quiz_id']]
+            answers.append(QuizAnswer(
                 quiz=quiz,
-                selected_option_index=selected_option_index,
-                is_correct=is_correct,
-                time_taken=time_taken
-            )
-            if is_correct:
-                correct_count += 1
+                selected_option_index=answer_data['selected_option_index'],
+                is_correct=(answer_data['selected_option_index'] == quiz.correct_option_index),
+                time_taken=answer_data['time_taken'],
+            ))
+        correct_count = sum(answer.is_correct for answer in answers)
 
         # Calculate score based on answered questions only
         score = (correct_count / questions_answered) * 100 if questions_answered > 0 else 0
-        quiz_session.completed_at = timezone.now()
-        quiz_session.score = score
-        quiz_session.correct_answers = correct_count
-        quiz_session.save()
+
+        with transaction.atomic():
+            # Only count answered questions for this session
+            quiz_session = QuizSession.objects.create(
+                user=user,
+                document=document,
+                total_questions=questions_answered,
+                completed_at=timezone.now(),
+                score=score,
+                correct_answers=correct_count,
+            )
+            for answer in answers:
+                answer.quiz_session = quiz_session
+            QuizAnswer.objects.bulk_create(answers)
+            # Row lock held until commit, so concurrent submissions each read their own count
+            Document.objects.filter(pk=document.pk).update(completed_quiz_sessions=F('completed_quiz_sessions') + 1)
+            completed_sessions = Document.objects.filter(pk=document.pk).values_list('completed_quiz_sessions', flat=True).get()
 
         # Module 1: Calculate mastery scores after quiz submission
         try:
@@ -377,20 +667,12 @@ class QuizSubmissionView(generics.GenericAPIView):
             logger.error(f"Error updating mastery scores and review schedule after quiz submission: {e}")
             # Don't fail the entire request if mastery calculation fails
 
-        # Module 3: Adaptive Quiz Generation - Trigger every 3rd quiz submission
-        total_sessions = QuizSession.objects.filter(
-            user=user,
-            document=document,
-            completed_at__isnull=False
-        ).count()
-
-        # Trigger adaptive quiz generation if divisible by 3
-        if total_sessions % 3 == 0:
-            quiz_data = generate_adaptive_quizzes(user=user, document_id=document_id)
-            save_adaptive_quizzes(user=user, document_id=document_id, quiz_data=quiz_data)
+        # Module 3: Adaptive Quiz Generation - Trigger every 3rd quiz submission.
+        # Queued for the generation worker, coalesced with any adaptive job already waiting
+        if completed_sessions % 3 == 0:
+            enqueue_adaptive_quiz_job(user, document)
 
         # Prepare response
-        answers = quiz_session.answers.all()
         answer_serializer = QuizAnswerSerializer(answers, many=True)
         response_data = {
             "quiz_session_id": quiz_session.id,
@@ -411,6 +693,7 @@ class FlashcardGenerationView(generics.GenericAPIView):
     Generates flashcards for a specific document using Azure OpenAI Models via a POST request.
     Requires document_id, difficulty, and number_of_flashcards in the request body.
     Tracks token usage and enforces user limits.
+    Generation runs in the background: returns 202 with a job id to poll (see GenerationJobView).
     """
     permission_classes = [IsAuthenticated]
     serializer_class = FlashcardGenerationRequestSerializer
@@ -426,88 +709,20 @@ class FlashcardGenerationView(generics.GenericAPIView):
 
         # Get the document and verify ownership
         try:
-            document = get_object_or_404(Document, pk=document_id, user=request.user)
+            document = get_object_or_404(Document.objects.without_text(), pk=document_id, user=request.user)
         except Document.DoesNotExist:
              raise NotFound(detail="Document not found or you do not have permission.")
 
-        if not document.extracted_text:
-            logger.warning(f"Document ID {document_id} has no extracted text for flashcard generation.")
-            return Response(
-                {"error": "Document content is empty or not processed."},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-          
         try:
-            # Pass the user and number_of_flashcards to track token usage and control generation
-            flashcard_data = generate_flashcards_from_text(
-                text_content=document.extracted_text,
-                difficulty=difficulty,
-                number_of_flashcards=number_of_flashcards,
-                user=request.user,
-                retries=DEFAULT_FLASHCARD_GENERATION_RETRIES
-            )
+            job = enqueue_generation_job(request.user, document, GenerationJob.Kind.FLASHCARD, {
+                'difficulty': difficulty,
+                'number_of_flashcards': number_of_flashcards,
+                'use_cache': validated_data['use_cache'],
+            })
         except PermissionDenied as e:
-            # Handle token limit exceeded exception from token_tracking utility
             return Response({"error": str(e)}, status=status.HTTP_403_FORBIDDEN)
-        except FlashcardGenerationError as e:
-            logger.error(f"Flashcard generation failed for doc {document_id}: {e}")
-            return Response({"error": str(e)}, status=e.status_code)
-        except Exception as e:
-            logger.exception(f"Unexpected error calling flashcard generation utility for doc {document_id}: {e}")
-            return Response(
-                {"error": "An unexpected error occurred during flashcard generation."},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
-
-        # Process the generated flashcard data
-        generated_flashcards = flashcard_data.get("flashcards", [])
-        saved_count = 0
-        session_id = str(uuid.uuid4())
-        errors = []
-        
-        # Limit saving to the number requested, even if the AI returned more
-        flashcards_to_save = generated_flashcards[:number_of_flashcards]
-
-        successfully_saved_flashcards = []
-        for item in flashcards_to_save:
-            item_serializer = FlashcardItemSerializer(data=item)
-            if item_serializer.is_valid():
-                validated_item_data = item_serializer.validated_data
-                try:
-                    flashcard_instance = Flashcard.objects.create(
-                        user=request.user,
-                        document=document,
-                        front=validated_item_data["front"],
-                        back=validated_item_data["back"],
-                        hint=validated_item_data.get("hint"),
-                        keywords=validated_item_data.get("keywords", []),
-                        difficulty=difficulty
-                    )
-                    successfully_saved_flashcards.append(flashcard_instance)
-                    saved_count += 1
-                except Exception as e:
-                    logger.error(f"Failed to save validated flashcard item for doc {document_id}: {validated_item_data.get('front', 'N/A')[:50]}... Error: {e}")
-                    errors.append(f"Error saving flashcard: {validated_item_data.get('front', 'N/A')[:50]}...")
-            else:
-                error_detail = json.dumps(item_serializer.errors)
-                logger.warning(f"Invalid flashcard item structure received from AI for doc {document_id}. Errors: {error_detail}. Item: {str(item)[:200]}...")
-                errors.append(f"Invalid flashcard data received: {error_detail}")
-
-        logger.info(f"Requested {number_of_flashcards} flashcards for document {document_id}. Attempted to save {len(flashcards_to_save)}. Successfully saved {saved_count}. Encountered {len(errors)} issues during validation or saving.")
-
-        response_data = {
-            "message": f"Flashcard generation process completed for document {document_id}. {saved_count} of {number_of_flashcards} requested flashcards were successfully saved.",
-            "session_id": session_id,
-            "document_id": document_id,
-            "difficulty": difficulty,
-            "requested_count": number_of_flashcards,
-        }
-        
-        if errors:
-            response_data["errors"] = errors
-
-        return Response(response_data, status=status.HTTP_200_OK if not errors else status.HTTP_207_MULTI_STATUS)
 
+        return generation_job_accepted(job)
 
 class DocumentFlashcardsListView(generics.ListAPIView):
     """
@@ -518,7 +733,7 @@ class DocumentFlashcardsListView(generics.ListAPIView):
 
     def get_queryset(self):
         document_id = self.kwargs.get('document_id')
-        document = get_object_or_404(Document, pk=document_id, user=self.request.user)
+        document = get_object_or_404(Document.objects.without_text(), pk=document_id, user=self.request.user)
         return Flashcard.objects.filter(document=document).order_by('created_at')
 
     def list(self, request, *args, **kwargs):
@@ -549,7 +764,7 @@ class FlashcardReviewView(generics.GenericAPIView):
         reviews_data = data['reviews']
 
         # Get document and verify ownership
-        document = get_object_or_404(Document, pk=document_id, user=user)
+        document = get_object_or_404(Document.objects.without_text(), pk=document_id, user=user)
         
         # Create a new flashcard session
         flashcard_session = FlashcardSession.objects.create(user=user, document=document)
@@ -608,7 +823,9 @@ class QuizHistoryListView(generics.ListAPIView):
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        return QuizSession.objects.filter(user=self.request.user).order_by('-started_at')
+        return QuizSession.objects.filter(user=self.request.user).select_related('document').defer(
+            'document__extracted_text'
+        ).order_by('-started_at')
 
 
 class QuizHistoryDetailView(generics.RetrieveAPIView):
@@ -618,7 +835,9 @@ class QuizHistoryDetailView(generics.RetrieveAPIView):
     lookup_url_kwarg = 'session_id'
 
     def get_queryset(self):
-        return QuizSession.objects.filter(user=self.request.user)
+        return QuizSession.objects.filter(user=self.request.user).select_related('document').defer(
+            'document__extracted_text'
+        )
 
 
 class MnemonicGenerationView(generics.GenericAPIView):
@@ -626,6 +845,7 @@ class MnemonicGenerationView(generics.GenericAPIView):
     Generates mnemonics for a specific document using Azure OpenAI Models via a POST request.
     Accepts optional mnemonic types, topics, and additional instructions.
     Tracks token usage and enforces user limits.
+    Generation runs in the background: returns 202 with a job id to poll (see GenerationJobView).
     """
     permission_classes = [IsAuthenticated]
     serializer_class = MnemonicGenerationRequestSerializer
@@ -642,85 +862,52 @@ class MnemonicGenerationView(generics.GenericAPIView):
 
         # Get the document and verify ownership
         try:
-            document = get_object_or_404(Document, pk=document_id, user=request.user)
+            document = get_object_or_404(Document.objects.without_text(), pk=document_id, user=request.user)
         except Document.DoesNotExist:
              raise NotFound(detail="Document not found or you do not have permission.")
 
-        if not document.extracted_text:
-            logger.warning(f"Document ID {document_id} has no extracted text for mnemonic generation.")
-            return Response(
-                {"error": "Document content is empty or not processed."},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-          
         try:
-            # Generate mnemonics using the utility function
-            mnemonic_data = generate_mnemonics_from_text(
-                text_content=document.extracted_text,
-                mnemonic_types=mnemonic_types if mnemonic_types else None,
-                topics=topics if topics else None,
-                instructions=instructions if instructions else None,
-                user=request.user,
-                retries=DEFAULT_MNEMONIC_GENERATION_RETRIES
-            )
+            job = enqueue_generation_job(request.user, document, GenerationJob.Kind.MNEMONIC, {
+                'mnemonic_types': mnemonic_types,
+                'topics': topics,
+                'instructions': instructions,
+                'use_cache': validated_data['use_cache'],
+            })
         except PermissionDenied as e:
-            # Handle token limit exceeded exception from token_tracking utility
             return Response({"error": str(e)}, status=status.HTTP_403_FORBIDDEN)
-        except MnemonicGenerationError as e:
-            logger.error(f"Mnemonic generation failed for doc {document_id}: {e}")
-            return Response({"error": str(e)}, status=e.status_code)
-        except Exception as e:
-            logger.exception(f"Unexpected error calling mnemonic generation utility for doc {document_id}: {e}")
-            return Response(
-                {"error": "An unexpected error occurred during mnemonic generation."},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
 
-        # Process the generated mnemonic data
-        generated_mnemonics = mnemonic_data.get("mnemonics", [])
-        uncovered_topics = mnemonic_data.get("uncovered_topics", [])
-        saved_count = 0
-        errors = []
-
-        successfully_saved_mnemonics = []
-        for item in generated_mnemonics:
-            item_serializer = MnemonicItemSerializer(data=item)
-            if item_serializer.is_valid():
-                validated_item_data = item_serializer.validated_data
-                try:
-                    mnemonic_instance = Mnemonic.objects.create(
-                        user=request.user,
-                        document=document,
-                        mnemonic=validated_item_data["mnemonic"],
-                        mnemonic_type=validated_item_data["mnemonic_type"],
-                        mnemonic_explanation=validated_item_data["mnemonic_explanation"],
-                        topic=validated_item_data["topic"]
-                    )
-                    successfully_saved_mnemonics.append(mnemonic_instance)
-                    saved_count += 1
-                except Exception as e:
-                    logger.error(f"Failed to save validated mnemonic item for doc {document_id}: {validated_item_data.get('topic', 'N/A')}. Error: {e}")
-                    errors.append(f"Error saving mnemonic: {validated_item_data.get('topic', 'N/A')}")
-            else:
-                error_detail = json.dumps(item_serializer.errors)
-                logger.warning(f"Invalid mnemonic item structure received from AI for doc {document_id}. Errors: {error_detail}. Item: {str(item)[:200]}...")
-                errors.append(f"Invalid mnemonic data received: {error_detail}")
+        return generation_job_accepted(job)
 
-        logger.info(f"Generated {len(generated_mnemonics)} mnemonics for document {document_id}. Successfully saved {saved_count}. Encountered {len(errors)} issues during validation or saving.")
+class StudyPackGenerationView(generics.GenericAPIView):
+    """
+    Generates quizzes, flashcards and mnemonics for a document together, from one generator call
+    over a shared context, instead of one call (and one copy of the document) per kind.
+    Generation runs in the background: returns 202 with a job id to poll (see GenerationJobView);
+    once done, the job result holds quiz_ids, flashcard_ids and mnemonic_ids.
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = StudyPackGenerationRequestSerializer
 
-        response_data = {
-            "message": f"Mnemonic generation process completed for document {document_id}. {saved_count} mnemonics were successfully saved.",
-            "document_id": document_id,
-            "saved_count": saved_count,
-            "generated_count": len(generated_mnemonics),
-            "uncovered_topics": uncovered_topics
-        }
-        
-        if errors:
-            response_data["errors"] = errors
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        validated_data = serializer.validated_data
 
-        return Response(response_data, status=status.HTTP_200_OK if not errors else status.HTTP_207_MULTI_STATUS)
+        document = get_object_or_404(Document.objects.without_text(), pk=validated_data['document_id'], user=request.user)
 
+        try:
+            job = enqueue_generation_job(request.user, document, GenerationJob.Kind.STUDY_PACK, {
+                'difficulty': validated_data['difficulty'],
+                'number_of_quizzes': validated_data['number_of_quizzes'],
+                'number_of_flashcards': validated_data['number_of_flashcards'],
+                'number_of_mnemonics': validated_data['number_of_mnemonics'],
+                'topics': validated_data.get('topics', []),
+                'use_cache': validated_data['use_cache'],
+            })
+        except PermissionDenied as e:
+            return Response({"error": str(e)}, status=status.HTTP_403_FORBIDDEN)
+
+        return generation_job_accepted(job)
 
 class DocumentMnemonicsListView(generics.ListAPIView):
     """
@@ -731,7 +918,7 @@ class DocumentMnemonicsListView(generics.ListAPIView):
 
     def get_queryset(self):
         document_id = self.kwargs.get('document_id')
-        document = get_object_or_404(Document, pk=document_id, user=self.request.user)
+        document = get_object_or_404(Document.objects.without_text(), pk=document_id, user=self.request.user)
         return Mnemonic.objects.filter(document=document).order_by('created_at')
 
     def list(self, request, *args, **kwargs):
@@ -753,7 +940,7 @@ class MnemonicDocumentsListView(generics.ListAPIView):
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        return Document.objects.filter(user=self.request.user).order_by('-upload_date')
+        return Document.objects.without_text().filter(user=self.request.user).order_by('-upload_date')
 
     def list(self, request, *args, **kwargs):
         queryset = self.get_queryset()
@@ -770,7 +957,7 @@ class ReviewDocumentsTodayView(generics.ListAPIView):
 
     def get_queryset(self):
         today = timezone.now().date()
-        return Document.objects.filter(
+        return Document.objects.without_text().filter(
             user=self.request.user,
             next_review_date__date=today
         ).order_by('next_review_date')
@@ -795,7 +982,7 @@ class ReviewDocumentsByDateView(generics.ListAPIView):
             return Document.objects.none()
             
         # Filter by date only, ignoring time component
-        return Document.objects.filter(
+        return Document.objects.without_text().filter(
             user=self.request.user,
             next_review_date__date=target_date
         ).order_by('next_review_date')
@@ -822,7 +1009,7 @@ class ReviewDocumentsDateRangeView(generics.ListAPIView):
         except ValueError:
             return Document.objects.none()
             
-        return Document.objects.filter(
+        return Document.objects.without_text().filter(
             user=self.request.user,
             next_review_date__date__range=[start_date, end_date]
         ).order_by('next_review_date')
@@ -860,7 +1047,7 @@ class ReviewCalendarView(generics.GenericAPIView):
             last_day = date(year, month + 1, 1) - timedelta(days=1)
         
         # Get documents scheduled for review in this month
-        documents = Document.objects.filter(
+        documents = Document.objects.without_text().filter(
             user=request.user,
             next_review_date__date__range=[first_day, last_day]
         ).order_by('next_review_date')
@@ -899,7 +1086,7 @@ class StudyPlanListCreateView(generics.ListCreateAPIView):
     
     def get_queryset(self):
         return StudyPlan.objects.filter(user=self.request.user).prefetch_related(
-            'documents', 'steps__resources'
+            Prefetch('documents', queryset=Document.objects.without_text()), 'steps__resources'
         ).order_by('-created_at')
 
 
@@ -912,7 +1099,7 @@ class StudyPlanDetailView(generics.RetrieveUpdateDestroyAPIView):
     
     def get_queryset(self):
         return StudyPlan.objects.filter(user=self.request.user).prefetch_related(
-            'documents', 'steps__resources'
+            Prefetch('documents', queryset=Document.objects.without_text()), 'steps__resources'
         )
     
     def get_serializer_class(self):
@@ -921,6 +1108,25 @@ class StudyPlanDetailView(generics.RetrieveUpdateDestroyAPIView):
         return StudyPlanSerializer
 
 
+def study_plan_document_summaries(documents):
+    """Filename and summary of each document, as sent to the study planner"""
+    document_summaries = []
+    for doc in documents:
+        if doc.summary:
+            document_summaries.append({
+                'filename': doc.filename,
+                'summary': doc.summary
+            })
+        else:
+            # If no summary, use a portion of extracted text
+            text_preview = read_document_range(doc, 0, 1000) or "No content available"
+            document_summaries.append({
+                'filename': doc.filename,
+                'summary': f"Document content preview: {text_preview}"
+            })
+    return document_summaries
+
+
 class StudyPlanGenerateView(generics.CreateAPIView):
     """
     Generate a new AI-powered study plan using Perplexity API
@@ -938,25 +1144,12 @@ class StudyPlanGenerateView(generics.CreateAPIView):
             document_ids = data['document_ids']
             
             # Fetch documents and their summaries
-            documents = Document.objects.filter(
+            documents = Document.objects.without_text().filter(
                 id__in=document_ids,
                 user=request.user
             )
             
-            document_summaries = []
-            for doc in documents:
-                if doc.summary:
-                    document_summaries.append({
-                        'filename': doc.filename,
-                        'summary': doc.summary
-                    })
-                else:
-                    # If no summary, use a portion of extracted text
-                    text_preview = doc.extracted_text[:1000] if doc.extracted_text else "No content available"
-                    document_summaries.append({
-                        'filename': doc.filename,
-                        'summary': f"Document content preview: {text_preview}"
-                    })
+            document_summaries = study_plan_document_summaries(documents)
             
             if not document_summaries:
                 raise ValidationError({
@@ -966,34 +1159,51 @@ class StudyPlanGenerateView(generics.CreateAPIView):
             # Generate study plan using Perplexity API
             logger.info(f"Generating study plan for user {request.user.username} with {len(document_summaries)} documents")
             
-            study_plan_data = generate_study_plan(
-                document_summaries=document_summaries,
-                daily_study_hours=data['daily_study_hours'],
-                days_until_exam=data['days_until_exam'],
-                exam_type=data['exam_type'],
-                additional_context=data.get('additional_context')
-            )
+            # Repeated requests over the same documents and settings reuse the cached plan
+            with usage_feature(TokenUsageEvent.Feature.STUDY_PLAN):
+                study_plan_data = cached_llm_call(
+                    'study_plan',
+                    json.dumps(document_summaries, sort_keys=True),
+                    {
+                        'daily_study_hours': data['daily_study_hours'],
+                        'days_until_exam': data['days_until_exam'],
+                        'exam_type': data['exam_type'],
+                        'additional_context': data.get('additional_context'),
+                    },
+                    lambda: llm_call(
+                        lambda: generate_study_plan(
+                            document_summaries=document_summaries,
+                            daily_study_hours=data['daily_study_hours'],
+                            days_until_exam=data['days_until_exam'],
+                            exam_type=data['exam_type'],
+                            additional_context=data.get('additional_context')
+                        ),
+                        label='study plan', backend=PERPLEXITY,
+                    ),
+                    use_cache=data['use_cache'],
+                )
             
             # Skip validation - allow any generated study plan structure
             # if not validate_study_plan_data(study_plan_data):
             #     raise StudyPlannerError("Generated study plan has invalid structure")
             
-            # Create the study plan in database
-            study_plan = StudyPlan.objects.create(
-                user=request.user,
-                title=data['title'],
-                description=data.get('description', ''),
-                daily_study_hours=data['daily_study_hours'],
-                days_until_exam=data['days_until_exam'],
-                exam_type=data['exam_type'],
-                additional_context=data.get('additional_context', '')
-            )
-            
-            # Add documents to the study plan
-            study_plan.documents.set(documents)
-            
-            # Create study plan steps from the generated plan
-            self._create_study_plan_steps(study_plan, study_plan_data)
+            # Create the study plan in database, all or nothing
+            with transaction.atomic():
+                study_plan = StudyPlan.objects.create(
+                    user=request.user,
+                    title=data['title'],
+                    description=data.get('description', ''),
+                    daily_study_hours=data['daily_study_hours'],
+                    days_until_exam=data['days_until_exam'],
+                    exam_type=data['exam_type'],
+                    additional_context=data.get('additional_context', '')
+                )
+                
+                # Add documents to the study plan
+                study_plan.documents.set(documents)
+                
+                # Create study plan steps from the generated plan
+                total_steps_created = self._create_study_plan_steps(study_plan, study_plan_data, documents)
             
             # Update resources with URLs (already enhanced by generate_study_plan)
             try:
@@ -1003,8 +1213,10 @@ class StudyPlanGenerateView(generics.CreateAPIView):
                 logger.warning(f"Failed to update study plan resources: {e}")
                 # Continue without resource updates if it fails
             
-            # Return the created study plan
-            study_plan.refresh_from_db()
+            # Return the created study plan, loaded the way the detail view loads it
+            study_plan = StudyPlan.objects.prefetch_related(
+                Prefetch('documents', queryset=Document.objects.without_text()), 'steps__resources'
+            ).get(pk=study_plan.pk)
             response_serializer = StudyPlanSerializer(study_plan, context={'request': request})
             
             return Response({
@@ -1012,10 +1224,16 @@ class StudyPlanGenerateView(generics.CreateAPIView):
                 'generation_metadata': {
                     'generated_at': study_plan_data.get('generated_at'),
                     'api_usage': study_plan_data.get('api_usage', {}),
-                    'total_steps_created': study_plan.steps.count()
+                    'total_steps_created': total_steps_created
                 }
             }, status=status.HTTP_201_CREATED)
             
+        except LLMUnavailable as e:
+            return Response({
+                'error': 'Study Plan Generation Failed',
+                'detail': str(e.detail)
+            }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
         except StudyPlannerError as e:
             logger.error(f"Study planner error for user {request.user.username}: {e}")
             return Response({
@@ -1030,13 +1248,21 @@ class StudyPlanGenerateView(generics.CreateAPIView):
                 'detail': 'An unexpected error occurred while generating the study plan.'
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
-    def _create_study_plan_steps(self, study_plan: StudyPlan, plan_data: Dict):
-        """Create study plan steps from the generated plan data"""
+    def _create_study_plan_steps(self, study_plan: StudyPlan, plan_data: Dict, documents) -> int:
+        """
+        Create study plan steps from the generated plan data, with two bulk inserts (steps, then
+        their resources). Returns the number of steps created.
+        """
         daily_schedule = plan_data.get('daily_schedule', [])
         
         # Handle case where daily_schedule might be None
         if daily_schedule is None:
             daily_schedule = []
+
+        # Related documents are looked up in a term index of the plan's documents, built once
+        topic_matcher = TopicMatcher(documents)
+        steps = []
+        step_resources = []  # Resources of each step, in the order of steps
         
         for day_data in daily_schedule:
             # Handle case where day_data might be None or not a dict
@@ -1068,8 +1294,8 @@ class StudyPlanGenerateView(generics.CreateAPIView):
                     activity_type = self._map_activity_type(activity.get('type', 'reading'))
                     activity_priority = self._map_priority(activity.get('priority', 'medium'))
                     
-                    # Create the study plan step
-                    step = StudyPlanStep.objects.create(
+                    # Build the study plan step
+                    steps.append(StudyPlanStep(
                         study_plan=study_plan,
                         day_number=day_number,
                         step_order=step_order,
@@ -1079,29 +1305,32 @@ class StudyPlanGenerateView(generics.CreateAPIView):
                         description=activity.get('description', ''),
                         topic=activity.get('topic', '')[:255],  # Truncate if too long
                         estimated_duration=activity.get('duration_minutes', activity.get('duration', 60)) / 60.0,  # Convert to hours
-                        related_document=self._find_related_document(
-                            study_plan, activity.get('topic', '')
-                        )
-                    )
+                        related_document=topic_matcher.match(activity.get('topic', ''))
+                    ))
                     
-                    # Create resources for this step
-                    resources = activity.get('resources', [])
-                    for resource in resources:
+                    # Build resources for this step
+                    resources = []
+                    for resource in activity.get('resources', []):
                         # Safely get resource values and truncate if necessary
-                        resource_type = self._map_resource_type(resource.get('type', 'article'))
-                        resource_title = str(resource.get('title', ''))[:255]  # Truncate title
-                        resource_url = resource.get('url', resource.get('url_suggestion', '#'))
-                        resource_desc = str(resource.get('description', ''))
-                        
-                        StudyPlanResource.objects.create(
-                            study_plan_step=step,
-                            resource_type=resource_type,
-                            title=resource_title,
-                            url=resource_url,
-                            description=resource_desc
-                        )
+                        resources.append(StudyPlanResource(
+                            resource_type=self._map_resource_type(resource.get('type', 'article')),
+                            title=str(resource.get('title', ''))[:255],  # Truncate title
+                            url=resource.get('url', resource.get('url_suggestion', '#')),
+                            description=str(resource.get('description', ''))
+                        ))
+                    step_resources.append(resources)
                     
                     step_order += 1
+
+        # Steps get their ids from the insert, so their resources can point at them
+        StudyPlanStep.objects.bulk_create(steps)
+        resources = []
+        for step, resources_of_step in zip(steps, step_resources):
+            for resource in resources_of_step:
+                resource.study_plan_step = step
+                resources.append(resource)
+        StudyPlanResource.objects.bulk_create(resources)
+        return len(steps)
     
     def _map_activity_type(self, activity_type: str) -> str:
         """Map activity type from study planner to valid model choice"""
@@ -1171,20 +1400,6 @@ class StudyPlanGenerateView(generics.CreateAPIView):
         mapped_type = type_mapping.get(clean_type, 'other')
         return mapped_type[:10]  # Ensure max 10 chars
     
-    def _find_related_document(self, study_plan: StudyPlan, topic: str):
-        """Find the most relevant document for a given topic"""
-        if not topic:
-            return None
-        
-        # Simple keyword matching - can be enhanced with more sophisticated matching
-        documents = study_plan.documents.all()
-        for doc in documents:
-            if topic.lower() in doc.summary.lower() or topic.lower() in doc.filename.lower():
-                return doc
-        
-        # Return the first document if no specific match
-        return documents.first() if documents.exists() else None
-    
     def _update_study_plan_resources(self, study_plan: StudyPlan, enhanced_plan_data: Dict):
         """Update study plan resources with enhanced search results"""
         # This would update resources with actual URLs from enhanced search
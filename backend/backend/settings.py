@@ -1,4 +1,5 @@
 import os
+import json
 from dotenv import load_dotenv
 from pathlib import Path
 import dj_database_url
@@ -59,6 +60,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "api",
     "rest_framework",
     "corsheaders",
@@ -190,3 +192,135 @@ else:
         CORS_ALLOWED_ORIGINS = [origin.strip() for origin in cors_origins_str.split(',')]
     CSRF_TRUSTED_ORIGINS = CORS_ALLOWED_ORIGINS.copy()
     CORS_ALLOW_CREDENTIALS = True
+
+# Background workers: a job still running after the worker's --stale-after is presumed abandoned by a
+# dead worker and requeued, until it has been claimed this many times; then it fails, so a job that keeps
+# killing its worker (e.g. out of memory on a huge PDF) isn't retried forever
+STALE_JOB_MAX_ATTEMPTS = int(os.getenv('STALE_JOB_MAX_ATTEMPTS', 3))
+
+# Document ingestion
+# Uploads are spooled here until the process_ingestion_jobs worker extracts them
+INGESTION_SPOOL_DIR = os.getenv('INGESTION_SPOOL_DIR', str(BASE_DIR / 'spool'))
+MAX_UPLOAD_SIZE_BYTES = int(os.getenv('MAX_UPLOAD_SIZE_BYTES', 50 * 1024 * 1024))
+
+# Stream every upload to disk (hashing it on the way) instead of buffering small files in memory.
+# Temp files live next to the spool so queuing an upload is a rename, not a copy.
+FILE_UPLOAD_HANDLERS = ["api.upload_handlers.HashingTemporaryFileUploadHandler"]
+FILE_UPLOAD_TEMP_DIR = INGESTION_SPOOL_DIR
+
+# PDFs longer than INGESTION_RANGE_PAGES are extracted as page ranges in parallel
+INGESTION_RANGE_PAGES = int(os.getenv('INGESTION_RANGE_PAGES', 40))
+INGESTION_MAX_PARALLEL_RANGES = int(os.getenv('INGESTION_MAX_PARALLEL_RANGES', 4))
+INGESTION_RANGE_RETRIES = int(os.getenv('INGESTION_RANGE_RETRIES', 2))
+# A job whose ranges still fail after their retries is requeued (keeping the spooled file and the
+# finished ranges) until it has been attempted this many times
+INGESTION_JOB_MAX_ATTEMPTS = int(os.getenv('INGESTION_JOB_MAX_ATTEMPTS', 3))
+
+# Batch uploads: files per request, and ingestion jobs extracted at once for a single user
+INGESTION_BATCH_MAX_FILES = int(os.getenv('INGESTION_BATCH_MAX_FILES', 50))
+INGESTION_MAX_RUNNING_JOBS_PER_USER = int(os.getenv('INGESTION_MAX_RUNNING_JOBS_PER_USER', 3))
+
+# Extraction cache: identical uploads reuse earlier extraction results instead of calling Azure again
+EXTRACTION_CACHE_ENABLED = os.getenv('EXTRACTION_CACHE_ENABLED', 'True').lower() == 'true'
+EXTRACTION_CACHE_MAX_AGE_DAYS = int(os.getenv('EXTRACTION_CACHE_MAX_AGE_DAYS', 90))
+EXTRACTION_CACHE_MAX_BYTES = int(os.getenv('EXTRACTION_CACHE_MAX_BYTES', 500 * 1024 * 1024))
+
+# Extracted text is stored as page-aligned chunks of roughly this many characters
+DOCUMENT_CHUNK_TARGET_CHARS = int(os.getenv('DOCUMENT_CHUNK_TARGET_CHARS', 2000))
+DOCUMENT_RANGE_MAX_CHARS = int(os.getenv('DOCUMENT_RANGE_MAX_CHARS', 20000))
+
+# Large text columns (CompressedTextField) are zlib-compressed; shorter values are stored as-is
+TEXT_COMPRESSION_LEVEL = int(os.getenv('TEXT_COMPRESSION_LEVEL', 6))
+TEXT_COMPRESSION_MIN_BYTES = int(os.getenv('TEXT_COMPRESSION_MIN_BYTES', 64))
+
+# Generation prompts get at most this many tokens of document context, picked by BM25 + MMR over
+# the document's chunks; smaller requests get proportionally less (TOKENS_PER_ITEM, MIN_TOKENS)
+GENERATION_CONTEXT_TOKEN_BUDGET = int(os.getenv('GENERATION_CONTEXT_TOKEN_BUDGET', 6000))
+GENERATION_CONTEXT_TOKENS_PER_ITEM = int(os.getenv('GENERATION_CONTEXT_TOKENS_PER_ITEM', 400))
+GENERATION_CONTEXT_MIN_TOKENS = int(os.getenv('GENERATION_CONTEXT_MIN_TOKENS', 2000))
+
+# tiktoken encoding used to count tokens of document chunks and estimate generation cost
+TOKENIZER_ENCODING = os.getenv('TOKENIZER_ENCODING', 'o200k_base')
+
+# Full-text search (PostgreSQL text search configuration and page sizes of the search endpoint)
+SEARCH_CONFIG = os.getenv('SEARCH_CONFIG', 'english')
+SEARCH_PAGE_SIZE = int(os.getenv('SEARCH_PAGE_SIZE', 20))
+SEARCH_MAX_PAGE_SIZE = int(os.getenv('SEARCH_MAX_PAGE_SIZE', 50))
+
+# Generation requests of at least twice GENERATION_STREAM_LEAD_ITEMS start with a small lead call so
+# the first items can be streamed early; the stream endpoint checks the job for new items every POLL_INTERVAL seconds
+# and closes each connection after WINDOW seconds (clients reconnect with the last event id), so a stream
+# never holds a web worker for the length of a generation
+GENERATION_STREAM_LEAD_ITEMS = int(os.getenv('GENERATION_STREAM_LEAD_ITEMS', 3))
+GENERATION_STREAM_POLL_INTERVAL = float(os.getenv('GENERATION_STREAM_POLL_INTERVAL', 0.5))
+GENERATION_STREAM_WINDOW = float(os.getenv('GENERATION_STREAM_WINDOW', 5))
+
+# LLM response cache: identical generation requests (same normalised text, parameters, model and prompt
+# version) reuse the stored response instead of calling the model. Bump LLM_PROMPT_VERSION when the prompts change.
+LLM_CACHE_ENABLED = os.getenv('LLM_CACHE_ENABLED', 'True').lower() == 'true'
+LLM_CACHE_TTL_HOURS = int(os.getenv('LLM_CACHE_TTL_HOURS', 7 * 24))
+LLM_CACHE_MAX_BYTES = int(os.getenv('LLM_CACHE_MAX_BYTES', 200 * 1024 * 1024))
+# A generation request identical to one the user made this many seconds ago (a double-click or a client
+# retry) gets the earlier job back instead of queueing another
+GENERATION_REPEAT_WINDOW_SECONDS = int(os.getenv('GENERATION_REPEAT_WINDOW_SECONDS', 30))
+LLM_PROMPT_VERSION = os.getenv('LLM_PROMPT_VERSION', '1')
+LLM_MODEL = os.getenv('AZURE_OPENAI_DEPLOYMENT_NAME', '')
+STUDY_PLAN_MODEL = os.getenv('PERPLEXITY_MODEL', '')
+
+# Larger generation requests fan out into concurrent calls of at most GENERATION_FANOUT_ITEMS items over
+# disjoint sections of the document; each asks for a few spare items so duplicates can be dropped
+GENERATION_FANOUT_ITEMS = int(os.getenv('GENERATION_FANOUT_ITEMS', 8))
+GENERATION_FANOUT_CONCURRENCY = int(os.getenv('GENERATION_FANOUT_CONCURRENCY', 4))
+GENERATION_FANOUT_SPARE_ITEMS = int(os.getenv('GENERATION_FANOUT_SPARE_ITEMS', 1))
+
+# Generated items whose MinHash-estimated word and word-pair overlap with an existing item of the same
+# document, difficulty and short answer reaches this threshold are treated as near duplicates
+# (not saved, or merged by dedupe_study_items)
+SIMILARITY_DUPLICATE_THRESHOLD = float(os.getenv('SIMILARITY_DUPLICATE_THRESHOLD', 0.5))
+
+# Generation pools: items per document, kind and difficulty generated ahead of requests, by plan tier
+# (0 disables pooling). Pools of PREWARM_DIFFICULTIES are filled after ingestion, others once requested.
+# Refills smaller than MIN_REFILL items aren't queued; at most MAX_RUNNING_REFILLS run at once.
+# Refills are billed to the document's owner and never spend the KEPT_BUDGET_SHARE of their daily token
+# limit kept for their own requests; one refill per document is pending at a time.
+GENERATION_POOL_TARGETS = json.loads(os.getenv('GENERATION_POOL_TARGETS', '{"free": 10, "pro": 30}'))
+GENERATION_POOL_PREWARM_DIFFICULTIES = [
+    difficulty.strip() for difficulty in os.getenv('GENERATION_POOL_PREWARM_DIFFICULTIES', 'medium').split(',') if difficulty.strip()
+]
+GENERATION_POOL_MIN_REFILL = int(os.getenv('GENERATION_POOL_MIN_REFILL', 5))
+GENERATION_POOL_MAX_RUNNING_REFILLS = int(os.getenv('GENERATION_POOL_MAX_RUNNING_REFILLS', 2))
+GENERATION_POOL_KEPT_BUDGET_SHARE = float(os.getenv('GENERATION_POOL_KEPT_BUDGET_SHARE', 0.5))
+
+# Azure OpenAI connection for model calls made by the API itself (study packs); the deployment is LLM_MODEL
+AZURE_OPENAI_ENDPOINT = os.getenv('AZURE_OPENAI_ENDPOINT', '')
+AZURE_OPENAI_API_KEY = os.getenv('AZURE_OPENAI_API_KEY', '')
+AZURE_OPENAI_API_VERSION = os.getenv('AZURE_OPENAI_API_VERSION', '2024-08-01-preview')
+
+# Outbound model calls (api/llm_gateway.py), per worker process: at most MAX_CONCURRENCY at once, paced to
+# LLM_TOKENS_PER_MINUTE (the deployment's TPM quota; 0 disables pacing), retried with jittered exponential
+# backoff, and failed fast for CIRCUIT_RESET_SECONDS after CIRCUIT_FAILURE_THRESHOLD consecutive failures.
+# The utils generators make LLM_GENERATOR_RETRIES retries of their own on top of the gateway's.
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', 8))
+LLM_TOKENS_PER_MINUTE = int(os.getenv('LLM_TOKENS_PER_MINUTE', 0))
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', 4))
+LLM_BACKOFF_BASE_SECONDS = float(os.getenv('LLM_BACKOFF_BASE_SECONDS', 1.0))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv('LLM_BACKOFF_MAX_SECONDS', 30.0))
+LLM_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('LLM_CIRCUIT_FAILURE_THRESHOLD', 5))
+LLM_CIRCUIT_RESET_SECONDS = float(os.getenv('LLM_CIRCUIT_RESET_SECONDS', 30.0))
+LLM_QUEUE_TIMEOUT_SECONDS = float(os.getenv('LLM_QUEUE_TIMEOUT_SECONDS', 60.0))
+LLM_GENERATOR_RETRIES = int(os.getenv('LLM_GENERATOR_RETRIES', 0))
+
+# Cache hit/miss counters (api/cache_stats.py) are added to CacheStats in batches of CACHE_STATS_BATCH_SIZE
+# lookups or CACHE_STATS_FLUSH_SECONDS after the first one
+CACHE_STATS_BATCH_SIZE = int(os.getenv('CACHE_STATS_BATCH_SIZE', 200))
+CACHE_STATS_FLUSH_SECONDS = float(os.getenv('CACHE_STATS_FLUSH_SECONDS', 10.0))
+
+# Token usage ledger (api/usage_ledger.py): events are buffered per process and written, with their
+# hourly rollups, in batches of TOKEN_LEDGER_BATCH_SIZE or TOKEN_LEDGER_FLUSH_SECONDS after the first one
+TOKEN_LEDGER_BATCH_SIZE = int(os.getenv('TOKEN_LEDGER_BATCH_SIZE', 50))
+TOKEN_LEDGER_FLUSH_SECONDS = float(os.getenv('TOKEN_LEDGER_FLUSH_SECONDS', 5.0))
+
+# Verified Supabase JWTs (backend/supabase_auth.py) are cached per process with the resolved user,
+# until the token expires or for at most AUTH_CACHE_TTL_SECONDS
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv('AUTH_CACHE_MAX_ENTRIES', 10000))
+AUTH_CACHE_TTL_SECONDS = int(os.getenv('AUTH_CACHE_TTL_SECONDS', 300))
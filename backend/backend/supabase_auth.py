@@ -1,19 +1,69 @@
 import jwt
+import time
+import hashlib
+import threading
+from collections import OrderedDict
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
 from rest_framework import authentication, exceptions
 
 User = get_user_model()
 
+
+class VerifiedTokenCache:
+    """
+    Bounded LRU of verified tokens: sha256 of the token -> (expiry, claims, user field values).
+    Entries expire with the token's `exp`, or after `ttl` seconds if that comes first, so a cached
+    token is never accepted past its expiry and user changes (e.g. deactivation) show within `ttl`.
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key, payload, user_values):
+        expires_at = min(payload.get('exp', 0), time.time() + self.ttl)
+        with self.lock:
+            self.entries[key] = (expires_at, payload, user_values)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+_USER_FIELDS = [field.attname for field in User._meta.concrete_fields]
+_token_cache = VerifiedTokenCache(settings.AUTH_CACHE_MAX_ENTRIES, settings.AUTH_CACHE_TTL_SECONDS)
+
+
 class SupabaseJWTAuthentication(authentication.BaseAuthentication):
     def authenticate(self, request):
         auth_header = request.headers.get('Authorization', '')
-        
+
         if not auth_header.startswith('Bearer '):
             return None
-            
+
         token = auth_header.split(' ')[1]
 
+        # Warm requests: no signature check and no user query, a fresh User is built from the cached row
+        cache_key = hashlib.sha256(token.encode('utf-8')).hexdigest()
+        cached = _token_cache.get(cache_key)
+        if cached is not None:
+            _, _, user_values = cached
+            return (User.from_db('default', _USER_FIELDS, user_values), None)
+
         try:
             payload = jwt.decode(
                 token,
@@ -27,16 +77,17 @@ class SupabaseJWTAuthentication(authentication.BaseAuthentication):
         except jwt.InvalidTokenError:
             raise exceptions.AuthenticationFailed('Invalid token')
 
-        try:
-            user = User.objects.get(username=payload['sub'])
-        except User.DoesNotExist:
-            user = User.objects.create_user(
-                username=payload['sub'],
-                email=payload.get('email', ''),
-                first_name=payload.get('user_metadata', {}).get('first_name', ''),
-                last_name=payload.get('user_metadata', {}).get('last_name', '')
-            )
-            user.set_unusable_password()
-            user.save()
+        # The frontend fires parallel requests with a new user's first token; get_or_create
+        # recovers from the unique username violation when another request created the user first
+        user, _ = User.objects.get_or_create(
+            username=payload['sub'],
+            defaults={
+                'email': payload.get('email', ''),
+                'first_name': payload.get('user_metadata', {}).get('first_name', ''),
+                'last_name': payload.get('user_metadata', {}).get('last_name', ''),
+                'password': make_password(None),  # Unusable: Supabase handles sign-in
+            },
+        )
 
+        _token_cache.set(cache_key, payload, [getattr(user, name) for name in _USER_FIELDS])
         return (user, None)
@@ -264,6 +264,122 @@ apiClient.interceptors.response.use(
   }
 );
 
+// Poll a document ingestion job until the worker has finished extracting it
+const INGESTION_POLL_INTERVAL = 2000;
+const INGESTION_POLL_TIMEOUT = 10 * 60 * 1000;
+
+const waitForIngestionJob = async (jobId) => {
+  const startedAt = Date.now();
+  
+  while (Date.now() - startedAt < INGESTION_POLL_TIMEOUT) {
+    const response = await apiClient.get(`/documents/jobs/${jobId}/`);
+    const job = response.data;
+    
+    if (job.status === 'done') {
+      return job;
+    }
+    if (job.status === 'failed') {
+      // Surface worker errors through the same 400 path as synchronous upload errors
+      const error = new Error(job.error || 'Failed to process document content.');
+      error.response = { status: 400, data: { error: job.error } };
+      throw error;
+    }
+    
+    await new Promise(resolve => setTimeout(resolve, INGESTION_POLL_INTERVAL));
+  }
+  
+  throw new Error('Document processing is taking longer than expected. Please check your documents later.');
+};
+
+// Poll a quiz, flashcard or mnemonic generation job until the worker has saved the items
+const GENERATION_POLL_INTERVAL = 1500;
+const GENERATION_POLL_TIMEOUT = 5 * 60 * 1000;
+
+const waitForGenerationJob = async (jobId) => {
+  const startedAt = Date.now();
+  
+  while (Date.now() - startedAt < GENERATION_POLL_TIMEOUT) {
+    const response = await apiClient.get(`/generate/jobs/${jobId}/`);
+    const job = response.data;
+    
+    if (job.status === 'done') {
+      // Same shape as the former synchronous response, plus the ids of the saved items;
+      // result.status is the status it was sent with (207 when some items had errors)
+      return { ...job.result, item_ids: job.item_ids };
+    }
+    if (job.status === 'failed') {
+      // Surface worker errors with the status the synchronous endpoint used to return (e.g. 403 token limit)
+      const error = new Error(job.error || 'Generation failed.');
+      error.response = { status: job.error_status || 500, data: { error: job.error } };
+      throw error;
+    }
+    
+    await new Promise(resolve => setTimeout(resolve, GENERATION_POLL_INTERVAL));
+  }
+  
+  throw new Error('Generation is taking longer than expected. Please check again later.');
+};
+
+// Read a generation job's Server-Sent Events, calling onItem with each item as soon as it is saved.
+// Uses fetch rather than EventSource, which can't send the Authorization header.
+// The server closes each stream after a few seconds; reconnect after the last item received until done.
+const streamGenerationJob = async (jobId, onItem) => {
+  const token = localStorage.getItem('rectifyToken');
+  const startedAt = Date.now();
+  let lastEventId = 0;
+  
+  while (Date.now() - startedAt < GENERATION_POLL_TIMEOUT) {
+    const response = await fetch(`${API_URL}/generate/jobs/${jobId}/stream/?last_event_id=${lastEventId}`, {
+      headers: {
+        'Accept': 'text/event-stream',
+        ...(token ? { 'Authorization': `Bearer ${token}` } : {})
+      }
+    });
+    if (!response.ok || !response.body) {
+      // Streaming unavailable (e.g. buffered by a proxy); fall back to polling
+      return waitForGenerationJob(jobId);
+    }
+    
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      
+      let boundary;
+      while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+        const message = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+        const event = message.match(/^event: (.*)$/m)?.[1];
+        const data = message.match(/^data: (.*)$/m)?.[1];
+        if (!event || !data) continue; // retry hint
+        
+        const payload = JSON.parse(data);
+        if (event === 'item') {
+          lastEventId = Number(message.match(/^id: (\d+)$/m)?.[1] ?? lastEventId);
+          onItem(payload);
+        } else if (event === 'done') {
+          return payload;
+        } else if (event === 'error') {
+          const error = new Error(payload.error || 'Generation failed.');
+          error.response = { status: payload.status || 500, data: { error: payload.error } };
+          throw error;
+        }
+      }
+    }
+    // Stream window closed before the job finished: reconnect where it left off
+  }
+  
+  throw new Error('Generation is taking longer than expected. Please check again later.');
+};
+
+// Wait for a queued generation: stream items to onItem when given, otherwise poll until done
+const waitForGeneration = (jobId, onItem) => (
+  onItem ? streamGenerationJob(jobId, onItem) : waitForGenerationJob(jobId)
+);
+
 // Define API service methods based on the documentation
 const apiService = {
   // Authentication functions removed as Supabase handles auth
@@ -283,13 +399,15 @@ const apiService = {
         'Accept': 'application/json',
         'X-CSRFTOKEN': getCSRFToken()
       },
-      timeout: 60000 // Increase timeout to 60 seconds for larger files
+      timeout: 60000 // Upload only; extraction runs in the background
     })
-    .then(response => {
+    .then(async response => {
       console.log('Document upload response:', response.data);
       
-      // Extract the document ID from the response for subsequent operations
-      const documentId = response.data.id;
+      // Uploads are processed in the background; poll the job until the document exists.
+      // Files seen before come straight back from the extraction cache with the document id.
+      const job = response.data.job_id ? await waitForIngestionJob(response.data.job_id) : response.data;
+      const documentId = job.document_id;
       
       return {
         document_id: documentId,
@@ -324,6 +442,97 @@ const apiService = {
     });
   },
   
+  uploadDocuments: (files) => {
+    const formData = new FormData();
+    files.forEach(file => formData.append('files', file));
+
+    console.log('Uploading document batch to:', `${API_URL}/documents/process-batch/`, `(${files.length} files)`);
+
+    return apiClient.post('/documents/process-batch/', formData, {
+      headers: {
+        'Content-Type': 'multipart/form-data',
+        'Accept': 'application/json',
+        'X-CSRFTOKEN': getCSRFToken()
+      },
+      timeout: 300000, // One request carries every file; extraction runs in the background
+      // 207 (some files failed) and 400 (all failed) still carry a result per file
+      validateStatus: status => status < 300 || status === 207 || status === 400
+    })
+    .then(response => {
+      console.log('Document batch upload response:', response.data);
+
+      // Wait for queued files in parallel; each result settles to a document id or an error
+      return Promise.all(response.data.results.map(async result => {
+        if (result.status === 'failed') {
+          return { filename: result.filename, status: 'failed', error: result.error };
+        }
+        try {
+          const job = result.job_id ? await waitForIngestionJob(result.job_id) : result;
+          return { filename: result.filename, status: 'complete', document_id: job.document_id, id: job.document_id };
+        } catch (error) {
+          return { filename: result.filename, status: 'failed', error: error.message };
+        }
+      }));
+    })
+    .catch(error => {
+      console.error('Document batch upload error:', error.response?.data || error.message);
+      if (error.response?.status === 413) {
+        throw new Error('The upload is too large. Please upload fewer or smaller documents.');
+      } else if (error.response?.status === 401) {
+        throw new Error('You need to be logged in to upload documents.');
+      }
+      throw error;
+    });
+  },
+
+  replaceDocument: (documentId, file) => {
+    const formData = new FormData();
+    formData.append('file', file);
+
+    console.log(`Replacing file of document ${documentId} with:`, file.name, `(${formatFileSize(file.size)})`);
+
+    return apiClient.post(`/documents/${documentId}/replace/`, formData, {
+      headers: {
+        'Content-Type': 'multipart/form-data',
+        'Accept': 'application/json',
+        'X-CSRFTOKEN': getCSRFToken()
+      },
+      timeout: 60000
+    })
+    .then(async response => {
+      // Unchanged quizzes, flashcards and mnemonics are kept; changed sections regenerate in the background
+      const job = await waitForIngestionJob(response.data.job_id);
+      return { document_id: job.document_id, id: job.document_id, status: 'complete' };
+    })
+    .catch(error => {
+      console.error('Document replace error:', error.response?.data || error.message);
+      if (error.response?.status === 409) {
+        throw new Error('A new version of this document is already being processed.');
+      } else if (error.response?.status === 413) {
+        throw new Error('File is too large. Please upload a smaller document.');
+      }
+      throw error;
+    });
+  },
+
+  getDocumentVersions: (documentId) => {
+    return apiClient.get(`/documents/${documentId}/versions/`, {
+      headers: {
+        'X-CSRFTOKEN': getCSRFToken()
+      }
+    });
+  },
+
+  // Pre-flight token estimate for a generation request ({ kind: 'quiz' | 'flashcard' | 'mnemonic' | 'study_plan', ... })
+  estimateGeneration: (params) => {
+    return apiClient.post('/generate/estimate/', params, {
+      headers: {
+        'X-CSRFTOKEN': getCSRFToken()
+      }
+    })
+    .then(response => response.data);
+  },
+
   getDocuments: () => {
     console.log('Fetching documents from:', `${API_URL}/documents/`);
     
@@ -369,7 +578,8 @@ const apiService = {
       number_of_quizzes = 10,
       title = '',
       include_hints = true,
-      include_explanations = true
+      include_explanations = true,
+      onItem = null // Called with each quiz as soon as it is saved
     } = typeof options === 'object' ? options : { difficulty: options, number_of_quizzes: 10 };
     
     console.log(`Generating ${number_of_quizzes} ${difficulty} quizzes for document ${documentId}`);
@@ -410,9 +620,10 @@ const apiService = {
         'Accept': 'application/json'
       }
     })
-    .then(response => {
-      console.log('Quiz generation succeeded:', response.data);
-      return response.data;
+    .then(response => waitForGeneration(response.data.job_id, onItem))
+    .then(result => {
+      console.log('Quiz generation succeeded:', result);
+      return result;
     })
     .catch(error => {
       // Log detailed error information for debugging
@@ -670,7 +881,22 @@ const apiService = {
       throw error;
     });
   },
-  
+
+  // Tokens used per feature and per day over the last `days` days
+  getTokenUsageBreakdown: (days = 7) => {
+    return apiClient.get('/token-usage/breakdown/', {
+      params: { days },
+      headers: {
+        'X-CSRFTOKEN': getCSRFToken()
+      }
+    })
+    .then(response => response.data)
+    .catch(error => {
+      console.error('Token usage breakdown error:', error.response?.data || error.message);
+      throw error;
+    });
+  },
+
   getQuizHistory: async () => {
     try {
       // console.log('Fetching quiz history from:', `${API_URL}/quiz/history/`);
@@ -844,7 +1070,8 @@ const apiService = {
       // Default options
       const {
         count = 10,
-        difficulty = 'medium'
+        difficulty = 'medium',
+        onItem = null // Called with each flashcard as soon as it is saved
       } = options;
       
       console.log(`Generating ${count} flashcards for document ${documentId}`);
@@ -873,6 +1100,9 @@ const apiService = {
       if (!response.data) {
         throw new Error('No data received from flashcard generation');
       }
+      
+      // Flashcards are generated in the background; wait until they are saved
+      await waitForGeneration(response.data.job_id, onItem);
 
       // Clear the flashcards cache for this document after successful generation
       apiCache.clear('flashcards', documentId.toString());
@@ -1064,10 +1294,14 @@ const apiService = {
       
       console.log('Mnemonic generation response:', response.data);
       
+      // Mnemonics are generated in the background; wait until they are saved
+      // options.onItem is called with each mnemonic as soon as it is saved
+      const result = await waitForGeneration(response.data.job_id, options.onItem);
+      
       // Clear cache after successful generation
       apiCache.clear('mnemonics', documentId.toString());
       
-      return response.data;
+      return result;
     } catch (error) {
       console.error('Error generating mnemonics:', error);
       
@@ -1083,6 +1317,48 @@ const apiService = {
     }
   },
 
+  // Generate quizzes, flashcards and mnemonics for a document in one request
+  // The document is sent to the model once instead of once per kind
+  generateStudyPack: async (documentId, options = {}) => {
+    try {
+      const payload = {
+        document_id: parseInt(documentId, 10),
+        difficulty: options.difficulty || 'medium',
+        number_of_quizzes: options.numberOfQuizzes ?? 10,
+        number_of_flashcards: options.numberOfFlashcards ?? 10,
+        number_of_mnemonics: options.numberOfMnemonics ?? 5,
+        topics: options.topics || []
+      };
+
+      const response = await apiClient.post('/generate-study-pack/', payload, {
+        headers: {
+          'X-CSRFToken': getCSRFToken(),
+          'Content-Type': 'application/json'
+        }
+      });
+
+      // Resolves with quiz_ids, flashcard_ids and mnemonic_ids once everything is saved
+      const result = await waitForGenerationJob(response.data.job_id);
+
+      apiCache.clear('flashcards', documentId.toString());
+      apiCache.clear('mnemonics', documentId.toString());
+
+      return result;
+    } catch (error) {
+      console.error('Error generating study pack:', error);
+
+      if (error.response?.status === 403) {
+        throw new Error(error.response.data?.error || 'Token limit exceeded.');
+      } else if (error.response?.status === 404) {
+        throw new Error('Document not found. Please check if the document exists.');
+      } else if (error.response?.status === 400) {
+        throw new Error(error.response.data?.detail || 'Invalid request parameters.');
+      }
+
+      throw new Error(error.response?.data?.detail || 'Failed to generate study pack.');
+    }
+  },
+
   // Get mnemonics for a document
   getMnemonics: async (documentId) => {
     try {